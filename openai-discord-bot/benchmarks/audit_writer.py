@@ -0,0 +1,136 @@
+"""
+Compare writing CommandContext rows one commit at a time with the write-behind audit writer, under concurrent
+command handlers.
+
+    python benchmarks/audit_writer.py --handlers 200 --saves 20
+
+Each handler awaits CommandContext.save() --saves times. "direct" runs with the audit writer stopped, so every save is
+its own INSERT and commit; "write-behind" starts it, so saves only queue a row. The report shows rows and commits per
+second (until every row is on disk), save() latency as the handler sees it, and event-loop lag.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+from sqlmodel import select
+
+from load_test import BOT_DIR, LAG_SAMPLE_SECONDS, percentile, write_config
+
+MODES = ("direct", "write-behind")
+
+
+async def sample_lag(lags: List[float]) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + LAG_SAMPLE_SECONDS
+        await asyncio.sleep(LAG_SAMPLE_SECONDS)
+        lags.append(max(loop.time() - expected, 0.0))
+
+
+async def run_mode(db_utils: Any, mode: str, args: argparse.Namespace) -> Dict[str, Any]:
+    commits = 0
+
+    def count_commit(_: Any) -> None:
+        nonlocal commits
+        commits += 1
+
+    event.listen(Session, "after_commit", count_commit)
+    latencies: List[float] = []
+    lags: List[float] = []
+
+    async def handler(number: int) -> None:
+        for save in range(args.saves):
+            context = db_utils.CommandContext(
+                guild_id=number % 8, user_id=number, user=f"user-{number}", command_name="bench", params={"n": save}
+            )
+            start = time.perf_counter()
+            await context.save()
+            latencies.append(time.perf_counter() - start)
+            # the rest of the handler: a Discord or OpenAI call
+            await asyncio.sleep(args.work_ms / 1000)
+
+    async with db_utils.get_session() as session:
+        before = (await session.exec(select(func.count()).select_from(db_utils.CommandContext))).one()
+
+    if mode == "write-behind":
+        db_utils.audit_writer.start()
+
+    sampler = asyncio.create_task(sample_lag(lags))
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(handler(number) for number in range(args.handlers)))
+
+        # rows only count once they are committed: let the writer catch up, then flush whatever is left
+        while db_utils.audit_writer.task and (db_utils.audit_writer.queue.qsize() or db_utils.audit_writer.pending):
+            await asyncio.sleep(LAG_SAMPLE_SECONDS)
+        await db_utils.audit_writer.stop()
+        elapsed = time.perf_counter() - start
+    finally:
+        sampler.cancel()
+        event.remove(Session, "after_commit", count_commit)
+
+    async with db_utils.get_session() as session:
+        rows = (await session.exec(select(func.count()).select_from(db_utils.CommandContext))).one() - before
+
+    return {
+        "rows": rows,
+        "commits": commits,
+        "elapsed_seconds": elapsed,
+        "rows_per_second": rows / elapsed,
+        "commits_per_second": commits / elapsed,
+        "save_p50_ms": percentile(latencies, 0.50) * 1000,
+        "save_p99_ms": percentile(latencies, 0.99) * 1000,
+        "lag_p99_ms": percentile(lags, 0.99) * 1000,
+        "lag_max_ms": max(lags, default=0.0) * 1000,
+    }
+
+
+async def main_async(args: argparse.Namespace) -> Dict[str, Dict[str, Any]]:
+    # the bot resolves config.ini and database.db against the working directory
+    sys.path.insert(0, str(BOT_DIR / "src"))
+    import db_utils  # pylint: disable=import-outside-toplevel
+
+    await db_utils.init_db()
+    try:
+        return {mode: await run_mode(db_utils, mode, args) for mode in MODES}
+    finally:
+        await db_utils.engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--handlers", type=int, default=200, help="concurrent command handlers")
+    parser.add_argument("--saves", type=int, default=20, help="saves per handler")
+    parser.add_argument("--work-ms", type=float, default=20.0, help="time each handler spends elsewhere between saves")
+    args = parser.parse_args()
+
+    previous_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bot-audit-bench-") as workdir:
+        write_config(Path(workdir), keep_rate_limits=True)
+        os.chdir(workdir)
+        try:
+            report = asyncio.run(main_async(args))
+        finally:
+            os.chdir(previous_cwd)
+
+    print(f"\n{args.handlers} handlers x {args.saves} saves\n")
+    header = f"{'mode':<13} {'rows':>6} {'commits':>7} {'rows/s':>8} {'commits/s':>9} {'save p50':>9} {'save p99':>9}"
+    print(f"{header} {'lag p99':>8} {'lag max':>8}")
+    for mode, result in report.items():
+        print(
+            f"{mode:<13} {result['rows']:>6} {result['commits']:>7} {result['rows_per_second']:>8.0f} "
+            f"{result['commits_per_second']:>9.0f} {result['save_p50_ms']:>8.2f}ms {result['save_p99_ms']:>7.2f}ms "
+            f"{result['lag_p99_ms']:>6.1f}ms {result['lag_max_ms']:>6.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
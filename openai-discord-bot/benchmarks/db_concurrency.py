@@ -0,0 +1,216 @@
+"""
+Fire a burst of concurrent slash commands at the database layer and report p50/p99 command latency and event-loop
+lag, for the blocking SQLite sessions the bot used to run on the loop and for the async engine.
+
+    python benchmarks/db_concurrency.py --commands 150 --bursts 5
+
+Every command does what a /chat does against the database: log its context, look up the guild's API key, the
+user's credits and the previous response, wait --openai-ms for the model, then record the new response.
+
+- "sync" runs those queries through a plain SQLModel Session on the event loop, the way db_utils did before it
+  moved to aiosqlite, with SQLite's default settings.
+- "async" calls the db_utils helpers with their caches cleared and the audit writer stopped, so every query still
+  reaches the database.
+- "async+caches" is the bot as it ships: warm caches and the write-behind audit writer.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+from cryptography.fernet import Fernet
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import Session, create_engine, select
+
+from load_test import BOT_DIR, LAG_SAMPLE_SECONDS, percentile, write_config
+
+VARIANTS = ("sync", "async", "async+caches")
+TOPICS = ("normal", "adult", "games", "fitness")
+
+
+class SyncCommands:
+    """
+    The database side of a command as the bot ran it with blocking sessions.
+    """
+
+    def __init__(self, db_utils: Any, path: Path, openai_seconds: float) -> None:
+        self.db = db_utils
+        self.engine = create_engine(f"sqlite:///{path}")
+        self.openai_seconds = openai_seconds
+
+    async def run(self, context: Any) -> None:
+        db = self.db
+        guild_id, user_id, topic = context.guild_id, context.user_id, context.params["topic"]
+
+        with Session(self.engine) as session:
+            session.add(context)
+            session.commit()
+
+        with Session(self.engine) as session:
+            key = session.exec(select(db.Key).where(db.Key.guild_id == guild_id)).first()
+            db.get_cipher().decrypt(key.api_key.encode())
+
+        with Session(self.engine) as session:
+            session.exec(select(db.Credits).where(db.Credits.user_id == user_id)).one_or_none()
+
+        with Session(self.engine) as session:
+            statement = select(db.Chat).where(db.Chat.guild_id == guild_id).where(db.Chat.topic == topic)
+            session.exec(statement).one_or_none()
+
+        await asyncio.sleep(self.openai_seconds)
+
+        with Session(self.engine) as session:
+            statement = select(db.Chat).where(db.Chat.guild_id == guild_id).where(db.Chat.topic == topic)
+            record = session.exec(statement).one_or_none()
+            if record:
+                record.response_id = f"resp_{random.getrandbits(64):x}"
+                record.updated = datetime.now()
+                session.add(record)
+            else:
+                session.add(
+                    db.Chat(
+                        response_id=f"resp_{random.getrandbits(64):x}",
+                        topic=topic,
+                        guild_id=guild_id,
+                        updated=datetime.now(),
+                    )
+                )
+            session.commit()
+
+
+async def async_command(db: Any, context: Any, openai_seconds: float, cold: bool) -> None:
+    if cold:
+        db.chat_cache.clear()
+        db.invalidate_api_key()
+
+    await context.save()
+    await db.get_api_key(context.guild_id)
+    await db.get_user_credits(context.user_id)
+    await db.get_response_id(context)
+    await asyncio.sleep(openai_seconds)
+    await db.update_chat(f"resp_{random.getrandbits(64):x}", context, continued=True)
+
+
+async def seed(db: Any, args: argparse.Namespace) -> None:
+    cipher = db.get_cipher()
+    async with db.get_session() as session:
+        for guild_id in range(args.guilds):
+            api_key = cipher.encrypt(f"sk-bench-{guild_id}".encode()).decode()
+            session.add(db.Key(guild_id=guild_id, guild_name=f"guild-{guild_id}", api_key=api_key))
+        for user_id in range(args.users):
+            session.add(db.Credits(user_id=user_id, credits=100, updated=datetime.now()))
+        await session.commit()
+
+
+async def run_variant(db: Any, variant: str, workdir: Path, args: argparse.Namespace) -> Dict[str, Any]:
+    # a fresh database file per variant, since journal_mode=WAL sticks to the file
+    path = workdir / f"{variant}.db"
+    db.engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    if variant != "sync":
+        event.listen(db.engine.sync_engine, "connect", db._set_sqlite_pragmas)  # pylint: disable=protected-access
+
+    await db.init_db()
+    await seed(db, args)
+
+    sync_commands = SyncCommands(db, path, args.openai_ms / 1000)
+
+    async def command(context: Any) -> None:
+        if variant == "sync":
+            await sync_commands.run(context)
+        else:
+            await async_command(db, context, args.openai_ms / 1000, cold=variant == "async")
+
+    if variant == "async+caches":
+        db.audit_writer.start()
+
+    latencies: List[float] = []
+    lags: List[float] = []
+
+    async def one(number: int) -> None:
+        context = db.CommandContext(
+            guild_id=random.randrange(args.guilds),
+            user_id=random.randrange(args.users),
+            user="bench",
+            command_name="chat",
+            params={"topic": random.choice(TOPICS), "keep_chatting": "Yes"},
+        )
+        start = time.perf_counter()
+        await command(context)
+        latencies.append(time.perf_counter() - start)
+
+    async def sample_lag() -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + LAG_SAMPLE_SECONDS
+            await asyncio.sleep(LAG_SAMPLE_SECONDS)
+            lags.append(max(loop.time() - expected, 0.0))
+
+    sampler = asyncio.create_task(sample_lag())
+    try:
+        for burst in range(args.bursts):
+            await asyncio.gather(*(one(burst * args.commands + number) for number in range(args.commands)))
+    finally:
+        sampler.cancel()
+        await db.audit_writer.stop()
+        await db.engine.dispose()
+        sync_commands.engine.dispose()
+
+    return {
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies) * 1000,
+        "lag_p99_ms": percentile(lags, 0.99) * 1000,
+        "lag_max_ms": max(lags, default=0.0) * 1000,
+    }
+
+
+async def main_async(args: argparse.Namespace, workdir: Path) -> Dict[str, Dict[str, Any]]:
+    sys.path.insert(0, str(BOT_DIR / "src"))
+    import db_utils  # pylint: disable=import-outside-toplevel
+
+    # the module engine carries the pragma listener; each variant gets its own engine instead
+    await db_utils.engine.dispose()
+    return {variant: await run_variant(db_utils, variant, workdir, args) for variant in VARIANTS}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--commands", type=int, default=150, help="commands started at once")
+    parser.add_argument("--bursts", type=int, default=5, help="bursts, one after another")
+    parser.add_argument("--openai-ms", type=float, default=50.0, help="simulated model latency")
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    os.environ.setdefault("FERNET_KEY", Fernet.generate_key().decode())
+
+    previous_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bot-db-concurrency-") as workdir:
+        write_config(Path(workdir), keep_rate_limits=True)
+        os.chdir(workdir)
+        try:
+            report = asyncio.run(main_async(args, Path(workdir)))
+        finally:
+            os.chdir(previous_cwd)
+
+    print(f"\n{args.bursts} bursts of {args.commands} concurrent commands, {args.openai_ms:.0f} ms simulated OpenAI\n")
+    print(f"{'variant':<13} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'lag p99':>8} {'lag max':>8}")
+    for variant, result in report.items():
+        print(
+            f"{variant:<13} {result['p50_ms']:>8.0f} {result['p99_ms']:>8.0f} {result['max_ms']:>8.0f} "
+            f"{result['lag_p99_ms']:>8.1f} {result['lag_max_ms']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
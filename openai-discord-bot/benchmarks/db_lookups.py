@@ -0,0 +1,154 @@
+"""
+Time the database lookups every command makes, with and without the SQLite tuning (pragmas and the Chat
+(guild_id, topic) index).
+
+    python benchmarks/db_lookups.py --chats 50000 --calls 2000
+
+"untuned" opens the database without SQLITE_PRAGMAS and drops ix_chat_guild_id_topic, the way it was before either
+existed; "tuned" is the bot as it ships. The in-process caches are cleared before every call so each one reaches the
+database, and "get_api_key (cached)" shows what a warm key cache saves on top.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+
+from cryptography.fernet import Fernet
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from load_test import BOT_DIR, percentile, write_config
+
+VARIANTS = ("untuned", "tuned")
+TOPICS = ("normal", "adult", "games", "fitness", "chat")
+
+
+async def seed(db_utils: Any, args: argparse.Namespace) -> None:
+    cipher = db_utils.get_cipher()
+    async with db_utils.get_session() as session:
+        for guild_id in range(args.guilds):
+            api_key = cipher.encrypt(f"sk-bench-{guild_id}".encode()).decode()
+            session.add(db_utils.Key(guild_id=guild_id, guild_name=f"guild-{guild_id}", api_key=api_key))
+        for user_id in range(args.users):
+            session.add(db_utils.Credits(user_id=user_id, credits=100, updated=datetime.now()))
+        for number in range(args.chats):
+            session.add(
+                db_utils.Chat(
+                    response_id=f"resp_{number}",
+                    topic=f"{TOPICS[number % len(TOPICS)]}-{number}",
+                    guild_id=number % args.guilds,
+                    updated=datetime.now(),
+                )
+            )
+        await session.commit()
+
+
+async def time_calls(calls: int, func: Callable[[int], Awaitable[Any]], before: Callable[[], None]) -> List[float]:
+    timings = []
+    for number in range(calls):
+        before()
+        start = time.perf_counter()
+        await func(number)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+async def run_variant(db_utils: Any, variant: str, workdir: Path, args: argparse.Namespace) -> Dict[str, List[float]]:
+    # a fresh database file per variant, since journal_mode=WAL sticks to the file
+    db_utils.engine = create_async_engine(f"sqlite+aiosqlite:///{workdir / f'{variant}.db'}")
+    if variant == "tuned":
+        set_pragmas = db_utils._set_sqlite_pragmas  # pylint: disable=protected-access
+        db_utils.event.listen(db_utils.engine.sync_engine, "connect", set_pragmas)
+
+    await db_utils.init_db()
+    if variant == "untuned":
+        async with db_utils.engine.begin() as conn:
+            await conn.execute(text("DROP INDEX ix_chat_guild_id_topic"))
+    await seed(db_utils, args)
+
+    def context(number: int) -> Any:
+        guild_id = random.randrange(args.guilds)
+        topic = f"{TOPICS[number % len(TOPICS)]}-{random.randrange(args.chats)}"
+        return db_utils.CommandContext(
+            guild_id=guild_id,
+            user_id=number,
+            user="bench",
+            command_name="chat",
+            params={"topic": topic, "keep_chatting": "Yes"},
+        )
+
+    def clear_caches() -> None:
+        db_utils.chat_cache.clear()
+        db_utils.invalidate_api_key()
+
+    try:
+        return {
+            "get_response_id": await time_calls(
+                args.calls, lambda number: db_utils.get_response_id(context(number)), clear_caches
+            ),
+            "get_api_key": await time_calls(
+                args.calls, lambda number: db_utils.get_api_key(number % args.guilds), clear_caches
+            ),
+            "get_api_key (cached)": await time_calls(
+                args.calls, lambda number: db_utils.get_api_key(number % args.guilds), lambda: None
+            ),
+            "get_user_credits": await time_calls(
+                args.calls, lambda number: db_utils.get_user_credits(number % args.users), clear_caches
+            ),
+            "add_credits": await time_calls(
+                args.calls, lambda number: db_utils.add_credits(number % args.users, 1), clear_caches
+            ),
+        }
+    finally:
+        await db_utils.engine.dispose()
+
+
+async def main_async(args: argparse.Namespace, workdir: Path) -> Dict[str, Dict[str, List[float]]]:
+    sys.path.insert(0, str(BOT_DIR / "src"))
+    import db_utils  # pylint: disable=import-outside-toplevel
+
+    # the module engine carries the pragma listener; each variant gets its own engine instead
+    await db_utils.engine.dispose()
+    return {variant: await run_variant(db_utils, variant, workdir, args) for variant in VARIANTS}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=50000, help="Chat rows to seed")
+    parser.add_argument("--users", type=int, default=1000, help="Credits rows to seed")
+    parser.add_argument("--guilds", type=int, default=100, help="Key rows to seed")
+    parser.add_argument("--calls", type=int, default=2000, help="calls per lookup")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    os.environ.setdefault("FERNET_KEY", Fernet.generate_key().decode())
+
+    previous_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bot-db-bench-") as workdir:
+        write_config(Path(workdir), keep_rate_limits=True)
+        os.chdir(workdir)
+        try:
+            report = asyncio.run(main_async(args, Path(workdir)))
+        finally:
+            os.chdir(previous_cwd)
+
+    print(f"\n{args.calls} calls each, {args.chats} chats, {args.users} users, {args.guilds} guilds\n")
+    print(f"{'lookup':<22} " + " ".join(f"{f'{variant} p50':>13} {f'{variant} p99':>13}" for variant in VARIANTS))
+    for lookup in report[VARIANTS[0]]:
+        cells = []
+        for variant in VARIANTS:
+            timings = report[variant][lookup]
+            cells.append(f"{percentile(timings, 0.50) * 1e6:>11.0f}us {percentile(timings, 0.99) * 1e6:>11.0f}us")
+        print(f"{lookup:<22} " + " ".join(cells))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Just enough of discord.py's Interaction, channel, message and voice client surface to drive the command handlers
+"""
+
+import asyncio
+import io
+import itertools
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+import discord
+
+_snowflakes = itertools.count(1_000_000_000_000_000_000)
+
+
+def _files(fields: Dict[str, Any]) -> List[discord.File]:
+    files = []
+    for name in ("file", "files", "attachments"):
+        value = fields.get(name, discord.utils.MISSING)
+        if value is discord.utils.MISSING or value is None:
+            continue
+        files.extend(value if isinstance(value, list) else [value])
+    return [file for file in files if isinstance(file, discord.File)]
+
+
+class FakeREST:
+    """
+    Stands in for Discord's HTTP API: every call waits `latency_ms`, and attachments are read the way an upload would.
+    """
+
+    def __init__(self, latency_ms: float = 0.0) -> None:
+        self.latency = latency_ms / 1000
+        self.calls = 0
+        self.uploaded_bytes = 0
+
+    async def call(self, fields: Optional[Dict[str, Any]] = None) -> None:
+        self.calls += 1
+
+        for file in _files(fields or {}):
+            self.uploaded_bytes += len(await asyncio.to_thread(file.fp.read))
+            file.close()
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+
+class FakeMessage:
+    def __init__(self, channel: "FakeChannel", author: Any, **fields: Any) -> None:
+        self.id = next(_snowflakes)
+        self.channel = channel
+        self.author = author
+        self.created_at = discord.utils.utcnow()
+        self.content: Optional[str] = None
+        self.embeds: List[discord.Embed] = []
+        self.attachments: List[str] = []
+        self._apply(fields)
+
+    def _apply(self, fields: Dict[str, Any]) -> None:
+        if (content := fields.get("content", discord.utils.MISSING)) is not discord.utils.MISSING:
+            self.content = content
+        if (embed := fields.get("embed", discord.utils.MISSING)) is not discord.utils.MISSING:
+            self.embeds = [embed] if embed else []
+        if files := _files(fields):
+            self.attachments = [file.filename for file in files]
+
+    async def edit(self, **fields: Any) -> "FakeMessage":
+        await self.channel.rest.call(fields)
+        self._apply(fields)
+        return self
+
+    async def delete(self, *, delay: Optional[float] = None) -> None:
+        await self.channel.rest.call()
+        if self in self.channel.messages:
+            self.channel.messages.remove(self)
+
+
+class FakeChannel:
+    def __init__(self, guild: "FakeGuild", rest: FakeREST, bot_user: Any) -> None:
+        self.id = next(_snowflakes)
+        self.guild = guild
+        self.rest = rest
+        self.bot_user = bot_user
+        self.messages: List[FakeMessage] = []
+
+    async def send(self, **fields: Any) -> FakeMessage:
+        await self.rest.call(fields)
+        message = FakeMessage(self, self.bot_user, **fields)
+        self.messages.append(message)
+        return message
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int) -> None:
+        self.id = guild_id
+        self.name = f"guild-{guild_id}"
+        self.voice_client: Optional["FakeVoiceClient"] = None
+
+
+class FakeVoiceClient:
+    """
+    Plays an AudioSource the way discord.py's AudioPlayer does: one 20ms frame at a time, on its own thread, then
+    calls `after`. Sources built on ffmpeg need ffmpeg installed.
+    """
+
+    def __init__(self, guild: FakeGuild) -> None:
+        self.guild = guild
+        self.source: Optional[discord.AudioSource] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def is_playing(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def is_connected(self) -> bool:
+        return True
+
+    def play(self, source: discord.AudioSource, *, after: Optional[Callable[[Optional[Exception]], Any]] = None) -> None:
+        self.source = source
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._play, args=(source, after), daemon=True)
+        self._thread.start()
+
+    def _play(self, source: discord.AudioSource, after: Optional[Callable[[Optional[Exception]], Any]]) -> None:
+        error = None
+        start = time.perf_counter()
+        frames = 0
+
+        try:
+            while not self._stopped.is_set() and source.read():
+                frames += 1
+                time.sleep(max(start + frames * 0.02 - time.perf_counter(), 0))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            error = e
+        finally:
+            source.cleanup()
+
+        if after:
+            after(error)
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    async def disconnect(self, *, force: bool = False) -> None:
+        self.stop()
+
+
+class FakeInteractionResponse:
+    def __init__(self, interaction: "FakeInteraction") -> None:
+        self.interaction = interaction
+        self.message: Optional[FakeMessage] = None
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def defer(self, **_: Any) -> None:
+        await self.interaction.channel.rest.call()
+        self._done = True
+
+    async def send_message(self, content: Optional[str] = None, **fields: Any) -> None:
+        await self.interaction.channel.rest.call(fields)
+        self.message = FakeMessage(self.interaction.channel, self.interaction.bot_user, content=content, **fields)
+        self.interaction.channel.messages.append(self.message)
+        self._done = True
+
+
+class FakeFollowup:
+    def __init__(self, interaction: "FakeInteraction") -> None:
+        self.interaction = interaction
+
+    async def send(self, content: Any = discord.utils.MISSING, **fields: Any) -> FakeMessage:
+        return await self.interaction.channel.send(content=content, **fields)
+
+
+class FakeInteraction:
+    """
+    An application command interaction from `user` in `channel`, answered through FakeREST.
+    """
+
+    def __init__(self, command_name: str, guild: FakeGuild, channel: FakeChannel, user: Any, bot_user: Any) -> None:
+        self.id = next(_snowflakes)
+        self.guild = guild
+        self.guild_id = guild.id
+        self.channel = channel
+        self.channel_id = channel.id
+        self.user = user
+        self.bot_user = bot_user
+        self.command = SimpleNamespace(name=command_name, qualified_name=command_name)
+        self.extras: Dict[str, Any] = {}
+        self.response = FakeInteractionResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def original_response(self) -> FakeMessage:
+        return self.response.message
+
+    async def edit_original_response(self, **fields: Any) -> FakeMessage:
+        return await self.response.message.edit(**fields)
+
+
+class FakeAttachment:
+    """
+    An uploaded image for /vision.
+    """
+
+    def __init__(self, data: bytes, filename: str = "upload.png", content_type: str = "image/png") -> None:
+        self.data = data
+        self.filename = filename
+        self.content_type = content_type
+        self.size = len(data)
+        self.url = f"https://cdn.discordapp.test/attachments/{next(_snowflakes)}/{filename}"
+
+    async def read(self) -> bytes:
+        return self.data
+
+    async def to_file(self) -> discord.File:
+        return discord.File(fp=io.BytesIO(self.data), filename=self.filename)
+
+
+class FakeClient:
+    """
+    The parts of discord.Client the /video job queue uses to post results.
+    """
+
+    def __init__(self, channels: Dict[int, FakeChannel]) -> None:
+        self.channels = channels
+
+    async def wait_until_ready(self) -> None:
+        return None
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        return self.channels.get(channel_id)
+
+    async def fetch_channel(self, channel_id: int) -> FakeChannel:
+        return self.channels[channel_id]
@@ -0,0 +1,381 @@
+"""
+A local stand-in for the OpenAI endpoints the bot calls, with configurable latency and injected 429s
+"""
+
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import random
+import struct
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from aiohttp import web
+
+ENDPOINTS = ("responses", "speech", "images", "videos")
+
+SPEECH_SAMPLE_RATE = 24000
+STREAM_CHUNK_BYTES = 4800
+
+
+@dataclass
+class EndpointProfile:
+    """
+    How one endpoint behaves: time to first byte, its jitter, and the share of requests answered with a 429.
+    """
+
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+
+    async def wait(self) -> None:
+        delay = max(random.gauss(self.latency_ms, self.jitter_ms), 0.0) / 1000
+        if delay:
+            await asyncio.sleep(delay)
+
+    def rate_limited(self) -> bool:
+        return random.random() < self.error_rate
+
+
+def png_bytes(size_kb: int) -> bytes:
+    """
+    A valid grey PNG padded with an ancillary chunk to roughly `size_kb` kilobytes.
+    """
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 0, 0, 0, 0)
+    padding = chunk(b"peNd", random.randbytes(max(size_kb * 1024 - 70, 0)))
+    return b"".join(
+        (
+            b"\x89PNG\r\n\x1a\n",
+            chunk(b"IHDR", header),
+            padding,
+            chunk(b"IDAT", zlib.compress(b"\x00\x80")),
+            chunk(b"IEND", b""),
+        )
+    )
+
+
+def wav_header(data_bytes: int) -> bytes:
+    return (
+        b"RIFF"
+        + struct.pack("<I", 36 + data_bytes)
+        + b"WAVEfmt "
+        + struct.pack("<IHHIIHH", 16, 1, 1, SPEECH_SAMPLE_RATE, SPEECH_SAMPLE_RATE * 2, 2, 16)
+        + b"data"
+        + struct.pack("<I", data_bytes)
+    )
+
+
+class FakeOpenAI:
+    """
+    aiohttp application serving /v1/responses (plain and streamed), /v1/audio/speech, /v1/images/generations
+    (plain and streamed) and /v1/videos. Point the bot at it with OPENAI_BASE_URL=http://host:port/v1.
+    """
+
+    def __init__(
+        self,
+        profiles: Optional[Dict[str, EndpointProfile]] = None,
+        stream_interval_ms: float = 20.0,
+        image_kb: int = 256,
+        video_render_seconds: float = 1.0,
+    ) -> None:
+        self.profiles = {name: EndpointProfile() for name in ENDPOINTS}
+        self.profiles.update(profiles or {})
+        self.stream_interval = stream_interval_ms / 1000
+        self.image_b64 = base64.b64encode(png_bytes(image_kb)).decode()
+        self.video_render_seconds = video_render_seconds
+        self.videos: Dict[str, dict] = {}
+        self.requests: Dict[str, int] = {name: 0 for name in ENDPOINTS}
+        self.rate_limited: Dict[str, int] = {name: 0 for name in ENDPOINTS}
+        self._ids = itertools.count(1)
+        self.runner: Optional[web.AppRunner] = None
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/responses", self.responses)
+        app.router.add_post("/v1/audio/speech", self.speech)
+        app.router.add_post("/v1/images/generations", self.images)
+        app.router.add_post("/v1/videos", self.create_video)
+        app.router.add_get("/v1/videos", self.list_videos)
+        app.router.add_get("/v1/videos/{video_id}", self.retrieve_video)
+        app.router.add_get("/v1/videos/{video_id}/content", self.video_content)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Serve in the running loop and return the base URL (port 0 picks a free one).
+        """
+        self.runner = web.AppRunner(self.app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        bound_port = self.runner.addresses[0][1]
+        return f"http://{host}:{bound_port}/v1"
+
+    async def stop(self) -> None:
+        if self.runner:
+            await self.runner.cleanup()
+
+    def _id(self, prefix: str) -> str:
+        return f"{prefix}_{next(self._ids):08d}"
+
+    async def _begin(self, endpoint: str) -> Optional[web.Response]:
+        """
+        Count the request, wait out its latency, and return a 429 if one is injected.
+        """
+        self.requests[endpoint] += 1
+        profile = self.profiles[endpoint]
+        await profile.wait()
+
+        if profile.rate_limited():
+            self.rate_limited[endpoint] += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                status=429,
+                headers={"retry-after-ms": "200", "x-ratelimit-remaining-requests": "0"},
+            )
+
+        return None
+
+    @staticmethod
+    async def _sse(request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        return response
+
+    @staticmethod
+    async def _event(response: web.StreamResponse, payload: dict) -> None:
+        await response.write(f"event: {payload['type']}\ndata: {json.dumps(payload)}\n\n".encode())
+
+    async def responses(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        if error := await self._begin("responses"):
+            return error
+
+        words = [f"word{number}" for number in range(min(int(body.get("max_output_tokens") or 60), 60))]
+        response_id = self._id("resp")
+        message_id = self._id("msg")
+
+        def response_object(text: str) -> dict:
+            return {
+                "id": response_id,
+                "object": "response",
+                "created_at": int(time.time()),
+                "model": body.get("model"),
+                "status": "completed",
+                "previous_response_id": body.get("previous_response_id"),
+                "instructions": body.get("instructions"),
+                "output": [
+                    {
+                        "type": "message",
+                        "id": message_id,
+                        "role": "assistant",
+                        "status": "completed",
+                        "content": [{"type": "output_text", "text": text, "annotations": []}],
+                    }
+                ],
+                "parallel_tool_calls": True,
+                "tool_choice": "auto",
+                "tools": [],
+            }
+
+        if not body.get("stream"):
+            return web.json_response(response_object(" ".join(words)))
+
+        response = await self._sse(request)
+        for sequence, word in enumerate(words):
+            await self._event(
+                response,
+                {
+                    "type": "response.output_text.delta",
+                    "item_id": message_id,
+                    "output_index": 0,
+                    "content_index": 0,
+                    "delta": word if sequence == 0 else f" {word}",
+                    "logprobs": [],
+                    "sequence_number": sequence,
+                },
+            )
+            await asyncio.sleep(self.stream_interval)
+
+        await self._event(
+            response,
+            {"type": "response.completed", "response": response_object(" ".join(words)), "sequence_number": len(words)},
+        )
+        await response.write_eof()
+        return response
+
+    async def speech(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        if error := await self._begin("speech"):
+            return error
+
+        # roughly a third of a second of audio per word
+        seconds = max(len(body.get("input", "").split()) / 3, 0.5)
+        audio_bytes = int(seconds * SPEECH_SAMPLE_RATE) * 2
+        response_format = body.get("response_format", "mp3")
+
+        response = web.StreamResponse(headers={"Content-Type": "application/octet-stream"})
+        await response.prepare(request)
+
+        if response_format == "wav":
+            await response.write(wav_header(audio_bytes))
+
+        silence = bytes(STREAM_CHUNK_BYTES)
+        for start in range(0, audio_bytes, STREAM_CHUNK_BYTES):
+            await response.write(silence[: min(STREAM_CHUNK_BYTES, audio_bytes - start)])
+            await asyncio.sleep(self.stream_interval)
+
+        await response.write_eof()
+        return response
+
+    async def images(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        if error := await self._begin("images"):
+            return error
+
+        created = int(time.time())
+        count = int(body.get("n") or 1)
+
+        if not body.get("stream"):
+            data = [{"b64_json": self.image_b64, "revised_prompt": body.get("prompt")} for _ in range(count)]
+            return web.json_response({"created": created, "data": data})
+
+        common = {
+            "b64_json": self.image_b64,
+            "background": "opaque",
+            "created_at": created,
+            "output_format": "png",
+            "quality": "medium",
+            "size": "1024x1024",
+        }
+        response = await self._sse(request)
+        for index in range(int(body.get("partial_images") or 0)):
+            await self._event(response, {"type": "image_generation.partial_image", "partial_image_index": index, **common})
+            await asyncio.sleep(self.stream_interval)
+
+        usage = {
+            "input_tokens": 10,
+            "output_tokens": 100,
+            "total_tokens": 110,
+            "input_tokens_details": {"image_tokens": 0, "text_tokens": 10},
+        }
+        await self._event(response, {"type": "image_generation.completed", "usage": usage, **common})
+        await response.write_eof()
+        return response
+
+    def _video_object(self, video: dict) -> dict:
+        done = time.monotonic() - video["started"] >= self.video_render_seconds
+        return {
+            "id": video["id"],
+            "object": "video",
+            "model": video["model"],
+            "prompt": video["prompt"],
+            "status": "completed" if done else "in_progress",
+            "progress": 100 if done else 50,
+            "created_at": video["created_at"],
+            "seconds": video["seconds"],
+            "size": video["size"],
+        }
+
+    async def create_video(self, request: web.Request) -> web.Response:
+        if request.content_type == "application/json":
+            body = await request.json()
+        else:
+            body = dict(await request.post())
+        if error := await self._begin("videos"):
+            return error
+
+        video = {
+            "id": self._id("video"),
+            "model": body.get("model", "sora-2"),
+            "prompt": body.get("prompt"),
+            "seconds": str(body.get("seconds", "4")),
+            "size": body.get("size", "1280x720"),
+            "created_at": int(time.time()),
+            "started": time.monotonic(),
+        }
+        self.videos[video["id"]] = video
+        return web.json_response({**self._video_object(video), "status": "queued", "progress": 0})
+
+    async def list_videos(self, request: web.Request) -> web.Response:
+        if error := await self._begin("videos"):
+            return error
+
+        limit = int(request.query.get("limit", 20))
+        videos = sorted(self.videos.values(), key=lambda video: video["started"], reverse=True)[:limit]
+        data = [self._video_object(video) for video in videos]
+        return web.json_response(
+            {
+                "object": "list",
+                "data": data,
+                "first_id": data[0]["id"] if data else None,
+                "last_id": data[-1]["id"] if data else None,
+                "has_more": False,
+            }
+        )
+
+    async def retrieve_video(self, request: web.Request) -> web.Response:
+        if error := await self._begin("videos"):
+            return error
+
+        video = self.videos.get(request.match_info["video_id"])
+        if video is None:
+            return web.json_response({"error": {"message": "No such video", "type": "invalid_request_error"}}, status=404)
+        return web.json_response(self._video_object(video))
+
+    async def video_content(self, request: web.Request) -> web.Response:
+        if error := await self._begin("videos"):
+            return error
+        return web.Response(body=bytes(512 * 1024), content_type="video/mp4")
+
+
+def parse_profiles(latency: str = "", jitter: str = "", error_rate: str = "") -> Dict[str, EndpointProfile]:
+    """
+    Build profiles from "responses=800,images=3000" style options. A bare number applies to every endpoint.
+    """
+
+    def parse(option: str) -> Dict[str, float]:
+        values: Dict[str, float] = {}
+        for part in filter(None, (part.strip() for part in option.split(","))):
+            if "=" in part:
+                name, value = part.split("=", 1)
+                if name not in ENDPOINTS:
+                    raise ValueError(f"Unknown endpoint {name!r}, expected one of {', '.join(ENDPOINTS)}")
+                values[name] = float(value)
+            else:
+                values.update({name: float(part) for name in ENDPOINTS})
+        return values
+
+    latencies, jitters, error_rates = parse(latency), parse(jitter), parse(error_rate)
+    return {
+        name: EndpointProfile(
+            latency_ms=latencies.get(name, 0.0), jitter_ms=jitters.get(name, 0.0), error_rate=error_rates.get(name, 0.0)
+        )
+        for name in ENDPOINTS
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", default="", help='milliseconds, e.g. "responses=800,images=3000"')
+    parser.add_argument("--jitter", default="", help="milliseconds of gaussian jitter, same format")
+    parser.add_argument("--error-rate", default="", help="share of requests answered with a 429, same format")
+    parser.add_argument("--image-kb", type=int, default=256)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(profiles=parse_profiles(args.latency, args.jitter, args.error_rate), image_kb=args.image_kb)
+    web.run_app(fake.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
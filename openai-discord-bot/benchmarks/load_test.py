@@ -0,0 +1,394 @@
+"""
+Replay mixed slash-command traffic against a stub OpenAI server and report throughput, latency and event-loop lag
+per command.
+
+    python benchmarks/load_test.py --qps 20 --duration 30 --mix chat=4,rather=2,say=2,image=2,video=1,vision=1
+
+The bot runs in-process from a scratch directory holding its own config.ini, database.db and generated_content/.
+Command callbacks are awaited directly with fake interactions, so no Discord connection or OpenAI key is needed.
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from configparser import ConfigParser
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from cryptography.fernet import Fernet
+
+from fake_discord import (
+    FakeAttachment,
+    FakeChannel,
+    FakeClient,
+    FakeGuild,
+    FakeInteraction,
+    FakeREST,
+    FakeVoiceClient,
+)
+from fake_openai import FakeOpenAI, parse_profiles, png_bytes
+
+BOT_DIR = Path(__file__).resolve().parent.parent
+
+LAG_SAMPLE_SECONDS = 0.005
+
+RATHER_TOPICS = ("normal", "adult", "games", "fitness")
+
+# keyword arguments for each command's callback, given the request number
+COMMAND_ARGUMENTS: Dict[str, Callable[[int], Dict[str, Any]]] = {
+    "chat": lambda number: {
+        "prompt": f"Load test question {number}: what is worth knowing about the number {number}?",
+        "keep_chatting": random.choice(("Yes", "No")),
+    },
+    "rather": lambda number: {"topic": RATHER_TOPICS[number % len(RATHER_TOPICS)]},
+    "say": lambda number: {"text_to_speech": f"This is load test line number {number}, spoken out loud."},
+    "image": lambda number: {"prompt": f"A lighthouse at dusk, variation {number}", "model": "gpt-image-1-mini"},
+    "video": lambda number: {"prompt": f"A paper boat drifting down a gutter, take {number}", "ai_director": True},
+    "vision": lambda number: {
+        "attachment": FakeAttachment(png_bytes(64), filename=f"upload-{number}.png"),
+        "vision_prompt": f"Describe upload {number}.",
+    },
+}
+
+
+@dataclass
+class CommandStats:
+    latencies: List[float] = field(default_factory=list)
+    lags: List[float] = field(default_factory=list)
+    errors: Dict[str, int] = field(default_factory=dict)
+    in_flight: int = 0
+
+
+@dataclass
+class SimpleUser:
+    id: int
+    name: str
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+
+def percentile(values: List[float], share: float) -> float:
+    """
+    Nearest-rank percentile, 0 for an empty list.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(share * len(ordered)), len(ordered) - 1)]
+
+
+def parse_mix(option: str) -> Dict[str, float]:
+    mix = {}
+    for part in filter(None, (part.strip() for part in option.split(","))):
+        name, _, weight = part.partition("=")
+        if name not in COMMAND_ARGUMENTS:
+            raise ValueError(f"Unknown command {name!r}, expected one of {', '.join(COMMAND_ARGUMENTS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def write_config(workdir: Path, keep_rate_limits: bool) -> None:
+    """
+    Copy config.ini into the scratch directory with fast video polling and no metrics server.
+    """
+    config = ConfigParser(interpolation=None)
+    config.optionxform = str
+    config.read(BOT_DIR / "config.ini")
+
+    config["GENERAL"]["video_poll_seconds"] = "0.5"
+    config["GENERAL"]["video_poll_max_seconds"] = "1"
+    config["METRICS"]["enabled"] = "false"
+    config["STORAGE"]["backend"] = "local"
+
+    if not keep_rate_limits:
+        config["OPENAI_MODEL_LIMITS"] = {}
+
+    with open(workdir / "config.ini", "w", encoding="UTF-8") as config_file:
+        config.write(config_file)
+
+
+class LoadTest:
+    """
+    Drives the bot's command callbacks at a fixed arrival rate and samples event-loop lag while they run.
+    """
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.mix = parse_mix(args.mix)
+        self.stats: Dict[str, CommandStats] = {name: CommandStats() for name in self.mix}
+        self.lags: List[float] = []
+        self.rest = FakeREST(latency_ms=args.discord_latency_ms)
+        self.fake_openai = FakeOpenAI(
+            profiles=parse_profiles(args.latency, args.jitter, args.error_rate),
+            stream_interval_ms=args.stream_interval_ms,
+            image_kb=args.image_kb,
+            video_render_seconds=args.video_render_seconds,
+        )
+        self.guilds: List[FakeGuild] = []
+        self.channels: Dict[int, FakeChannel] = {}
+        self.users: List[Any] = []
+        self.bot_user: Any = None
+        self.app: Any = None
+        self.video_jobs_pending = 0
+
+    async def setup(self, base_url: str) -> None:
+        os.environ["OPENAI_BASE_URL"] = base_url
+        os.environ.setdefault("FERNET_KEY", Fernet.generate_key().decode())
+        os.environ.setdefault("OPENAI_API_KEY", "sk-load-test")
+
+        # the bot resolves config.ini, database.db and generated_content/ against the working directory
+        sys.path.insert(0, str(BOT_DIR / "src"))
+        self.app = importlib.import_module("app")
+
+        # pylint: disable=import-outside-toplevel
+        import db_utils
+        from storage import storage
+        from video_jobs import VideoJobQueue
+
+        await db_utils.init_db()
+
+        cipher = db_utils.get_cipher()
+        async with db_utils.get_session() as session:
+            for guild_id in range(self.args.guilds + 1):
+                api_key = cipher.encrypt(f"sk-load-test-{guild_id}".encode()).decode()
+                session.add(db_utils.Key(guild_id=guild_id, guild_name=f"guild-{guild_id}", api_key=api_key))
+            await session.commit()
+
+        self.bot_user = SimpleUser(id=1, name="bot")
+        for guild_id in range(1, self.args.guilds + 1):
+            guild = FakeGuild(guild_id)
+            channel = FakeChannel(guild, self.rest, self.bot_user)
+            self.guilds.append(guild)
+            self.channels[channel.id] = channel
+
+            if self.args.voice:
+                guild.voice_client = FakeVoiceClient(guild)
+                self.app.bot._connection._add_voice_client(guild_id, guild.voice_client)  # pylint: disable=W0212
+
+        for user_id in range(100, 100 + self.args.users):
+            self.users.append(SimpleUser(id=user_id, name=f"user-{user_id}"))
+            await db_utils.add_credits(user_id=user_id, num_credits=10**9)
+
+        db_utils.audit_writer.start()
+        await storage.start()
+        self.app.video_queue = VideoJobQueue(FakeClient(self.channels))
+        await self.app.video_queue.start()
+
+    async def teardown(self) -> None:
+        # pylint: disable=import-outside-toplevel
+        import db_utils
+        from ai_helpers import close_openai_clients
+        from storage import storage
+
+        await self.app.video_queue.stop()
+        await storage.stop()
+        await db_utils.audit_writer.stop()
+        await close_openai_clients()
+        await db_utils.engine.dispose()
+
+    async def sample_lag(self) -> None:
+        """
+        Measure how late a short sleep wakes up, and charge it to every command running at the time.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + LAG_SAMPLE_SECONDS
+            await asyncio.sleep(LAG_SAMPLE_SECONDS)
+            lag = max(loop.time() - expected, 0.0)
+
+            self.lags.append(lag)
+            for stats in self.stats.values():
+                if stats.in_flight:
+                    stats.lags.append(lag)
+
+    async def run_one(self, name: str, number: int) -> None:
+        guild = random.choice(self.guilds)
+        channel = next(channel for channel in self.channels.values() if channel.guild is guild)
+        interaction = FakeInteraction(name, guild, channel, random.choice(self.users), self.bot_user)
+        command = getattr(self.app, name)
+        stats = self.stats[name]
+
+        # named the way the bot's command tree names command tasks, for the loop monitor
+        asyncio.current_task().set_name(f"command:{name}")
+
+        stats.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await command.callback(interaction, **COMMAND_ARGUMENTS[name](number))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            error = type(e).__name__
+            stats.errors[error] = stats.errors.get(error, 0) + 1
+            if self.args.verbose:
+                logging.exception("%s #%s failed", name, number)
+        finally:
+            stats.latencies.append(time.perf_counter() - start)
+            stats.in_flight -= 1
+
+    async def replay(self) -> float:
+        """
+        Start commands at --qps until --duration or --requests runs out, then wait for them all to finish.
+        """
+        names, weights = list(self.mix), list(self.mix.values())
+        interval = 1 / self.args.qps
+        loop = asyncio.get_running_loop()
+        tasks = []
+
+        start = loop.time()
+        number = 0
+        while loop.time() - start < self.args.duration and (not self.args.requests or number < self.args.requests):
+            name = random.choices(names, weights)[0]
+            tasks.append(asyncio.create_task(self.run_one(name, number)))
+            number += 1
+            await asyncio.sleep(max(start + number * interval - loop.time(), 0))
+
+        await asyncio.gather(*tasks)
+        elapsed = loop.time() - start
+
+        # /video only queues a job; give the workers a chance to post the results
+        try:
+            await asyncio.wait_for(self.app.video_queue.queue.join(), timeout=self.args.drain_seconds)
+        except asyncio.TimeoutError:
+            pass
+        self.video_jobs_pending = self.app.video_queue.queue.qsize()
+
+        return elapsed
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        commands = {}
+        for name, stats in self.stats.items():
+            commands[name] = {
+                "count": len(stats.latencies),
+                "errors": stats.errors,
+                "throughput": len(stats.latencies) / elapsed,
+                "p50_ms": percentile(stats.latencies, 0.50) * 1000,
+                "p95_ms": percentile(stats.latencies, 0.95) * 1000,
+                "p99_ms": percentile(stats.latencies, 0.99) * 1000,
+                "lag_p99_ms": percentile(stats.lags, 0.99) * 1000,
+                "lag_max_ms": max(stats.lags, default=0.0) * 1000,
+            }
+
+        total = sum(command["count"] for command in commands.values())
+        return {
+            "elapsed_seconds": elapsed,
+            "requests": total,
+            "throughput": total / elapsed,
+            "commands": commands,
+            "loop_lag": {
+                "p50_ms": percentile(self.lags, 0.50) * 1000,
+                "p99_ms": percentile(self.lags, 0.99) * 1000,
+                "max_ms": max(self.lags, default=0.0) * 1000,
+            },
+            "openai_requests": self.fake_openai.requests,
+            "openai_rate_limited": self.fake_openai.rate_limited,
+            "discord_calls": self.rest.calls,
+            "discord_uploaded_mb": self.rest.uploaded_bytes / 1024 / 1024,
+            "video_jobs_pending": self.video_jobs_pending,
+        }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(
+        f"\n{report['requests']} commands in {report['elapsed_seconds']:.1f}s ({report['throughput']:.1f}/s), "
+        f"{report['discord_calls']} Discord calls, {report['discord_uploaded_mb']:.1f} MB uploaded\n"
+    )
+    header = f"{'command':<8} {'count':>6} {'errors':>6} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    print(f"{header} {'lag p99':>8} {'lag max':>8}")
+    for name, command in report["commands"].items():
+        print(
+            f"{name:<8} {command['count']:>6} {sum(command['errors'].values()):>6} {command['throughput']:>7.2f} "
+            f"{command['p50_ms']:>8.0f} {command['p95_ms']:>8.0f} {command['p99_ms']:>8.0f} "
+            f"{command['lag_p99_ms']:>8.1f} {command['lag_max_ms']:>8.1f}"
+        )
+        for error, count in command["errors"].items():
+            print(f"{'':<8} {count:>6} x {error}")
+
+    lag = report["loop_lag"]
+    print(f"\nevent loop lag: p50 {lag['p50_ms']:.1f} ms, p99 {lag['p99_ms']:.1f} ms, max {lag['max_ms']:.1f} ms")
+    print(f"OpenAI requests: {report['openai_requests']}, answered 429: {report['openai_rate_limited']}")
+    if report["video_jobs_pending"]:
+        print(f"{report['video_jobs_pending']} video jobs still queued at exit")
+
+
+async def main_async(args: argparse.Namespace) -> Dict[str, Any]:
+    load_test = LoadTest(args)
+    base_url = await load_test.fake_openai.start()
+
+    try:
+        await load_test.setup(base_url)
+        sampler = asyncio.create_task(load_test.sample_lag())
+        try:
+            elapsed = await load_test.replay()
+        finally:
+            sampler.cancel()
+            await load_test.teardown()
+    finally:
+        await load_test.fake_openai.stop()
+
+    return load_test.report(elapsed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--qps", type=float, default=10.0, help="commands started per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of traffic")
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many commands (0 = no limit)")
+    parser.add_argument("--mix", default="chat=4,rather=2,say=2,image=2,video=1,vision=1", help="command weights")
+    parser.add_argument("--guilds", type=int, default=4)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--latency", default="responses=300,speech=200,images=1500,videos=100", help="OpenAI ms")
+    parser.add_argument("--jitter", default="50", help="gaussian jitter in ms, same format as --latency")
+    parser.add_argument("--error-rate", default="0", help="share of OpenAI requests answered 429")
+    parser.add_argument("--stream-interval-ms", type=float, default=20.0, help="gap between streamed chunks")
+    parser.add_argument("--image-kb", type=int, default=256)
+    parser.add_argument("--video-render-seconds", type=float, default=2.0)
+    parser.add_argument("--discord-latency-ms", type=float, default=0.0, help="delay added to every Discord call")
+    parser.add_argument("--drain-seconds", type=float, default=30.0, help="how long to wait for queued videos")
+    parser.add_argument("--voice", action="store_true", help="attach fake voice clients (needs ffmpeg)")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="keep [OPENAI_MODEL_LIMITS]")
+    parser.add_argument("--workdir", type=Path, help="scratch directory to keep (default: a temporary one)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="also write the report here")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.voice and not shutil.which("ffmpeg"):
+        parser.error("--voice needs ffmpeg on the PATH")
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    random.seed(args.seed)
+
+    workdir: Optional[Path] = args.workdir
+    scratch = None
+    if workdir is None:
+        scratch = tempfile.TemporaryDirectory(prefix="bot-load-test-")  # pylint: disable=consider-using-with
+        workdir = Path(scratch.name)
+    workdir.mkdir(parents=True, exist_ok=True)
+    write_config(workdir, keep_rate_limits=args.keep_rate_limits)
+
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        report = asyncio.run(main_async(args))
+    finally:
+        os.chdir(previous_cwd)
+        if scratch:
+            scratch.cleanup()
+
+    print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2), encoding="UTF-8")
+
+
+if __name__ == "__main__":
+    main()
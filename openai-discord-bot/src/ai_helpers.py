@@ -2,46 +2,91 @@
 Helper functions that interact with OpenAI
 """
 
-from configparser import ConfigParser
-from datetime import datetime
+import asyncio
+import base64
+import contextlib
+import functools
+import io
+import itertools
+import logging
+import queue
+import time
+import wave
 from pathlib import Path
-from typing import Optional, Tuple
-from urllib.request import Request, urlopen
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple, TypeVar
 
-from discord import Embed
-from openai import AsyncOpenAI
-from openai.types.responses import Response
+import discord
+from discord import Embed, FFmpegOpusAudio, FFmpegPCMAudio
+from openai import APIError, AsyncOpenAI, AsyncStream
+from openai.types import Image, ImageGenStreamEvent, ImagesResponse
+from openai.types.responses import Response, ResponseStreamEvent
 
-from db_utils import CommandContext, get_api_key, get_response_id, update_chat
+from db_utils import CommandContext, get_api_key, get_response_id, invalidate_api_key, update_chat
+from metrics import OPENAI_HEDGES, OPENAI_RETRIES, observe_openai
+from rate_limits import QueuedCallback, rate_limiter
+from resilience import breaker_for, hedged, retry_delay, retry_reason
+from settings import get_settings
+from speech_cache import speech_cache
 
+logger = logging.getLogger(__name__)
 
-def get_config():
-    """
-    Read the configuration specified in the config ini
-    """
-    config = ConfigParser()
-    config.read("config.ini")
-    return config
+T = TypeVar("T")
 
+_openai_clients: Dict[str, AsyncOpenAI] = {}  # one pooled client per API key
+_guild_api_keys: Dict[int, str] = {}  # guild_id -> the API key its client was last built for
+_retiring_clients: Dict[asyncio.Task, AsyncOpenAI] = {}  # clients for replaced keys, closed after a grace period
 
-def download_file_from_url(url: str, filename: str, headers: dict = None) -> None:
-    """
-    Downloads a file from the given URL and saves it to the specified filename.
-    Optionally accepts headers for the request.
-    """
+# how long a client keeps serving requests that started before its key was replaced
+RETIRED_CLIENT_GRACE_SECONDS = 600
+_playback_tasks: Set[asyncio.Task] = set()  # keeps background voice playback alive until it finishes
 
-    req = Request(url=url, headers=headers or {})
-    with urlopen(req) as response:
-        data = response.read()
-        with open(filename, "wb") as f:
-            f.write(data)
+# the Speech API's "pcm" format is raw 24kHz, 16-bit, mono, little-endian audio
+PCM_SAMPLE_RATE = 24000
+PCM_CHUNK_BYTES = 4800  # 100ms of audio
 
+EMBED_DESCRIPTION_LIMIT = 4096
 
-def has_enough_credits(user_credits: int, deduction: int) -> bool:
+
+class SingleFlight:
     """
-    Check to see if the user has enough credits to use the model
+    Collapses concurrent identical OpenAI calls into one.
+
+    Callers passing the same key while a call is running await that call instead of starting another, and get its
+    result or its error. Nothing is kept once the call finishes, so a later request always gets a fresh call. Credits
+    are not handled here; each caller still reserves and settles its own.
     """
-    return user_credits - deduction >= 0
+
+    def __init__(self) -> None:
+        self.calls: Dict[Hashable, asyncio.Task] = {}
+
+    @staticmethod
+    def key(*parts: Any) -> Tuple[Any, ...]:
+        """
+        Build a key from request parameters, ignoring differences in whitespace.
+        """
+        return tuple(" ".join(part.split()) if isinstance(part, str) else part for part in parts)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Return func()'s result, sharing it with every concurrent caller of the same key.
+        """
+        task = self.calls.get(key)
+        if task is None:
+            task = self.calls[key] = asyncio.create_task(func())
+            task.add_done_callback(functools.partial(self._finished, key))
+
+        # one caller being cancelled must not cancel the call for everyone else
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task) -> None:
+        del self.calls[key]
+
+        # every waiter may have been cancelled; fetch the error so asyncio does not report it as never retrieved
+        if not task.cancelled():
+            task.exception()
+
+
+single_flight = SingleFlight()
 
 
 def construct_error_embed(
@@ -69,14 +114,138 @@ def construct_error_embed(
 
 async def get_openai_client(guild_id: int) -> AsyncOpenAI:
     """
-    Return the guild-assigned API key
+    Return the pooled client for the guild-assigned API key
+
+    When a guild's key has changed, the client for its old key is retired unless another guild still uses that key.
     """
     api_key = await get_api_key(guild_id=guild_id)
-    openai_client = AsyncOpenAI(api_key=api_key)
+    _use_api_key(guild_id, api_key)
+
+    openai_client = _openai_clients.get(api_key)
+    if openai_client is None:
+        # retries happen in call_openai(), where they can see the circuit breakers and rate limiter
+        openai_client = AsyncOpenAI(api_key=api_key, max_retries=0)
+        _openai_clients[api_key] = openai_client
 
     return openai_client
 
 
+def _use_api_key(guild_id: int, api_key: str) -> None:
+    previous = _guild_api_keys.get(guild_id)
+    _guild_api_keys[guild_id] = api_key
+
+    if previous is not None and previous != api_key:
+        _retire_client(previous)
+
+
+def _retire_client(api_key: str) -> None:
+    """
+    Stop handing out the client for a key no guild uses any more, and close it after RETIRED_CLIENT_GRACE_SECONDS.
+    """
+    if api_key in _guild_api_keys.values() or (openai_client := _openai_clients.pop(api_key, None)) is None:
+        return
+
+    task = asyncio.create_task(_close_later(openai_client), name="retire-openai-client")
+    _retiring_clients[task] = openai_client
+    task.add_done_callback(lambda done: _retiring_clients.pop(done, None))
+
+
+async def _close_later(openai_client: AsyncOpenAI) -> None:
+    await asyncio.sleep(RETIRED_CLIENT_GRACE_SECONDS)
+    await openai_client.close()
+
+
+async def refresh_openai_clients() -> Tuple[int, List[int]]:
+    """
+    Re-read every guild's API key from the database, e.g. after `python db_utils.py` loaded new ones, and retire the
+    clients of keys that were replaced. Returns how many clients were retired and the guilds whose key is now missing.
+    """
+    invalidate_api_key()
+    before = len(_openai_clients)
+    missing = []
+
+    for guild_id in list(_guild_api_keys):
+        try:
+            _use_api_key(guild_id, await get_api_key(guild_id=guild_id))
+        except ValueError:
+            missing.append(guild_id)
+            _retire_client(_guild_api_keys.pop(guild_id))
+
+    return before - len(_openai_clients), missing
+
+
+async def close_openai_clients() -> None:
+    """
+    Close every pooled OpenAI client and its keep-alive connections, including retired ones.
+    """
+    clients = [*_openai_clients.values(), *_retiring_clients.values()]
+    _openai_clients.clear()
+    _guild_api_keys.clear()
+
+    retiring = list(_retiring_clients)
+    for task in retiring:
+        task.cancel()
+    await asyncio.gather(*retiring, return_exceptions=True)
+
+    for openai_client in clients:
+        await openai_client.close()
+
+
+async def call_openai(
+    call: str,
+    model: str,
+    guild_id: int,
+    request: Callable[[], Awaitable[T]],
+    limit: bool = True,
+    hedge: bool = False,
+    idempotent: bool = True,
+    committed: Optional[Callable[[], bool]] = None,
+    on_queued: Optional[QueuedCallback] = None,
+) -> T:
+    """
+    Make an OpenAI request under the shared [RESILIENCE] policy and return its result.
+
+    `request` sends the request once; it is called again for every retry and hedge. Each attempt waits for a
+    rate-limiter slot (unless `limit` is off) and is timed as `call`. 429s, 5xx and dropped connections are retried
+    with backoff while `model`'s circuit breaker stays closed, until `committed()` says output already reached the
+    user. `idempotent=False` limits retries to 429s. With `hedge`, a slow attempt is raced against a second copy.
+    """
+    settings = get_settings().resilience
+    breaker = breaker_for(model)
+
+    async def attempt() -> T:
+        slot = rate_limiter.slot(guild_id, model=model, on_queued=on_queued) if limit else contextlib.nullcontext()
+        async with slot:
+            with observe_openai(call, model=model, guild_id=guild_id):
+                return await request()
+
+    for number in itertools.count(1):
+        breaker.before_call()
+
+        try:
+            if hedge and settings.hedge_after_ms > 0:
+                result, winner = await hedged(attempt, delay=settings.hedge_after_ms / 1000)
+                if winner:
+                    OPENAI_HEDGES.labels(call=call, model=model, winner=winner).inc()
+            else:
+                result = await attempt()
+        except BaseException as e:
+            breaker.record(e)
+
+            delay = retry_delay(e, attempt=number, idempotent=idempotent) if isinstance(e, Exception) else None
+            if delay is None or number >= settings.max_attempts or (committed and committed()):
+                raise
+
+            OPENAI_RETRIES.labels(call=call, model=model, reason=retry_reason(e)).inc()
+            logger.warning("Retrying %s (%s) in %.1fs after attempt %d failed: %s", call, model, delay, number, e)
+            await asyncio.sleep(delay)
+        else:
+            breaker.record(None)
+            return result
+
+    raise AssertionError("unreachable")
+
+
 async def new_response(
     context: CommandContext,
     prompt: str,
@@ -84,9 +253,12 @@ async def new_response(
     openai_client: Optional[AsyncOpenAI] = None,
     max_output_tokens: int = 1000,
     model: str = "gpt-4.1-mini",
+    on_text: Optional[Callable[[str], Awaitable[None]]] = None,
 ) -> Response:
     """
     Generate a new response with the OpenAI Response API and store its ID
+
+    With `on_text`, the response is streamed and `on_text` is awaited with the accumulated text after each delta.
     """
 
     # topic-specific models
@@ -97,61 +269,350 @@ async def new_response(
         openai_client = await get_openai_client(guild_id=context.guild_id)
 
     previous_response_id = await get_response_id(context=context)
-
-    response = await openai_client.responses.create(
-        input=prompt,
+    shown = False
+
+    async def show(text: str) -> None:
+        nonlocal shown
+        shown = True
+        await on_text(text)
+
+    async def create() -> Response:
+        response = await openai_client.responses.create(
+            input=prompt,
+            model=model,
+            instructions=instructions,
+            max_output_tokens=max_output_tokens,
+            previous_response_id=previous_response_id,
+            stream=on_text is not None,
+        )
+
+        if on_text is not None:
+            response = await _consume_response_stream(stream=response, on_text=show)
+        return response
+
+    # only non-streamed text is hedged; a streamed response stops retrying once text has reached the user
+    response = await call_openai(
+        "responses.create",
         model=model,
-        instructions=instructions,
-        max_output_tokens=max_output_tokens,
-        previous_response_id=previous_response_id,
+        guild_id=context.guild_id,
+        request=create,
+        hedge=on_text is None,
+        committed=lambda: shown,
     )
 
     if context.params.get("topic"):
-        await update_chat(response_id=response.id, context=context)
+        await update_chat(response_id=response.id, context=context, continued=previous_response_id is not None)
 
     return response
 
 
+async def _consume_response_stream(
+    stream: AsyncStream[ResponseStreamEvent], on_text: Callable[[str], Awaitable[None]]
+) -> Response:
+    """
+    Feed text deltas to `on_text` and return the final Response from the stream.
+    """
+    text = ""
+    final_response = None
+
+    async for event in stream:
+        if event.type == "response.output_text.delta":
+            text += event.delta
+            await on_text(text)
+        elif event.type in ("response.completed", "response.incomplete", "response.failed"):
+            final_response = event.response
+        elif event.type == "error":
+            raise APIError(message=event.message, request=None, body=event)
+
+    if final_response is None:
+        raise APIError(message="The response stream ended before the response finished", request=None, body=None)
+
+    return final_response
+
+
+def split_for_embeds(text: str, limit: int = EMBED_DESCRIPTION_LIMIT) -> List[str]:
+    """
+    Split text into embed-sized pieces, preferring to break on newlines.
+    """
+    pieces = []
+
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        pieces.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+
+    pieces.append(text)
+    return pieces
+
+
+class ProgressiveReply:
+    """
+    Followup embeds that grow with streamed text.
+
+    Edits are throttled to one every `edit_interval` seconds to stay inside Discord's edit rate limits, and text
+    longer than one embed description spills into additional messages.
+    """
+
+    def __init__(
+        self, interaction: discord.Interaction, content: str, title: str, color: int, edit_interval: float = 1.5
+    ) -> None:
+        self.interaction = interaction
+        self.content = content
+        self.title = title
+        self.color = color
+        self.edit_interval = edit_interval
+        self.messages: List[discord.WebhookMessage] = []
+        self.rendered: List[Tuple[str, str]] = []  # (title, description) last sent for each message
+        self.last_render = 0.0
+
+    async def update(self, text: str) -> None:
+        if time.monotonic() - self.last_render >= self.edit_interval:
+            await self._render(text + " ▌")
+
+    async def finish(self, text: str, title: Optional[str] = None) -> None:
+        if title:
+            self.title = title
+        await self._render(text)
+
+    async def _render(self, text: str) -> None:
+        self.last_render = time.monotonic()
+        pieces = split_for_embeds(text)
+
+        for number, piece in enumerate(pieces):
+            title = self.title if len(pieces) == 1 else f"{self.title} ({number + 1}/{len(pieces)})"
+
+            if number < len(self.messages):
+                if self.rendered[number] != (title, piece):
+                    await self.messages[number].edit(embed=Embed(title=title, description=piece, color=self.color))
+                    self.rendered[number] = (title, piece)
+            else:
+                message = await self.interaction.followup.send(
+                    content=self.content if number == 0 else discord.utils.MISSING,
+                    embed=Embed(title=title, description=piece, color=self.color),
+                    wait=True,
+                )
+                self.messages.append(message)
+                self.rendered.append((title, piece))
+
+
 async def generate_speech(
     context: CommandContext,
-    file_name: str,
     tts: str,
     voice: str = "onyx",
     openai_client: Optional[AsyncOpenAI] = None,
 ) -> Path:
     """
-    Use OpenAI's Speech API to create a text-to-speech audio file
+    Use OpenAI's Speech API to create a text-to-speech audio file, or reuse the cached one for identical input
     """
-    config = get_config()
+    settings = get_settings()
+    key = speech_cache.key(
+        text=tts,
+        voice=voice,
+        model=settings.openai_general.speech_model,
+        file_format=settings.openai_general.speech_file_format,
+    )
+
+    if cached_path := speech_cache.get(key):
+        return cached_path
 
     if not openai_client:
         openai_client = await get_openai_client(guild_id=context.guild_id)
 
-    async with openai_client.audio.speech.with_streaming_response.create(
-        model=config.get("OPENAI_GENERAL", "speech_model", fallback="tts-1"),
-        voice=voice,
-        input=tts,
-        response_format=config.get("OPENAI_GENERAL", "speech_file_format", fallback="wav"),
-    ) as speech:
-        file_path = content_path(context=context, file_name=file_name)
-        await speech.stream_to_file(file_path)
+    async def create_speech() -> Path:
+        temp_path = speech_cache.temp_path(key)
 
-    return file_path
+        async def download() -> None:
+            async with openai_client.audio.speech.with_streaming_response.create(
+                model=settings.openai_general.speech_model,
+                voice=voice,
+                input=tts,
+                response_format=settings.openai_general.speech_file_format,
+            ) as speech:
+                await speech.stream_to_file(temp_path)
+
+        try:
+            await call_openai(
+                "audio.speech", model=settings.openai_general.speech_model, guild_id=context.guild_id, request=download
+            )
+        except BaseException:
+            speech_cache.discard(temp_path)
+            raise
+
+        return speech_cache.add(key, temp_path)
+
+    # finished clips are kept by the speech cache, shared by every guild; this only shares a request that is still
+    # running, and only within the guild whose key pays for it
+    return await single_flight.do(("speech", context.guild_id, key), create_speech)
+
+
+class ChunkPipe(io.RawIOBase):
+    """
+    Blocking file-like object fed from the event loop and read by discord.py's ffmpeg stdin writer thread.
+
+    Only `max_chunks` chunks are buffered, so memory stays bounded no matter how long the text is.
+    """
+
+    def __init__(self, max_chunks: int = 50) -> None:
+        super().__init__()
+        self._chunks: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=max_chunks)
+        self._buffer = b""
+        self._eof = False
+        self.aborted = False
+
+    def readable(self) -> bool:
+        return True
+
+    def _put(self, chunk: Optional[bytes]) -> None:
+        while not self.aborted:
+            try:
+                self._chunks.put(chunk, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    async def feed(self, chunk: Optional[bytes]) -> None:
+        """
+        Queue a chunk for the reader; None marks the end of the stream.
+        """
+        try:
+            self._chunks.put_nowait(chunk)
+        except queue.Full:
+            await asyncio.to_thread(self._put, chunk)
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._buffer and not self._eof:
+            chunk = self._chunks.get()
+            if chunk is None:
+                self._eof = True
+            else:
+                self._buffer = chunk
+
+        if size < 0:
+            size = len(self._buffer)
+
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def abort(self) -> None:
+        """
+        Stop accepting chunks, e.g. once playback has ended early.
+        """
+        self.aborted = True
+
+
+async def play_and_wait(voice_client: discord.VoiceClient, source: discord.AudioSource) -> None:
+    """
+    Play a source once anything already playing has finished, and return when this clip is done.
+    """
+    while voice_client.is_playing():
+        await asyncio.sleep(0.25)
+
+    loop = asyncio.get_running_loop()
+    finished = loop.create_future()
+
+    def after(error: Optional[Exception]) -> None:
+        # discord.py calls this from its audio thread
+        loop.call_soon_threadsafe(lambda: finished.done() or finished.set_result(error))
+
+    voice_client.play(source, after=after)
+
+    if error := await finished:
+        logger.warning("Voice playback failed: %s", error)
+
+
+def _play_in_background(voice_client: discord.VoiceClient, source: discord.AudioSource) -> asyncio.Task:
+    task = asyncio.create_task(play_and_wait(voice_client, source))
+    _playback_tasks.add(task)
+    task.add_done_callback(_playback_tasks.discard)
+    return task
+
+
+async def stream_speech(
+    context: CommandContext,
+    tts: str,
+    voice_client: discord.VoiceClient,
+    voice: str = "onyx",
+    openai_client: Optional[AsyncOpenAI] = None,
+) -> Path:
+    """
+    Play text-to-speech in a voice channel as the audio arrives.
+
+    The Speech API returns raw PCM, which is piped chunk by chunk into ffmpeg so playback starts on the first chunk.
+    The same chunks are written to a cached WAV in a worker thread for the attachment; cache hits play from disk.
+    """
+    settings = get_settings()
+    key = speech_cache.key(text=tts, voice=voice, model=settings.openai_general.speech_model, file_format="wav")
+
+    if cached_path := speech_cache.get(key):
+        _play_in_background(voice_client, FFmpegOpusAudio(cached_path))
+        return cached_path
+
+    if not openai_client:
+        openai_client = await get_openai_client(guild_id=context.guild_id)
+
+    pipe = ChunkPipe()
+    source = FFmpegPCMAudio(pipe, pipe=True, before_options=f"-f s16le -ar {PCM_SAMPLE_RATE} -ac 1")
+    playback = _play_in_background(voice_client, source)
+    playback.add_done_callback(lambda _: pipe.abort())
+
+    temp_path = speech_cache.temp_path(key)
+    wav_file = wave.open(str(temp_path), "wb")  # pylint: disable=consider-using-with
+    wav_file.setnchannels(1)
+    wav_file.setsampwidth(2)
+    wav_file.setframerate(PCM_SAMPLE_RATE)
+
+    played = False
+
+    async def play() -> None:
+        nonlocal played
+        async with openai_client.audio.speech.with_streaming_response.create(
+            model=settings.openai_general.speech_model,
+            voice=voice,
+            input=tts,
+            response_format="pcm",
+        ) as speech:
+            async for chunk in speech.iter_bytes(PCM_CHUNK_BYTES):
+                played = True
+                await pipe.feed(chunk)
+                await asyncio.to_thread(wav_file.writeframes, chunk)
+
+    try:
+        # audio that has started playing cannot be taken back, so only retry before the first chunk
+        await call_openai(
+            "audio.speech",
+            model=settings.openai_general.speech_model,
+            guild_id=context.guild_id,
+            request=play,
+            committed=lambda: played,
+        )
+    except BaseException:
+        await pipe.feed(None)
+        await asyncio.to_thread(wav_file.close)
+        speech_cache.discard(temp_path)
+        raise
+
+    await pipe.feed(None)
+    await asyncio.to_thread(wav_file.close)
+
+    return speech_cache.add(key, temp_path)
 
 
 async def speak_and_spell(
     context: CommandContext,
     prompt: str,
+    voice_client: Optional[discord.VoiceClient] = None,
 ) -> Tuple[str, Path]:
     """
     Create a new response and WAV file in one nice function.
-    """
 
-    config = get_config()
+    When a voice client is given, the audio is streamed into it while it is generated.
+    """
 
     openai_client = await get_openai_client(guild_id=context.guild_id)
 
-    instructions = config.get("OPENAI_INSTRUCTIONS", context.params.get("topic"))
+    instructions = get_settings().instructions[context.params.get("topic")]
 
     response = await new_response(
         context=context, prompt=prompt, instructions=instructions, openai_client=openai_client
@@ -159,18 +620,74 @@ async def speak_and_spell(
 
     tts = response.output_text
 
-    file_path = await generate_speech(
-        context=context, tts=tts, file_name=f"{response.id}.wav", openai_client=openai_client
-    )
+    if voice_client:
+        file_path = await stream_speech(context=context, tts=tts, voice_client=voice_client, openai_client=openai_client)
+        return tts, file_path
+
+    file_path = await generate_speech(context=context, tts=tts, openai_client=openai_client)
 
     return tts, file_path
 
 
-def content_path(context: CommandContext, file_name: str) -> Path:
+async def decode_image(b64_json: str) -> bytes:
+    """
+    Base64-decode an image payload in a worker thread; high-resolution outputs are several MB.
+    """
+    return await asyncio.to_thread(base64.b64decode, b64_json)
+
+
+async def collect_image_stream(
+    stream: AsyncStream[ImageGenStreamEvent], on_partial: Optional[Callable[[bytes, int], Awaitable[None]]] = None
+) -> ImagesResponse:
+    """
+    Consume a streamed image generation, handing each decoded partial image to `on_partial`, and return the finished
+    images as an ImagesResponse so callers treat streamed and non-streamed generations alike.
+    """
+    images = []
+    created = None
+
+    async for event in stream:
+        if event.type == "image_generation.partial_image":
+            if on_partial:
+                await on_partial(await decode_image(event.b64_json), event.partial_image_index)
+        elif event.type == "image_generation.completed":
+            images.append(Image(b64_json=event.b64_json))
+            created = event.created_at
+
+    if not images:
+        raise APIError(message="The image stream ended before an image was completed", request=None, body=None)
+
+    return ImagesResponse(created=created, data=images)
+
+
+class ImagePreview:
     """
-    Create a path to store the content generated by OpenAI.
+    One followup message showing the latest partial image of a streamed generation, replaced by the final result.
     """
-    ts = datetime.now().strftime(format="%Y-%m-%d - %A")
-    dir_path = Path(f"generated_content/guild_{context.guild_id}/{ts}/{context.command_name}")
-    dir_path.mkdir(parents=True, exist_ok=True)
-    return dir_path / file_name
+
+    def __init__(self, interaction: discord.Interaction, embed: Embed) -> None:
+        self.interaction = interaction
+        self.embed = embed
+        self.message: Optional[discord.WebhookMessage] = None
+
+    async def show(self, image_bytes: bytes, index: int) -> None:
+        file_name = f"preview-{index}.png"
+        embed = self.embed.copy()
+        embed.set_image(url=f"attachment://{file_name}")
+        embed.set_footer(text=f"Preview {index + 1}, still rendering...")
+        file = discord.File(fp=io.BytesIO(image_bytes), filename=file_name)
+
+        if self.message is None:
+            self.message = await self.interaction.followup.send(embed=embed, file=file, wait=True)
+        else:
+            self.message = await self.message.edit(embed=embed, attachments=[file])
+
+    async def finish(self, embed: Embed, files: List[discord.File], content: Optional[str] = None) -> None:
+        """
+        Replace the preview with the final images, or send them if no preview was shown.
+        """
+        if self.message is None:
+            await self.interaction.followup.send(content=content or discord.utils.MISSING, embed=embed, files=files)
+        else:
+            await self.message.edit(content=content, embed=embed, attachments=files)
+
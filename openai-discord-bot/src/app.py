@@ -4,40 +4,128 @@ A simple Discord Bot that utilizes the OpenAI API.
 """
 
 import asyncio
-import base64
 import os
+import uuid
 from datetime import datetime, timedelta
-from pathlib import Path
-from typing import Literal, Optional
+from typing import List, Literal, Optional, Tuple
 
 import discord
 from discord import Embed, FFmpegOpusAudio, Intents, Interaction, app_commands
-from openai import BadRequestError
+from openai import BadRequestError, OpenAIError
 from openai.types import Image, ImagesResponse
 
 from ai_helpers import (
+    ImagePreview,
+    ProgressiveReply,
+    call_openai,
+    close_openai_clients,
+    collect_image_stream,
     construct_error_embed,
-    content_path,
-    download_file_from_url,
+    decode_image,
     generate_speech,
-    get_config,
     get_openai_client,
-    has_enough_credits,
     new_response,
+    refresh_openai_clients,
+    single_flight,
     speak_and_spell,
+    stream_speech,
 )
-from db_utils import add_credits, create_command_context, get_user_credits
+from db_utils import (
+    VideoJob,
+    add_credits,
+    audit_writer,
+    create_command_context,
+    engine,
+    get_user_credits,
+    init_db,
+    refund_credits,
+    refund_orphaned_reservations,
+    reserve_credits,
+    settle_credits,
+)
+from loop_monitor import loop_monitor
+from metrics import InstrumentedCommandTree, discord_trace_config, start_metrics_server
+from rate_limits import rate_limiter
+from resilience import CircuitOpenError
+from settings import get_settings, install_reload_signal
+from sharding import get_shard_config
+from speech_cache import speech_cache
+from storage import attachment, storage
+from talk import TalkSession, talk_sessions
+from video_jobs import VideoJobQueue
+
+
+class Bot(discord.AutoShardedClient):
+    """
+    Sharded discord.Client that releases pooled OpenAI and database connections on shutdown.
+
+    It runs the shards given by SHARD_COUNT/SHARD_IDS (every recommended shard by default) and only picks up
+    leftover work for the guilds on those shards.
+    """
+
+    async def setup_hook(self) -> None:
+        install_reload_signal(self.loop)
+        loop_monitor.start()
+        start_metrics_server(port_offset=shard_config.process_index)
+        await init_db()
+        await refund_orphaned_reservations(owned=shard_config.owns_guild)
+        audit_writer.start()
+        speech_cache.start()
+        await storage.start()
+        await video_queue.start()
+
+    async def close(self) -> None:
+        await video_queue.stop()
+        await speech_cache.stop()
+        await storage.stop()
+        await super().close()
+        await audit_writer.stop()
+        await close_openai_clients()
+        await engine.dispose()
+        await loop_monitor.stop()
+
+
+class BotCommandTree(InstrumentedCommandTree):
+    """
+    Command tree that answers the user when OpenAI stays unreachable, instead of leaving the interaction thinking.
+    """
+
+    async def on_error(self, interaction: Interaction, error: app_commands.AppCommandError, /) -> None:
+        original = getattr(error, "original", error)
+
+        if isinstance(original, (OpenAIError, CircuitOpenError)):
+            context = await create_command_context(interaction)
+            embed = construct_error_embed(
+                context=context,
+                fields={"Error Type": f"`{type(original).__name__}`", "Error Message": str(original)[:1024]},
+            )
+            try:
+                if interaction.response.is_done():
+                    await interaction.followup.send(embed=embed)
+                else:
+                    await interaction.response.send_message(embed=embed)
+            except discord.HTTPException:
+                pass
+
+        await super().on_error(interaction, error)
+
 
 # Bot Client
 intents = Intents.default()
 intents.messages = True
 intents.guilds = True
 
-bot = discord.Client(intents=intents)
-tree = discord.app_commands.CommandTree(bot)
+shard_config = get_shard_config()
+bot = Bot(
+    intents=intents,
+    http_trace=discord_trace_config(),
+    shard_count=shard_config.shard_count,
+    shard_ids=list(shard_config.shard_ids) if shard_config.shard_ids else None,
+)
+tree = BotCommandTree(bot)
+video_queue = VideoJobQueue(bot)
 
-USER_AGENT = "Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.3"
-usage_tracker = {}  # blank dict created to store model usage for restricted models
+ADMIN_USER_ID = 222869237012758529
 
 
 @tree.command(name="join", description="Join the voice channel that the user is currently in.")
@@ -57,6 +145,9 @@ async def join(interaction: Interaction) -> bool:
 async def leave(interaction: Interaction) -> bool:
     context = await create_command_context(interaction)
 
+    if session := talk_sessions.get(interaction.guild_id):
+        session.stop()
+
     if interaction.guild.voice_client:
         await interaction.guild.voice_client.disconnect()
         await interaction.response.send_message(content="I have left the voice chat.", delete_after=3.0)
@@ -68,86 +159,140 @@ async def leave(interaction: Interaction) -> bool:
 @app_commands.describe(number_of_minutes="The number of minutes to look back for message deletion.")
 async def clean(interaction: Interaction, number_of_minutes: int) -> bool:
     context = await create_command_context(interaction, params={"number_of_minutes": number_of_minutes})
-    config = get_config()
+    settings = get_settings()
 
-    max_clean_minutes = int(config.get("GENERAL", "max_clean_minutes", fallback=1440))
+    max_clean_minutes = settings.general.max_clean_minutes
     if max_clean_minutes < number_of_minutes:
         await interaction.response.send_message(content=f"Can't clean more than {max_clean_minutes} minutes back.")
         return await context.save()
 
     after_time = datetime.now() - timedelta(minutes=number_of_minutes)
-    messages = interaction.channel.history(after=after_time)
-
-    bot_id = bot.user.id
-    sleep_seconds = float(config.get("GENERAL", "clean_sleep", fallback=0.75))
+    channel = interaction.channel
 
     await interaction.response.send_message(content="Deleting messages...")
+    status_message = await interaction.original_response()
+
+    # Discord only bulk deletes messages younger than 14 days
+    bulk_cutoff = discord.utils.utcnow() - timedelta(days=14, minutes=-5)
+    recent_messages, old_messages = [], []
+
+    async for message in channel.history(limit=None, after=after_time):
+        if message.author.id == bot.user.id and message.id != status_message.id:
+            if message.created_at > bulk_cutoff:
+                recent_messages.append(message)
+            else:
+                old_messages.append(message)
+
+    total = len(recent_messages) + len(old_messages)
+    deleted = 0
+
+    async def report_progress() -> None:
+        await interaction.edit_original_response(content=f"Deleting messages... {deleted}/{total}")
+
+    for start in range(0, len(recent_messages), 100):
+        batch = recent_messages[start : start + 100]
+        try:
+            await channel.delete_messages(batch)
+        except discord.HTTPException:
+            # no Manage Messages permission (or no bulk delete here), so delete the rest one at a time
+            old_messages.extend(recent_messages[start:])
+            break
 
-    async for message in messages:
-        if message.author.id == bot_id:
-            await asyncio.sleep(sleep_seconds)
-            await message.delete()
+        deleted += len(batch)
+        await report_progress()
+
+    # discord.py waits out 429s on its own, the semaphore just keeps us from queueing everything at once
+    semaphore = asyncio.Semaphore(settings.general.clean_concurrency)
+
+    async def delete_one(message: discord.Message) -> None:
+        nonlocal deleted
+
+        async with semaphore:
+            try:
+                await message.delete()
+            except discord.NotFound:
+                return
+
+        deleted += 1
+        if deleted % 10 == 0:
+            await report_progress()
+
+    await asyncio.gather(*(delete_one(message) for message in old_messages))
+
+    await interaction.edit_original_response(content=f"Deleted {deleted} messages.")
+    context.params["deleted"] = deleted
 
     return await context.save()
 
 
-@tree.command(name="talk", description="Start a loop where the bot talks about a specified topic at regular intervals.")
+talk_group = app_commands.Group(name="talk", description="Have the bot talk about a topic at regular intervals.")
+
+
+@talk_group.command(name="start", description="Start a loop where the bot talks about a specified topic.")
 @app_commands.describe(
     topic="The topic the bot will talk about.", wait_minutes="The interval in minutes between each message."
 )
-async def talk(interaction: Interaction, topic: Literal["nonsense", "quotes"], wait_minutes: float = 5.0) -> bool:
+async def talk_start(interaction: Interaction, topic: Literal["nonsense", "quotes"], wait_minutes: float = 5.0) -> bool:
     context = await create_command_context(interaction, params={"topic": f"talk_{topic}", "wait_minutes": wait_minutes})
-    interval = wait_minutes * 60
-
-    config = get_config()
-    prompt = config.get("PROMPTS", topic)
+    settings = get_settings()
 
     if not discord.utils.get(bot.voice_clients, guild=interaction.guild):
         await interaction.response.send_message(content="I must be in a voice channel before you use this command.")
         return await context.save()
 
-    await interaction.response.send_message(content="Starting talk loop.", delete_after=3.0)
+    if interaction.guild_id in talk_sessions:
+        await interaction.response.send_message(content="I'm already talking. Use `/talk stop` first.")
+        return await context.save()
 
-    while True:
+    TalkSession(
+        client=bot,
+        context=context,
+        channel=interaction.channel,
+        prompt=settings.prompts[topic],
+        interval=wait_minutes * 60,
+        prefetch=settings.general.talk_prefetch,
+    ).start()
 
-        # check to see if a voice connection is still active
-        if voice := discord.utils.get(bot.voice_clients, guild=interaction.guild):
+    await interaction.response.send_message(content="Starting talk loop.", delete_after=3.0)
 
-            tts, file_path = await speak_and_spell(
-                context=context,
-                prompt=prompt,
-            )
-            source = FFmpegOpusAudio(file_path)
-            _ = voice.play(source)
+    return await context.save()
 
-            # create our file object
-            discord_file = discord.File(fp=file_path, filename=file_path.name)
 
-            await interaction.channel.send(content=tts, file=discord_file)
-            await asyncio.sleep(interval)
-        else:
-            break
+@talk_group.command(name="stop", description="Stop the talk loop in this server.")
+async def talk_stop(interaction: Interaction) -> bool:
+    context = await create_command_context(interaction)
+
+    if session := talk_sessions.get(interaction.guild_id):
+        session.stop()
+        await interaction.response.send_message(content="Stopped the talk loop.", delete_after=3.0)
+    else:
+        await interaction.response.send_message(content="There is no talk loop running.", delete_after=3.0)
 
     return await context.save()
 
 
+tree.add_command(talk_group)
+
+
 @tree.command(name="rather", description="Play a 'Would You Rather' game with a specified topic.")
 @app_commands.describe(topic="The subject for the generated hypothetical question.")
 async def rather(interaction: Interaction, topic: Literal["normal", "adult", "games", "fitness"] = "normal") -> bool:
     context = await create_command_context(interaction, params={"topic": f"rather_{topic}"})
-    config = get_config()
-    topic = f"rather_{topic}"
-    new_hypothetical_prompt = config.get("PROMPTS", "new_hypothetical")
+    new_hypothetical_prompt = get_settings().prompts["new_hypothetical"]
 
     await interaction.response.defer()
 
+    voice = discord.utils.get(bot.voice_clients, guild=interaction.guild)
+    streaming = voice is not None and get_settings().openai_general.speech_streaming
+
     tts, file_path = await speak_and_spell(
         context=context,
         prompt=new_hypothetical_prompt,
+        voice_client=voice if streaming else None,
     )
 
     # play over a voice channel
-    if voice := discord.utils.get(bot.voice_clients, guild=interaction.guild):
+    if voice and not streaming:
         source = FFmpegOpusAudio(file_path)
         _ = voice.play(source)
 
@@ -167,22 +312,27 @@ async def say(
     voice: Literal["alloy", "ash", "coral", "echo", "fable", "onyx", "nova", "sage", "shimmer"] = "onyx",
 ) -> bool:
     context = await create_command_context(interaction, params={"text_to_speech": text_to_speech, "voice": voice})
-    ts = datetime.now().strftime("%Y%m%d%H%M%S")
-    file_name = f"{ts}.wav"
     voice_client = discord.utils.get(bot.voice_clients, guild=interaction.guild)
 
     await interaction.response.defer()
 
-    file_path = await generate_speech(
-        context=context,
-        file_name=file_name,
-        tts=text_to_speech,
-        voice=voice,
-    )
+    if voice_client and get_settings().openai_general.speech_streaming:
+        file_path = await stream_speech(
+            context=context,
+            tts=text_to_speech,
+            voice_client=voice_client,
+            voice=voice,
+        )
+    else:
+        file_path = await generate_speech(
+            context=context,
+            tts=text_to_speech,
+            voice=voice,
+        )
 
-    if voice_client:
-        source = FFmpegOpusAudio(file_path)
-        _ = voice_client.play(source)
+        if voice_client:
+            source = FFmpegOpusAudio(file_path)
+            _ = voice_client.play(source)
 
     # create our file object
     discord_file = discord.File(fp=file_path, filename=file_path.name)
@@ -197,23 +347,27 @@ async def say(
     prompt="The prompt used for image generation.",
     model="The OpenAI image model to use.",
     background="Allows to set transparency for the background of the generated image(s). gpt-image-1* models only.",
+    n="How many images to generate (costs credits per image).",
 )
 async def image(
     interaction: Interaction,
     prompt: str,
     model: Literal["dall-e-2", "dall-e-3", "gpt-image-1.5", "gpt-image-1-mini"] = "gpt-image-1-mini",
     background: Literal["transparent", "opaque", "auto"] = "auto",
+    n: app_commands.Range[int, 1, 4] = 1,
 ) -> bool:
     context = await create_command_context(
-        interaction, params={"prompt": prompt, "model": model, "background": background}
+        interaction, params={"prompt": prompt, "model": model, "background": background, "n": n}
     )
     submission_params = context.params
 
     await interaction.response.defer()
-    config = get_config()
+    settings = get_settings()
 
     openai_client = await get_openai_client(interaction.guild_id)
 
+    reservation = None
+
     # create our embed object
     embed = Embed(
         color=10181046,
@@ -229,22 +383,95 @@ async def image(
         # submission params update for moderation
         submission_params["moderation"] = "low"
 
-        # credits section
-        user_credits = await get_user_credits(user_id=interaction.user.id)
-        model_cost = int(config.get("OPENAI_CREDITS", model, fallback="0"))
+        # stream low-resolution previews while a single image renders
+        if n == 1 and (partial_images := min(settings.openai_general.image_partial_images, 3)):
+            submission_params["stream"] = True
+            submission_params["partial_images"] = partial_images
+
+        # credits section: hold the cost of every image now, keep it only for the images that come back
+        model_cost = settings.credits.get(model, 0)
+        reservation = await reserve_credits(
+            user_id=interaction.user.id, amount=model_cost * n, guild_id=interaction.guild_id
+        )
 
-        if not has_enough_credits(user_credits=user_credits, deduction=model_cost):
+        if reservation is None:
+            user_credits = await get_user_credits(user_id=interaction.user.id)
             await interaction.followup.send(
                 content=(
                     f"You do not have enough B4NG AI credits to run this command with `{model}`.\n"
                     f"You have: `{user_credits}` credits.\n"
-                    f"This run costs you `{model_cost}` B4NG AI credits."
+                    f"This run costs you `{model_cost * n}` B4NG AI credits."
                 )
             )
             return await context.save()
+
+    preview = ImagePreview(interaction, embed=embed)
+
+    async def report_queue_position(position: int) -> None:
+        await interaction.followup.send(content=f"`{model}` is busy right now. You are #{position} in line.")
+
+    # dall-e-3 only makes one image per request, so ask for several at once instead
+    if model == "dall-e-3":
+        request_params = [{**submission_params, "n": 1}] * n
+    else:
+        request_params = [submission_params]
+
+    async def generate(params: dict) -> ImagesResponse:
+        async def request() -> ImagesResponse:
+            raw_response = await openai_client.images.with_raw_response.generate(**params)
+            rate_limiter.observe(interaction.guild_id, model=model, headers=raw_response.headers)
+
+            if params.get("stream"):
+                return await collect_image_stream(raw_response.parse(), on_partial=preview.show)
+            return raw_response.parse()
+
+        return await call_openai(
+            "images.generate",
+            model=model,
+            guild_id=interaction.guild_id,
+            request=request,
+            on_queued=report_queue_position,
+        )
+
+    async def store(file_name: str, image_object: Image) -> bytes:
+        data = await decode_image(image_object.b64_json)
+        await storage.save(context=context, file_name=file_name, data=data)
+        return data
+
+    async def render() -> List[Tuple[str, bytes, Optional[str]]]:
+        """
+        Generate the images and store them, returning each file name, image and revised prompt.
+        """
+        results = await asyncio.gather(*(generate(params) for params in request_params), return_exceptions=True)
+        image_responses = [result for result in results if isinstance(result, ImagesResponse)]
+
+        if not image_responses:
+            raise results[0]
+
+        images = [(response.created, image_object) for response in image_responses for image_object in response.data]
+        # `created` only has one-second resolution, so a per-render token keeps concurrent renders apart
+        token = uuid.uuid4().hex[:8]
+        file_names = [
+            f"{model}-{created}-{token}.png" if len(images) == 1 else f"{model}-{created}-{token}-{number}.png"
+            for number, (created, _) in enumerate(images)
+        ]
+        datas = await asyncio.gather(
+            *(store(file_name, image_object) for file_name, (_, image_object) in zip(file_names, images))
+        )
+        return [
+            (file_name, data, image_object.revised_prompt)
+            for file_name, data, (_, image_object) in zip(file_names, datas, images)
+        ]
+
+    # identical requests running at the same time in this guild share one generation and its files; a later
+    # request is charged in full, so it always gets new images
+    flight_key = single_flight.key("image", interaction.guild_id, model, prompt, background, n)
+
     try:
-        image_response: ImagesResponse = await openai_client.images.generate(**submission_params)
+        images = await single_flight.do(flight_key, render)
     except BadRequestError as e:
+        if reservation:
+            await refund_credits(reservation_id=reservation.id)
 
         failure_followup = {
             "embed": construct_error_embed(
@@ -264,30 +491,32 @@ async def image(
         await interaction.followup.send(**failure_followup)
 
         return await context.save()
+    except Exception:
+        if reservation:
+            await refund_credits(reservation_id=reservation.id)
+        raise
 
-    image_object: Image = image_response.data[0]
+    embed.set_image(url=f"attachment://{images[0][0]}")
 
-    # save the generated image to a file
-    file_name = f"{model}-{image_response.created}.png"
-    path = content_path(context=context, file_name=file_name)
-    image_bytes = base64.b64decode(image_object.b64_json)
-
-    with open(path, "wb") as file:
-        file.write(image_bytes)
+    # set the footer based on model
+    if revised_prompt := images[0][2]:
+        embed.set_footer(text=f"Revised Prompt:\n{revised_prompt}")
 
-    embed.set_image(url=f"attachment://{file_name}")
+    content = None
+    if len(images) < n:
+        content = f"Only {len(images)} of {n} images could be generated."
 
-    # set the footer based on model
-    if image_object.revised_prompt:
-        embed.set_footer(text=f"Revised Prompt:\n{image_object.revised_prompt}")
-    elif model == "gpt-image-1.5":
-        remaining_credits = await add_credits(user_id=interaction.user.id, num_credits=-model_cost)
-        embed.set_footer(text=f"{interaction.user.name} has {remaining_credits} B4NG AI credits remaining.")
+    if reservation:
+        remaining_credits = await settle_credits(reservation_id=reservation.id, keep=model_cost * len(images))
+        if reservation.amount:
+            embed.set_footer(text=f"{interaction.user.name} has {remaining_credits} B4NG AI credits remaining.")
+            if content:
+                content += " You were only charged for those."
 
-    # attach our file object
-    file_upload = discord.File(fp=path, filename=file_name)
+    # attach our file objects
+    file_uploads = [attachment(data, file_name) for file_name, data, _ in images]
 
-    await interaction.followup.send(file=file_upload, embed=embed)
+    await preview.finish(embed=embed, files=file_uploads, content=content)
 
     return await context.save()
 
@@ -308,26 +537,25 @@ async def video(
     model: Literal["sora-2", "sora-2-pro"] = "sora-2",
     size: Literal["720x1280", "1280x720"] = "1280x720",
 ) -> bool:
-    
+
     if model == "sora-2":
         model = "sora-2-2025-12-08"
 
     context = await create_command_context(
         interaction,
-        params={"prompt": prompt, "model": model, "seconds": seconds, "size": size},
+        params={"prompt": prompt, "model": model, "seconds": seconds, "size": size, "ai_director": ai_director},
     )
 
-    await interaction.response.defer()
+    settings = get_settings()
 
-    config = get_config()
-
-    # credits section
-    user_credits = await get_user_credits(user_id=interaction.user.id)
-    model_cost = int(config.get("OPENAI_CREDITS", model))
+    # credits section: held until the job finishes, then kept or refunded by the worker
+    model_cost = settings.credits[model]
     deduction = model_cost * int(seconds)
+    reservation = await reserve_credits(user_id=interaction.user.id, amount=deduction, guild_id=interaction.guild_id)
 
-    if not has_enough_credits(user_credits=user_credits, deduction=deduction):
-        await interaction.followup.send(
+    if reservation is None:
+        user_credits = await get_user_credits(user_id=interaction.user.id)
+        await interaction.response.send_message(
             content=(
                 f"You do not have enough B4NG AI credits to run this command with `{model}`.\n"
                 f"You have: `{user_credits}` credits.\n"
@@ -336,85 +564,27 @@ async def video(
         )
         return await context.save()
 
-    original_prompt = prompt
-    description_text = f"### User Input:\n> {original_prompt}"
-
-    openai_client = await get_openai_client(guild_id=0)
-
-    if ai_director:
-        instructions = config.get("OPENAI_INSTRUCTIONS", "video").format(seconds=seconds)
-        response = await new_response(context=context, instructions=instructions, prompt=prompt)
-        context.params["prompt"] = response.output_text
-        description_text += "\n### AI Director:\n`True`"
-
-    video_object = await openai_client.videos.create_and_poll(**context.params)
-
-    # successful generation
-    if video_object.status == "completed":
-        content = await openai_client.videos.download_content(video_object.id, variant="video")
-        video_file_name = f"{model}-{video_object.id}.mp4"
-        video_path = content_path(context=context, file_name=video_file_name)
-        content.write_to_file(video_path)
-
-        files = []
-        files.append(discord.File(fp=video_path, filename=video_file_name))
-
-        if ai_director:
-            text_file_name = f"{model}-ai-director-prompt-{video_object.id}.txt"
-            text_path = content_path(context=context, file_name=text_file_name)
-
-            with open(text_path, "w", encoding="UTF-8") as f:
-                f.write(response.output_text)
-
-            files.append(discord.File(fp=text_path, filename=text_file_name))
-
-        # create our embed object
-        embed = Embed(
-            color=3426654,
-            title=f"`{model}` Video Generation",
-            description=description_text,
+    job = await video_queue.submit(
+        VideoJob(
+            guild_id=interaction.guild_id,
+            channel_id=interaction.channel_id,
+            user_id=interaction.user.id,
+            user=interaction.user.name,
+            model=model,
+            seconds=seconds,
+            size=size,
+            prompt=prompt,
+            ai_director=ai_director,
+            cost=deduction,
+            reservation_id=reservation.id,
         )
+    )
 
-        # charge usage on success
-        remaining_credits = await add_credits(user_id=interaction.user.id, num_credits=-deduction)
-        embed.set_footer(text=f"{interaction.user.name} has {remaining_credits} B4NG AI credits remaining.")
-
-        # attach our files object
-        await interaction.followup.send(embed=embed, files=files)
-
-    # unsuccessful generation
-    else:
-        failure_followup = {
-            "embed": construct_error_embed(
-                context=context,
-                user_input=prompt,
-                fields={
-                    "Error Type": f"`{video_object.error.code}`",
-                    "Error Message": video_object.error.message,
-                    "Video ID": f"`{video_object.id}`",
-                    "Video Status": f"`{video_object.status}`",
-                    "Guidelines URL": (
-                        "https://platform.openai.com/docs/guides/video-generation#guardrails-and-restrictions"
-                    ),
-                    "Charged Credits": "False",
-                },
-            )
-        }
-
-        # write text file with a failed name
-        if ai_director:
-            text_file_name = f"FAILED-{model}-ai-director-prompt-{video_object.id}.txt"
-            text_path = content_path(context=context, file_name=text_file_name)
-
-            with open(text_path, "w", encoding="UTF-8") as f:
-                f.write(response.output_text)
-
-            failure_followup["file"] = discord.File(fp=text_path, filename=text_file_name)
-
-        await interaction.followup.send(**failure_followup)
+    await interaction.response.send_message(
+        content=f"Video job `#{job.id}` is queued. I'll post the `{model}` video here when it's ready."
+    )
 
-    context.params["ai_director"] = ai_director
-    context.params["original_prompt"] = original_prompt
+    context.params["job_id"] = job.id
     return await context.save()
 
 
@@ -427,10 +597,11 @@ async def vision(interaction: Interaction, attachment: discord.Attachment, visio
     context = await create_command_context(
         interaction, params={"vision_prompt": vision_prompt, "attachment": attachment.filename}
     )
-    config = get_config()
+    settings = get_settings()
+    vision_model = settings.openai_general.vision_model
 
     if not vision_prompt:
-        vision_prompt = config.get("PROMPTS", "vision_prompt", fallback="What is in this image?")
+        vision_prompt = settings.prompts.get("vision_prompt", "What is in this image?")
 
     try:
         image_url = attachment.url
@@ -440,23 +611,43 @@ async def vision(interaction: Interaction, attachment: discord.Attachment, visio
         )
         return await context.save()
 
+    max_bytes = settings.openai_general.vision_max_mb * 1024 * 1024
+    if attachment.size > max_bytes:
+        await interaction.response.send_message(
+            f"```plaintext\nError: Attachments can be at most {settings.openai_general.vision_max_mb} MB.\n```"
+        )
+        return await context.save()
+
     await interaction.response.defer()
 
-    openai_client = await get_openai_client(interaction.guild_id)
+    # fetch the attachment into memory while OpenAI looks at it
+    file_task = asyncio.create_task(attachment.to_file())
 
-    response = await openai_client.responses.create(
-        model=config.get("OPENAI_GENERAL", "vision_model", fallback="gpt-5-mini"),
-        input=[
-            {
-                "role": "user",
-                "content": [
-                    {"type": "input_text", "text": vision_prompt},
-                    {"type": "input_image", "image_url": image_url},
+    try:
+        openai_client = await get_openai_client(interaction.guild_id)
+
+        response = await call_openai(
+            "responses.create",
+            model=vision_model,
+            guild_id=interaction.guild_id,
+            request=lambda: openai_client.responses.create(
+                model=vision_model,
+                input=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "input_text", "text": vision_prompt},
+                            {"type": "input_image", "image_url": image_url},
+                        ],
+                    }
                 ],
-            }
-        ],
-        max_output_tokens=config.getint("OPENAI_GENERAL", "max_output_tokens", fallback=500),
-    )
+                max_output_tokens=settings.openai_general.max_output_tokens,
+            ),
+            hedge=True,
+        )
+    except BaseException:
+        file_task.cancel()
+        raise
 
     embed = Embed(
         color=5763719,
@@ -464,22 +655,13 @@ async def vision(interaction: Interaction, attachment: discord.Attachment, visio
         description=f"User Input:\n```{vision_prompt}```",
     )
 
-    # Download the image using the generic function
-    download_file_from_url(
-        url=attachment.url,
-        filename=attachment.filename,
-        headers={"User-Agent": USER_AGENT},
-    )
-
-    discord_file = discord.File(fp=attachment.filename, filename=attachment.filename)
+    discord_file = await file_task
 
-    embed.set_image(url=f"attachment://{attachment.filename}")
+    embed.set_image(url=f"attachment://{discord_file.filename}")
     embed.set_footer(text=response.output_text)
 
     await interaction.followup.send(embed=embed, file=discord_file)
 
-    Path(attachment.filename).unlink()
-
     return await context.save()
 
 
@@ -499,11 +681,9 @@ async def chat(
 ) -> bool:
 
     if not custom_instructions:
-        config = get_config()
-        custom_instructions = config.get(
-            "OPENAI_INSTRUCTIONS",
+        custom_instructions = get_settings().instructions.get(
             "chat_helper",
-            fallback="Ensure your response is under 2,000 characters and uses markdown compatible with Discord.",
+            "Ensure your response is under 2,000 characters and uses markdown compatible with Discord.",
         )
 
     context = await create_command_context(
@@ -519,9 +699,25 @@ async def chat(
 
     await interaction.response.defer()
 
+    general_settings = get_settings().general
+    title = f"🤖 `{chat_model}` Response"
+
+    # without streaming the reply is only sent by finish(), which still splits it over several embeds when needed
+    reply = ProgressiveReply(
+        interaction,
+        content=f"> {prompt}",
+        title=title,
+        color=1752220,
+        edit_interval=general_settings.chat_edit_seconds,
+    )
+
     try:
         response = await new_response(
-            context=context, prompt=prompt, instructions=custom_instructions, model=chat_model
+            context=context,
+            prompt=prompt,
+            instructions=custom_instructions,
+            model=chat_model,
+            on_text=reply.update if general_settings.chat_streaming else None,
         )
     except BadRequestError as e:
         failure_followup = {
@@ -543,10 +739,10 @@ async def chat(
 
         return await context.save()
 
-    title = f"🤖 `{chat_model}` Response{' (Continued)' if response.previous_response_id else ''}"
-    embed = Embed(title=title, description=response.output_text, color=1752220)
+    if response.previous_response_id:
+        title += " (Continued)"
 
-    await interaction.followup.send(content=f"> {prompt}", embed=embed)
+    await reply.finish(response.output_text, title=title)
 
     return await context.save()
 
@@ -556,7 +752,7 @@ async def chat(
 async def grant(interaction: Interaction, user_id: str, num_credits: str) -> bool:
     context = await create_command_context(interaction, params={"user_id": user_id, "credits": num_credits})
 
-    if interaction.user.id != 222869237012758529:
+    if interaction.user.id != ADMIN_USER_ID:
         await interaction.followup.send("Only Zach can use this command.")
         return await context.save()
 
@@ -568,16 +764,33 @@ async def grant(interaction: Interaction, user_id: str, num_credits: str) -> boo
     return await context.save()
 
 
+@tree.command(name="reload_keys", description="Re-read the guilds' OpenAI API keys from the database.")
+async def reload_keys(interaction: Interaction) -> bool:
+    context = await create_command_context(interaction)
+
+    if interaction.user.id != ADMIN_USER_ID:
+        await interaction.response.send_message("Only Zach can use this command.")
+        return await context.save()
+
+    retired, missing = await refresh_openai_clients()
+
+    message = f"Reloaded API keys; {retired} client(s) for replaced keys will close once their requests finish."
+    if missing:
+        message += f"\nNo key is stored any more for guild(s): {', '.join(str(guild_id) for guild_id in missing)}"
+    await interaction.response.send_message(content=message)
+
+    return await context.save()
+
+
 @tree.command(name="balance", description="Displays your current B4NG AI credits and model costs.")
 async def balance(interaction: Interaction) -> bool:
     context = await create_command_context(interaction=interaction)
 
     current_credits = await get_user_credits(user_id=interaction.user.id)
-    config = get_config()
 
     # Build model costs list
     costs_list = []
-    for key, value in config.items("OPENAI_CREDITS"):
+    for key, value in get_settings().credits.items():
         costs_list.append(f"- `{key}`: {value} credits")
     costs_message = "\n".join(costs_list)
 
@@ -597,11 +810,90 @@ async def balance(interaction: Interaction) -> bool:
     return await context.save()
 
 
+@bot.event
+async def on_app_command_completion(interaction: Interaction, _command: app_commands.Command) -> None:
+    tree.record(interaction, outcome="success")
+
+
+@tree.command(name="storage", description="Show how much generated content this server is storing.")
+async def storage_usage(interaction: Interaction) -> bool:
+    context = await create_command_context(interaction=interaction)
+    settings = get_settings().storage
+
+    used_mb = storage.usage_for(interaction.guild_id) / (1024 * 1024)
+    quota = f"{settings.guild_quota_mb} MB" if settings.guild_quota_mb else "unlimited"
+
+    embed = Embed(title="Generated Content Storage", color=15844367)
+    embed.add_field(name="Used", value=f"`{used_mb:.1f} MB`", inline=True)
+    embed.add_field(name="Quota", value=f"`{quota}`", inline=True)
+    if settings.max_age_days:
+        embed.add_field(name="Retention", value=f"`{settings.max_age_days:g} days`", inline=True)
+
+    await interaction.response.send_message(embed=embed)
+
+    return await context.save()
+
+
+@tree.command(name="profile", description="Sample what the event loop is busy with and list the slowest handlers.")
+@app_commands.describe(seconds="How long to sample the event loop for.")
+async def profile_loop(interaction: Interaction, seconds: app_commands.Range[int, 1, 120] = 10) -> bool:
+    context = await create_command_context(interaction, params={"seconds": seconds})
+
+    if interaction.user.id != ADMIN_USER_ID:
+        await interaction.response.send_message("Only Zach can use this command.")
+        return await context.save()
+
+    await interaction.response.defer()
+
+    profile = await loop_monitor.profile(seconds=seconds)
+    busy = profile.samples - profile.idle
+
+    embed = Embed(
+        title="Event Loop Profile",
+        color=15844367,
+        description=f"The event loop was busy in `{busy}` of `{profile.samples}` samples over `{seconds}` seconds.",
+    )
+    if profile.commands:
+        busiest = [f"- `{command}`: {count} samples" for command, count in profile.commands.most_common(5)]
+        embed.add_field(name="Busiest Handlers", value="\n".join(busiest), inline=False)
+
+    if blocking := loop_monitor.stall_seconds_by_command():
+        totals = [f"- `{command}`: {seconds * 1000:.0f} ms" for command, seconds in list(blocking.items())[:5]]
+        embed.add_field(name="Time Spent Blocking the Loop", value="\n".join(totals), inline=False)
+
+    worst_stalls = loop_monitor.worst_stalls()
+    if worst_stalls:
+        slowest = [
+            f"- `{stall.command}`: {stall.seconds * 1000:.0f} ms at {stall.started:%H:%M:%S}" for stall in worst_stalls
+        ]
+        embed.add_field(name="Slowest Stalls", value="\n".join(slowest), inline=False)
+
+    # collapsed stacks open in speedscope or flamegraph.pl, like py-spy's raw output
+    ts = datetime.now().strftime(format="%Y%m%d-%H%M%S")
+    files = []
+    if profile.stacks:
+        files.append(attachment(profile.collapsed().encode("UTF-8"), f"loop-profile-{ts}.txt"))
+    if worst_stalls:
+        stall_report = "\n\n".join(
+            f"{stall.started:%Y-%m-%d %H:%M:%S} {stall.command} blocked the loop for {stall.seconds * 1000:.0f} ms\n"
+            f"{stall.stack}"
+            for stall in loop_monitor.worst_stalls(count=len(loop_monitor.stalls))
+        )
+        files.append(attachment(stall_report.encode("UTF-8"), f"loop-stalls-{ts}.txt"))
+
+    await interaction.followup.send(embed=embed, files=files)
+
+    return await context.save()
+
+
 @bot.event
 async def on_ready():
 
-    await tree.sync()  # Sync slash commands globally
-    print(f"Logged in as {bot.user}")
+    # commands are global, so only the process running shard 0 needs to sync them
+    if shard_config.primary:
+        await tree.sync()  # Sync slash commands globally
+    print(f"Logged in as {bot.user} (shards {sorted(bot.shards)} of {bot.shard_count})")
 
 
-bot.run(os.getenv("DISCORD_BOT_KEY"))
+if __name__ == "__main__":
+    bot.run(os.getenv("DISCORD_BOT_KEY"))
@@ -2,17 +2,52 @@
 Functions to work with the database
 """
 
+import asyncio
+import logging
 import os
-from datetime import datetime
-from typing import Any, Dict, Optional, Union
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, Union
 
 from cryptography.fernet import Fernet
 from discord import Interaction
-from sqlmodel import JSON, Column, Field, Session, SQLModel, create_engine, select
+from sqlalchemy import Connection, Index, delete, event, func, insert, inspect, text, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import JSON, Column, Field, SQLModel, col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from metrics import CREDITS_CHARGED, CREDITS_REFUNDED, timed_db
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
 
 SQLITE_FILE_NAME = "database.db"
-SQLITE_URL = f"sqlite:///{SQLITE_FILE_NAME}"
-engine = create_engine(SQLITE_URL)
+SQLITE_URL = f"sqlite+aiosqlite:///{SQLITE_FILE_NAME}"
+engine = create_async_engine(SQLITE_URL)
+
+# applied to every new connection; WAL lets readers run alongside the writer and NORMAL skips the per-commit fsync
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+)
+
+API_KEY_TTL_SECONDS = 300
+_api_key_cache: Dict[int, Tuple[str, float]] = {}  # guild_id -> (decrypted key, expiry)
+_cipher: Optional[Fernet] = None
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, _connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
 
 
 class CommandContext(SQLModel, table=True):
@@ -30,12 +65,15 @@ class CommandContext(SQLModel, table=True):
 
     async def save(self) -> bool:
         """
-        Writes a CommandContext to the db
+        Hands a CommandContext to the write-behind audit writer, or writes it directly if the writer isn't running
         """
 
-        with get_session() as session:
+        if audit_writer.submit(self):
+            return True
+
+        async with get_session() as session:
             session.add(self)
-            session.commit()
+            await session.commit()
         return True
 
 
@@ -64,10 +102,156 @@ class Chat(SQLModel, table=True):
     Table for storing OpenAI Response IDs
     """
 
+    # every lookup is by (guild_id, topic), and there is only ever one row per pair
+    __table_args__ = (Index("ix_chat_guild_id_topic", "guild_id", "topic", unique=True),)
+
     response_id: str = Field(default=None, primary_key=True)
     topic: str
     guild_id: int
     updated: datetime
+    started: Optional[datetime] = None  # when the current response chain began
+    turns: Optional[int] = None  # responses in the current chain
+
+
+class VideoJob(SQLModel, table=True):
+    """
+    Table for queued /video generations so they survive a restart
+    """
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    guild_id: int = Field(index=True)
+    channel_id: int
+    user_id: int = Field(index=True)
+    user: str
+    model: str
+    seconds: str
+    size: str
+    prompt: str
+    ai_director: bool = False
+    director_prompt: Optional[str] = None
+    cost: int = 0
+    reservation_id: Optional[int] = None
+    video_id: Optional[str] = None
+    status: str = Field(default="queued", index=True)
+    error_code: Optional[str] = None
+    error_message: Optional[str] = None
+    created: datetime = Field(default_factory=datetime.now)
+    updated: datetime = Field(default_factory=datetime.now)
+
+
+# "submitting" is written just before videos.create, so a crash during the call is not mistaken for "queued"
+VIDEO_JOB_UNFINISHED = ("queued", "submitting", "submitted")
+
+
+class CreditReservation(SQLModel, table=True):
+    """
+    Table for credits debited up front and held until a generation succeeds or fails
+    """
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(index=True)
+    guild_id: Optional[int] = None  # the guild the command ran in, which decides the shard process that owns it
+    amount: int
+    status: str = Field(default="held", index=True)  # held, settled, refunded
+    created: datetime = Field(default_factory=datetime.now)
+    updated: datetime = Field(default_factory=datetime.now)
+
+
+class GeneratedContent(SQLModel, table=True):
+    """
+    Table indexing every file under generated_content/ for quotas, usage reports and cleanup
+    """
+
+    # the sweeper walks each guild's files oldest-written first; the bot never reads them back, so that is FIFO
+    __table_args__ = (Index("ix_generatedcontent_guild_id_last_access", "guild_id", "last_access"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    guild_id: int = Field(index=True)
+    command_name: str
+    path: str = Field(unique=True)
+    size: int
+    created: datetime = Field(default_factory=datetime.now, index=True)
+    last_access: datetime = Field(default_factory=datetime.now)  # last written, bumped when a path is rewritten
+
+
+class AuditWriter:
+    """
+    Write-behind queue for CommandContext rows.
+
+    Rows are collected for up to GENERAL.audit_flush_ms, or until GENERAL.audit_batch_size rows are waiting, and
+    written with one multi-row INSERT and a single commit. Whatever is still queued is flushed on stop().
+    """
+
+    def __init__(self) -> None:
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+        self.pending: List[Dict[str, Any]] = []  # the batch being collected or written
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self._run(), name="audit-writer")
+
+    async def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+        # a batch cut short by the cancel is still in self.pending
+        rows, self.pending = self.pending, []
+        while not self.queue.empty():
+            rows.append(self.queue.get_nowait())
+
+        # in batches, so a long backlog stays under SQLite's bound-parameter limit
+        batch_size = max(get_settings().general.audit_batch_size, 1)
+        for start in range(0, len(rows), batch_size):
+            await self._write(rows[start : start + batch_size])
+
+    def submit(self, context: CommandContext) -> bool:
+        """
+        Queue a row; returns False when the writer isn't running and the caller should write it itself.
+        """
+        if self.task is None or self.task.done():
+            return False
+
+        self.queue.put_nowait(context.model_dump(exclude={"id"}))
+        return True
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            settings = get_settings()
+            self.pending.append(await self.queue.get())
+            deadline = loop.time() + settings.general.audit_flush_ms / 1000
+
+            while len(self.pending) < settings.general.audit_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self.pending.append(await asyncio.wait_for(self.queue.get(), timeout=timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # a cancel anywhere above or during the write leaves the batch in self.pending for stop() to flush
+            try:
+                await self._write(self.pending)
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Could not write %s command contexts", len(self.pending))
+            self.pending = []
+
+    @staticmethod
+    @timed_db
+    async def _write(rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+
+        async with get_session() as session:
+            await session.exec(insert(CommandContext).values(rows))
+            await session.commit()
+
+
+audit_writer = AuditWriter()
 
 
 async def create_command_context(interaction: Interaction, params: Optional[Dict[str, Any]] = None) -> CommandContext:
@@ -82,100 +266,285 @@ async def create_command_context(interaction: Interaction, params: Optional[Dict
         guild_id=interaction.guild_id,
         user_id=interaction.user.id,
         user=interaction.user.name,
-        command_name=interaction.command.name,
+        command_name=interaction.command.qualified_name,
         params=params,
     )
 
     return context
 
 
-def get_session() -> Session:
+def _migrate(conn: Connection) -> None:
+    """
+    Lightweight migration: add columns and indexes that exist on a model but not yet in an older database file.
+    """
+    inspector = inspect(conn)
+
+    for table in SQLModel.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=conn.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            if index.name == "ix_chat_guild_id_topic":
+                _dedupe_chats(conn)
+            index.create(conn)
+
+
+def _dedupe_chats(conn: Connection) -> None:
     """
-    Returns a database session for queries 'n' things.
+    Older versions could write several Chat rows for one (guild_id, topic); keep only the newest so the unique index
+    can be built.
     """
+    result = conn.execute(
+        text(
+            """
+            DELETE FROM chat WHERE rowid IN (
+                SELECT rowid FROM (
+                    SELECT rowid, ROW_NUMBER() OVER (
+                        PARTITION BY guild_id, topic ORDER BY updated DESC, rowid DESC
+                    ) AS position FROM chat
+                ) WHERE position > 1
+            )
+            """
+        )
+    )
+    if result.rowcount:
+        logger.warning("Removed %s duplicate Chat rows before adding a unique index", result.rowcount)
+
+
+async def init_db() -> None:
+    """
+    Create any missing tables, columns and indexes.
+    """
+
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.run_sync(_migrate)
+
+
+def get_session() -> AsyncSession:
+    """
+    Returns an async database session for queries 'n' things.
+
+    Objects stay usable after commit so callers never trigger a lazy refresh outside of an await.
+    """
+
+    return AsyncSession(engine, expire_on_commit=False)
+
+
+class ChatState(NamedTuple):
+    """
+    The latest response in a (guild, topic) conversation and how long its chain has run.
+    """
+
+    response_id: str
+    started: datetime
+    turns: int
+
+
+MISSING = object()  # ChatCache.get() for a key that was never loaded
+
+
+class ChatCache:
+    """
+    LRU of (guild_id, topic) -> ChatState, written through by update_chat().
+
+    Every write to the Chat table goes through update_chat(), so a cached entry is never stale. Topics without a row
+    are cached as None so repeat misses stay off the database too. Holds up to GENERAL.chat_cache_size entries.
+    """
+
+    def __init__(self) -> None:
+        self.entries: "OrderedDict[Tuple[int, str], Optional[ChatState]]" = OrderedDict()
+
+    def get(self, key: Tuple[int, str]) -> Union[ChatState, None, object]:
+        """
+        Return the cached state (possibly None), or MISSING when the key has not been loaded.
+        """
+        if key not in self.entries:
+            return MISSING
+
+        self.entries.move_to_end(key)
+        return self.entries[key]
 
-    return Session(engine)
+    def put(self, key: Tuple[int, str], state: Optional[ChatState]) -> None:
+        self.entries[key] = state
+        self.entries.move_to_end(key)
 
+        while len(self.entries) > max(get_settings().general.chat_cache_size, 1):
+            self.entries.popitem(last=False)
 
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+chat_cache = ChatCache()
+
+
+def chat_limits(context: CommandContext) -> Tuple[float, int]:
+    """
+    (expiry minutes, max turns) for a conversation, from [CHAT_EXPIRY] and [CHAT_TURNS] by topic, then by command
+    name, falling back to the GENERAL defaults. Zero means unlimited.
+    """
+    settings = get_settings()
+    topic = context.params.get("topic")
+
+    expiry = settings.chat_expiry.get(topic, settings.chat_expiry.get(context.command_name))
+    turns = settings.chat_turns.get(topic, settings.chat_turns.get(context.command_name))
+
+    return (
+        settings.general.chat_expiry_minutes if expiry is None else expiry,
+        settings.general.chat_max_turns if turns is None else turns,
+    )
+
+
+def _chat_state(record: Optional[Chat]) -> Optional[ChatState]:
+    if record is None:
+        return None
+
+    # rows written before started/turns existed count as a fresh one-turn chain
+    return ChatState(response_id=record.response_id, started=record.started or record.updated, turns=record.turns or 1)
+
+
+@timed_db
 async def get_response_id(context: CommandContext) -> Union[str, None]:
     """
     Looks for a previous reponse id if one exists for a given "command" in the Chat table
+
+    Only keep_chatting requests continue a conversation, and only while it is within its expiry and turn limits.
     """
 
-    with get_session() as session:
-        statement = (
-            select(Chat).where(Chat.guild_id == context.guild_id).where(Chat.topic == context.params.get("topic"))
-        )
-        results = session.exec(statement=statement)
-        response_record = results.one_or_none()
+    # special case for user chat completions
+    if not context.params.get("keep_chatting"):
+        return None
+
+    key = (context.guild_id, context.params.get("topic"))
+    state = chat_cache.get(key)
+
+    if state is MISSING:
+        async with get_session() as session:
+            statement = select(Chat).where(Chat.guild_id == key[0]).where(Chat.topic == key[1])
+            results = await session.exec(statement=statement)
+            state = _chat_state(results.one_or_none())
+
+        chat_cache.put(key, state)
 
-        # special case for user chat completions
-        if not context.params.get("keep_chatting"):
-            return None
+    if state is None:
+        return None
 
-        return response_record.response_id if response_record else None
+    expiry_minutes, max_turns = chat_limits(context)
 
+    if expiry_minutes and datetime.now() - state.started > timedelta(minutes=expiry_minutes):
+        return None
+    if max_turns and state.turns >= max_turns:
+        return None
 
-async def update_chat(response_id: str, context: CommandContext) -> None:
+    return state.response_id
+
+
+@timed_db
+async def update_chat(response_id: str, context: CommandContext, continued: bool = False) -> None:
     """
     Update the command's record in the Chat table.
+
+    One upsert per turn; `continued` extends the current chain, otherwise a new chain starts. The result is written
+    through to the chat cache.
     """
 
-    with get_session() as session:
-        statement = (
-            select(Chat).where(Chat.guild_id == context.guild_id).where(Chat.topic == context.params.get("topic"))
-        )
-        results = session.exec(statement=statement)
-        response = results.one_or_none()
-
-        if response:
-            response.response_id = response_id
-            response.updated = datetime.now()
-            session.add(response)
-            session.commit()
-        else:
-            entry = Chat(
-                response_id=response_id,
-                topic=context.params.get("topic"),
-                guild_id=context.guild_id,
-                updated=datetime.now(),
-            )
-            session.add(entry)
-            session.commit()
+    key = (context.guild_id, context.params.get("topic"))
+    now = datetime.now()
+
+    statement = sqlite_insert(Chat).values(
+        response_id=response_id, topic=key[1], guild_id=key[0], updated=now, started=now, turns=1
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[Chat.guild_id, Chat.topic],
+        set_={
+            "response_id": response_id,
+            "updated": now,
+            "started": func.coalesce(Chat.started, Chat.updated) if continued else now,
+            "turns": func.coalesce(Chat.turns, 1) + 1 if continued else 1,
+        },
+    ).returning(Chat.started, Chat.turns)
+
+    async with get_session() as session:
+        result = await session.execute(statement)
+        started, turns = result.one()
+        await session.commit()
+
+    chat_cache.put(key, ChatState(response_id=response_id, started=started, turns=turns))
+
 
-    return
+def get_cipher() -> Fernet:
+    """
+    Build the Fernet cipher from FERNET_KEY once and reuse it.
+    """
+    global _cipher  # pylint: disable=global-statement
+
+    if _cipher is None:
+        fernet_key = os.getenv("FERNET_KEY")
+
+        if not fernet_key:
+            raise ValueError("FERNET_KEY environment variable not set!")
+
+        _cipher = Fernet(fernet_key.encode())
+
+    return _cipher
+
+
+def invalidate_api_key(guild_id: Optional[int] = None) -> None:
+    """
+    Forget a guild's decrypted API key, or every cached key when no guild is given.
+    """
+    if guild_id is None:
+        _api_key_cache.clear()
+    else:
+        _api_key_cache.pop(guild_id, None)
 
 
+@timed_db
 async def get_api_key(guild_id: int) -> str:
     """
     Retrieve the top-secret API key from the incredibly secure database.
-    """
-    fernet_key = os.getenv("FERNET_KEY")
 
-    if not fernet_key:
-        raise ValueError("FERNET_KEY environment variable not set!")
+    Decrypted keys are cached for API_KEY_TTL_SECONDS. Keys are loaded by a separate `python db_utils.py` run, so the
+    bot only sees a changed key once that expires, or right away after the /reload_keys admin command.
+    """
+    cached = _api_key_cache.get(guild_id)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
 
-    cipher = Fernet(fernet_key.encode())
+    cipher = get_cipher()
 
-    with get_session() as session:
+    async with get_session() as session:
         statement = select(Key).where(Key.guild_id == guild_id)
-        results = session.exec(statement=statement)
+        results = await session.exec(statement=statement)
         key_record = results.first()
 
         if not key_record:
             raise ValueError(f"No API token found for guild_id: {guild_id}")
 
-        return cipher.decrypt(key_record.api_key.encode()).decode()
+        api_key = cipher.decrypt(key_record.api_key.encode()).decode()
 
+    _api_key_cache[guild_id] = (api_key, time.monotonic() + API_KEY_TTL_SECONDS)
+    return api_key
 
+
+@timed_db
 async def get_user_credits(user_id: int) -> int:
     """
     Return a user's credits
     """
 
-    with get_session() as session:
+    async with get_session() as session:
         statement = select(Credits).where(Credits.user_id == user_id)
-        results = session.exec(statement=statement)
+        results = await session.exec(statement=statement)
         user_record = results.one_or_none()
 
         if user_record:
@@ -187,50 +556,316 @@ async def get_user_credits(user_id: int) -> int:
             updated=datetime.now(),
         )
         session.add(entry)
-        session.commit()
+        await session.commit()
 
         return 0
 
 
+@timed_db
 async def add_credits(user_id: int, num_credits: int) -> int:
     """
     Add credits to user's balance and return the new value
+
+    A single relative upsert, so it can't write back a stale balance over a concurrent reservation.
     """
 
-    with get_session() as session:
-        statement = select(Credits).where(Credits.user_id == user_id)
-        results = session.exec(statement=statement)
-        user_record = results.one_or_none()
+    now = datetime.now()
+    statement = sqlite_insert(Credits).values(user_id=user_id, credits=num_credits, updated=now)
+    statement = statement.on_conflict_do_update(
+        index_elements=[Credits.user_id],
+        set_={"credits": Credits.credits + num_credits, "updated": now},
+    ).returning(Credits.credits)
 
-        if user_record:
-            user_record.credits += num_credits
-            new_credits = user_record.credits
-            user_record.updated = datetime.now()
-            session.add(user_record)
-            session.commit()
-
-            return new_credits
-
-        else:
-            entry = Credits(
-                user_id=user_id,
-                credits=num_credits,
-                updated=datetime.now(),
+    async with get_session() as session:
+        result = await session.execute(statement)
+        new_credits = result.scalar_one()
+        await session.commit()
+
+    return new_credits
+
+
+@timed_db
+async def reserve_credits(user_id: int, amount: int, guild_id: Optional[int] = None) -> Optional[CreditReservation]:
+    """
+    Debit credits into a held reservation, or return None if the user can't cover it.
+
+    The debit is a single conditional UPDATE, so concurrent reservations can never overdraw a balance.
+    """
+
+    async with get_session() as session:
+        if amount > 0:
+            statement = (
+                update(Credits)
+                .where(col(Credits.user_id) == user_id)
+                .where(col(Credits.credits) >= amount)
+                .values(credits=col(Credits.credits) - amount, updated=datetime.now())
             )
-            session.add(entry)
-            session.commit()
+            result = await session.exec(statement=statement)
 
-            return num_credits
+            if result.rowcount != 1:
+                await session.rollback()
+                return None
 
+        reservation = CreditReservation(user_id=user_id, guild_id=guild_id, amount=amount)
+        session.add(reservation)
+        await session.commit()
+        await session.refresh(reservation)
+
+    return reservation
+
+
+@timed_db
+async def settle_credits(reservation_id: int, keep: Optional[int] = None) -> int:
+    """
+    Keep the credits held by a reservation and return the user's remaining balance
+
+    With `keep`, only that many of the held credits are charged and the rest go back to the user in the same
+    transaction, e.g. when only some images of a batch were generated.
+    """
+
+    async with get_session() as session:
+        reservation = await session.get(CreditReservation, reservation_id)
+        held = reservation.amount
+        keep = held if keep is None else min(max(keep, 0), held)
+
+        statement = (
+            update(CreditReservation)
+            .where(col(CreditReservation.id) == reservation_id)
+            .where(col(CreditReservation.status) == "held")
+            .values(status="settled", amount=keep, updated=datetime.now())
+        )
+        result = await session.exec(statement=statement)
+        settled = result.rowcount == 1
+
+        if settled and keep < held:
+            statement = (
+                update(Credits)
+                .where(col(Credits.user_id) == reservation.user_id)
+                .values(credits=col(Credits.credits) + held - keep, updated=datetime.now())
+            )
+            await session.exec(statement=statement)
+
+        await session.commit()
+
+        if settled:
+            CREDITS_CHARGED.inc(keep)
+            if keep < held:
+                CREDITS_REFUNDED.inc(held - keep)
+
+        user_record = await session.get(Credits, reservation.user_id)
+        return user_record.credits if user_record else 0
+
+
+@timed_db
+async def refund_credits(reservation_id: int) -> int:
+    """
+    Give a held reservation back to the user and return their balance. Refunding twice is a no-op.
+    """
+
+    async with get_session() as session:
+        reservation = await session.get(CreditReservation, reservation_id)
+
+        statement = (
+            update(CreditReservation)
+            .where(col(CreditReservation.id) == reservation_id)
+            .where(col(CreditReservation.status) == "held")
+            .values(status="refunded", updated=datetime.now())
+        )
+        result = await session.exec(statement=statement)
+        refunded = result.rowcount == 1 and reservation.amount > 0
+
+        if refunded:
+            statement = (
+                update(Credits)
+                .where(col(Credits.user_id) == reservation.user_id)
+                .values(credits=col(Credits.credits) + reservation.amount, updated=datetime.now())
+            )
+            await session.exec(statement=statement)
+
+        await session.commit()
+
+        if refunded:
+            CREDITS_REFUNDED.inc(reservation.amount)
+
+        user_record = await session.get(Credits, reservation.user_id)
+        return user_record.credits if user_record else 0
+
+
+async def refund_orphaned_reservations(owned: Optional[Callable[[Optional[int]], bool]] = None) -> int:
+    """
+    Refund reservations left held by a crash, keeping those that belong to unfinished video jobs.
+
+    `owned` limits this to reservations whose guild_id it accepts, so a restarting shard process leaves reservations
+    held by generations still running in other processes alone.
+    """
+
+    async with get_session() as session:
+        job_reservations = (
+            select(VideoJob.reservation_id)
+            .where(col(VideoJob.status).in_(VIDEO_JOB_UNFINISHED))
+            .where(col(VideoJob.reservation_id).is_not(None))
+        )
+        statement = (
+            select(CreditReservation.id, CreditReservation.guild_id)
+            .where(col(CreditReservation.status) == "held")
+            .where(col(CreditReservation.id).not_in(job_reservations))
+        )
+        results = await session.exec(statement=statement)
+        orphans = [reservation_id for reservation_id, guild_id in results.all() if owned is None or owned(guild_id)]
+
+    for reservation_id in orphans:
+        await refund_credits(reservation_id)
+
+    return len(orphans)
 
-if __name__ == "__main__":
-    SQLModel.metadata.create_all(engine)
 
-    with get_session() as db_session:
-        with open("encrypted_api_keys.txt", mode="r", encoding="UTF-8") as f:
+@timed_db
+async def create_video_job(job: VideoJob) -> VideoJob:
+    """
+    Insert a new video job and return it with its id
+    """
+
+    async with get_session() as session:
+        session.add(job)
+        await session.commit()
+        await session.refresh(job)
+
+    return job
+
+
+@timed_db
+async def update_video_job(job: VideoJob, **changes: Any) -> VideoJob:
+    """
+    Apply changes to a video job and persist them
+    """
+
+    async with get_session() as session:
+        session.add(job)
+
+        for name, value in changes.items():
+            setattr(job, name, value)
+        job.updated = datetime.now()
+
+        await session.commit()
+
+    return job
+
+
+@timed_db
+async def get_unfinished_video_jobs() -> List[VideoJob]:
+    """
+    Return every video job that was queued, being submitted or submitted but never finished, oldest first
+    """
+
+    async with get_session() as session:
+        statement = select(VideoJob).where(col(VideoJob.status).in_(VIDEO_JOB_UNFINISHED)).order_by(VideoJob.id)
+        results = await session.exec(statement=statement)
+        return list(results.all())
+
+
+@timed_db
+async def record_generated_content(guild_id: int, command_name: str, path: str, size: int) -> int:
+    """
+    Index a newly written file (or a rewrite of an indexed one) and return how many bytes the guild's usage changed by
+
+    One upsert on the unique path, so two writes of the same path cannot both insert.
+    """
+
+    now = datetime.now()
+    statement = sqlite_insert(GeneratedContent).values(
+        guild_id=guild_id, command_name=command_name, path=path, size=size, created=now, last_access=now
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[GeneratedContent.path], set_={"size": size, "last_access": now}
+    )
+
+    async with get_session() as session:
+        results = await session.exec(select(GeneratedContent.size).where(GeneratedContent.path == path))
+        previous = results.one_or_none()
+        await session.execute(statement)
+        await session.commit()
+
+    return size - (previous or 0)
+
+
+@timed_db
+async def get_content_usage() -> Dict[int, int]:
+    """
+    Return the bytes of generated content stored for every guild
+    """
+
+    async with get_session() as session:
+        statement = select(GeneratedContent.guild_id, func.sum(GeneratedContent.size)).group_by(
+            GeneratedContent.guild_id
+        )
+        results = await session.exec(statement=statement)
+        return {guild_id: total or 0 for guild_id, total in results.all()}
+
+
+@timed_db
+async def get_content_created_before(
+    cutoff: datetime, guild_ids: List[int], limit: int = 500
+) -> List[GeneratedContent]:
+    """
+    Return the guilds' indexed files created before `cutoff`, oldest first
+    """
+
+    async with get_session() as session:
+        statement = (
+            select(GeneratedContent)
+            .where(GeneratedContent.created < cutoff)
+            .where(col(GeneratedContent.guild_id).in_(guild_ids))
+        )
+        results = await session.exec(statement=statement.order_by(GeneratedContent.created).limit(limit))
+        return list(results.all())
+
+
+@timed_db
+async def get_least_recent_content(guild_id: int, limit: int = 100) -> List[GeneratedContent]:
+    """
+    Return a guild's indexed files, least recently written first
+    """
+
+    async with get_session() as session:
+        statement = (
+            select(GeneratedContent)
+            .where(GeneratedContent.guild_id == guild_id)
+            .order_by(GeneratedContent.last_access)
+            .limit(limit)
+        )
+        results = await session.exec(statement=statement)
+        return list(results.all())
+
+
+@timed_db
+async def delete_generated_content(entry_ids: List[int]) -> None:
+    """
+    Drop files from the index
+    """
+
+    async with get_session() as session:
+        await session.exec(delete(GeneratedContent).where(col(GeneratedContent.id).in_(entry_ids)))
+        await session.commit()
+
+
+async def load_keys(file_name: str = "encrypted_api_keys.txt") -> None:
+    """
+    Create the tables and load encrypted API keys from a comma-separated file, replacing a guild's existing key.
+    """
+
+    await init_db()
+
+    async with get_session() as db_session:
+        with open(file_name, mode="r", encoding="UTF-8") as f:
             rows = f.readlines()
             for row in rows:
                 data_list = row.split(",")
                 db_entry = Key(guild_id=int(data_list[0]), guild_name=data_list[1], api_key=data_list[2])
-                db_session.add(db_entry)
-        db_session.commit()
+                await db_session.merge(db_entry)
+        await db_session.commit()
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(load_keys())
@@ -0,0 +1,217 @@
+"""
+Event-loop lag monitoring: a heartbeat, a watchdog thread that captures whatever is blocking the loop, and an
+on-demand sampling profiler
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from pathlib import Path
+from types import FrameType
+from typing import Deque, Dict, List, Optional
+
+from metrics import COMMAND_TASK_PREFIX, LOOP_LAG_SECONDS, LOOP_STALLS
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+MAX_STALLS = 50
+
+
+@dataclass(frozen=True)
+class Stall:
+    """
+    One stretch where the loop did not get back to the heartbeat in time.
+    """
+
+    started: datetime
+    seconds: float
+    command: str
+    stack: str
+
+
+@dataclass
+class Profile:
+    """
+    Stacks sampled from the loop thread, in the collapsed "frame;frame;frame count" format that py-spy's raw output,
+    flamegraph.pl, inferno and speedscope all read. Each stack starts with the command or task that was running.
+
+    The sampler needs the GIL to read the loop thread's stack, so a long C call (b64decode, a sqlite query) shows up on
+    the line right after it.
+    """
+
+    seconds: float
+    samples: int = 0
+    idle: int = 0
+    stacks: Counter = field(default_factory=Counter)
+    commands: Counter = field(default_factory=Counter)
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _frame_label(frame: FrameType) -> str:
+    return f"{frame.f_code.co_name} ({Path(frame.f_code.co_filename).name}:{frame.f_lineno})"
+
+
+def _idle(frame: FrameType) -> bool:
+    # an idle loop sits in its selector waiting for I/O
+    return frame.f_code.co_name == "select" and frame.f_code.co_filename.endswith("selectors.py")
+
+
+def _loop_internals(frame: FrameType) -> bool:
+    # Handle._run is where the loop hands over to a callback; everything above it is asyncio's own machinery
+    return frame.f_code.co_name == "_run" and Path(frame.f_code.co_filename).match("asyncio/events.py")
+
+
+class LoopMonitor:
+    """
+    Watches the event loop for callbacks that hog it.
+
+    A heartbeat task sleeps for [LOOP_MONITOR] sample_ms at a time and records how late it wakes up. A watchdog thread
+    checks on the heartbeat; once it is more than slow_callback_ms overdue the loop is blocked, so the watchdog logs
+    the loop thread's stack and the command whose task is running, while the blocking call is still on the stack.
+    """
+
+    def __init__(self) -> None:
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id: Optional[int] = None
+        self.last_beat = 0.0
+        self.stalls: Deque[Stall] = deque(maxlen=MAX_STALLS)
+        self.task: Optional[asyncio.Task] = None
+        self.thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._profiling = asyncio.Lock()
+
+    def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+
+        if not get_settings().loop_monitor.enabled:
+            return
+
+        self.last_beat = time.monotonic()
+        self._stopping.clear()
+        self.task = asyncio.create_task(self._heartbeat(), name="loop-monitor")
+        self.thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self.thread.start()
+
+    async def stop(self) -> None:
+        self._stopping.set()
+
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+        if self.thread:
+            await asyncio.to_thread(self.thread.join)
+            self.thread = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            interval = get_settings().loop_monitor.sample_ms / 1000
+            expected = self.loop.time() + interval
+            await asyncio.sleep(interval)
+
+            LOOP_LAG_SECONDS.observe(max(self.loop.time() - expected, 0.0))
+            self.last_beat = time.monotonic()
+
+    def running_command(self) -> str:
+        """
+        The command (or, failing that, the task) the loop is running. Safe to call from another thread.
+        """
+        task = asyncio.current_task(self.loop)
+        if task is None:
+            return "(no task)"
+
+        name = task.get_name()
+        return name[len(COMMAND_TASK_PREFIX) :] if name.startswith(COMMAND_TASK_PREFIX) else name
+
+    def loop_frame(self) -> Optional[FrameType]:
+        return sys._current_frames().get(self.loop_thread_id)  # pylint: disable=protected-access
+
+    def _watch(self) -> None:
+        reported_beat = None
+        stall: Optional[Stall] = None
+
+        while not self._stopping.is_set():
+            settings = get_settings().loop_monitor
+            interval = settings.sample_ms / 1000
+            threshold = settings.slow_callback_ms / 1000
+            self._stopping.wait(max(min(interval, threshold) / 2, 0.005))
+
+            beat = self.last_beat
+            overdue = time.monotonic() - beat - interval
+
+            # the heartbeat came back: close out the stall we were tracking
+            if stall is not None and beat != reported_beat:
+                seconds = beat - reported_beat - interval
+                self.stalls.append(replace(stall, seconds=seconds))
+                LOOP_STALLS.labels(command=stall.command).inc()
+                logger.info("Event loop unblocked after %.0f ms (%s)", seconds * 1000, stall.command)
+                stall = None
+
+            if stall is None and beat != reported_beat and overdue > threshold:
+                frame = self.loop_frame()
+                stack = "".join(traceback.format_stack(frame, limit=settings.stack_limit)) if frame else ""
+                stall = Stall(
+                    started=datetime.now(), seconds=overdue, command=self.running_command(), stack=stack.rstrip()
+                )
+                reported_beat = beat
+                logger.warning(
+                    "Event loop blocked for %.0f ms so far in %s:\n%s", overdue * 1000, stall.command, stall.stack
+                )
+
+    def worst_stalls(self, count: int = 5) -> List[Stall]:
+        return sorted(self.stalls, key=lambda stall: stall.seconds, reverse=True)[:count]
+
+    def stall_seconds_by_command(self) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        for stall in self.stalls:
+            totals[stall.command] = totals.get(stall.command, 0.0) + stall.seconds
+        return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+    def _sample(self, profile: Profile, interval: float) -> None:
+        deadline = time.monotonic() + profile.seconds
+
+        while time.monotonic() < deadline and not self._stopping.is_set():
+            if (frame := self.loop_frame()) is not None:
+                profile.samples += 1
+
+                if _idle(frame):
+                    profile.idle += 1
+                else:
+                    command = self.running_command()
+                    labels = []
+                    while frame is not None and not _loop_internals(frame):
+                        labels.append(_frame_label(frame))
+                        frame = frame.f_back
+
+                    profile.stacks[";".join([command, *reversed(labels)])] += 1
+                    profile.commands[command] += 1
+
+            time.sleep(interval)
+
+    async def profile(self, seconds: float) -> Profile:
+        """
+        Sample the loop thread's stack for `seconds` from a worker thread. One profile runs at a time.
+        """
+        if self.loop_thread_id is None:
+            self.loop_thread_id = threading.get_ident()
+            self.loop = asyncio.get_running_loop()
+
+        profile = Profile(seconds=seconds)
+        async with self._profiling:
+            await asyncio.to_thread(self._sample, profile, get_settings().loop_monitor.profile_interval_ms / 1000)
+
+        return profile
+
+
+loop_monitor = LoopMonitor()
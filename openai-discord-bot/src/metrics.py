@@ -0,0 +1,189 @@
+"""
+Prometheus metrics for commands, OpenAI calls, database helpers and Discord requests
+"""
+
+import asyncio
+import functools
+import re
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Iterator, TypeVar
+
+import aiohttp
+from discord import Interaction, app_commands
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+from settings import get_settings
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+COMMAND_SECONDS = Histogram(
+    "bot_command_seconds",
+    "Slash command handler latency",
+    ["command", "guild", "outcome"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+OPENAI_SECONDS = Histogram(
+    "bot_openai_request_seconds",
+    "OpenAI API call latency",
+    ["call", "model", "guild", "outcome"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+DB_SECONDS = Histogram(
+    "bot_db_seconds",
+    "Database helper latency",
+    ["function", "outcome"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+DISCORD_SECONDS = Histogram(
+    "bot_discord_request_seconds",
+    "Discord HTTP request latency (messages, followups, edits, deletes)",
+    ["method", "route", "outcome"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+CREDITS_CHARGED = Counter("bot_credits_charged_total", "Credits kept after successful generations")
+CREDITS_REFUNDED = Counter("bot_credits_refunded_total", "Held credits given back after failed generations")
+SPEECH_CACHE_LOOKUPS = Counter("bot_speech_cache_lookups_total", "Text-to-speech cache lookups", ["result"])
+OPENAI_RETRIES = Counter(
+    "bot_openai_retries_total", "OpenAI calls retried after a transient error", ["call", "model", "reason"]
+)
+OPENAI_HEDGES = Counter(
+    "bot_openai_hedges_total",
+    "Backup requests sent for slow OpenAI calls, by which copy answered",
+    ["call", "model", "winner"],
+)
+CIRCUIT_TRANSITIONS = Counter(
+    "bot_openai_circuit_transitions_total", "OpenAI circuit breaker state changes", ["model", "state"]
+)
+CIRCUIT_STATE = Gauge(
+    "bot_openai_circuit_state", "OpenAI circuit breaker state (0 closed, 1 half-open, 2 open)", ["model"]
+)
+CIRCUIT_REJECTIONS = Counter(
+    "bot_openai_circuit_rejections_total", "OpenAI calls failed fast because the model's circuit was open", ["model"]
+)
+LOOP_LAG_SECONDS = Histogram(
+    "bot_event_loop_lag_seconds",
+    "How late the event loop woke a sleeping heartbeat",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+LOOP_STALLS = Counter(
+    "bot_event_loop_stalls_total", "Callbacks that blocked the event loop past the threshold", ["command"]
+)
+
+# tasks running a slash command are renamed so stalls and profiles can name the command
+COMMAND_TASK_PREFIX = "command:"
+
+
+def _outcome(error: BaseException) -> str:
+    return "cancelled" if isinstance(error, asyncio.CancelledError) else type(error).__name__
+
+
+@contextmanager
+def observe(histogram: Histogram, **labels: Any) -> Iterator[None]:
+    """
+    Time the block into `histogram`, labelled with the outcome ("success" or the exception's name).
+    """
+    start = time.perf_counter()
+    outcome = "success"
+    try:
+        yield
+    except BaseException as e:
+        outcome = _outcome(e)
+        raise
+    finally:
+        histogram.labels(outcome=outcome, **{name: str(value) for name, value in labels.items()}).observe(
+            time.perf_counter() - start
+        )
+
+
+def observe_openai(call: str, model: str, guild_id: int):
+    """
+    Time one OpenAI API call.
+    """
+    return observe(OPENAI_SECONDS, call=call, model=model, guild=guild_id)
+
+
+def timed_db(func: F) -> F:
+    """
+    Decorator timing an async database helper.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with observe(DB_SECONDS, function=func.__name__):
+            return await func(*args, **kwargs)
+
+    return wrapper  # type: ignore[return-value]
+
+
+class InstrumentedCommandTree(app_commands.CommandTree):
+    """
+    CommandTree that records how long every slash command handler runs, and names the task running it after the
+    command.
+    """
+
+    async def interaction_check(self, interaction: Interaction, /) -> bool:
+        interaction.extras["started"] = time.perf_counter()
+
+        # the check runs in the task that goes on to run the command
+        if interaction.command is not None and (task := asyncio.current_task()) is not None:
+            task.set_name(COMMAND_TASK_PREFIX + interaction.command.qualified_name)
+
+        return True
+
+    def record(self, interaction: Interaction, outcome: str) -> None:
+        if (started := interaction.extras.get("started")) is None or interaction.command is None:
+            return
+
+        COMMAND_SECONDS.labels(
+            command=interaction.command.qualified_name, guild=str(interaction.guild_id), outcome=outcome
+        ).observe(time.perf_counter() - started)
+
+    async def on_error(self, interaction: Interaction, error: app_commands.AppCommandError, /) -> None:
+        original = getattr(error, "original", error)
+        self.record(interaction, outcome=_outcome(original))
+        await super().on_error(interaction, error)
+
+
+# interaction tokens and snowflakes would make every request its own label
+_SNOWFLAKE = re.compile(r"/\d{15,}")
+_TOKEN = re.compile(r"/[\w-]{60,}")
+
+
+def discord_trace_config() -> aiohttp.TraceConfig:
+    """
+    aiohttp tracing for the session discord.py uses for every REST call, interaction responses included.
+    """
+
+    async def on_request_start(_session, context: SimpleNamespace, _params) -> None:
+        context.started = time.perf_counter()
+
+    def record(context: SimpleNamespace, method: str, url, outcome: str) -> None:
+        route = _TOKEN.sub("/{token}", _SNOWFLAKE.sub("/{id}", url.path))
+        DISCORD_SECONDS.labels(method=method, route=route, outcome=outcome).observe(
+            time.perf_counter() - context.started
+        )
+
+    async def on_request_end(_session, context: SimpleNamespace, params: aiohttp.TraceRequestEndParams) -> None:
+        record(context, params.method, params.url, outcome=str(params.response.status))
+
+    async def on_request_exception(
+        _session, context: SimpleNamespace, params: aiohttp.TraceRequestExceptionParams
+    ) -> None:
+        record(context, params.method, params.url, outcome=_outcome(params.exception))
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
+
+
+def start_metrics_server(port_offset: int = 0) -> None:
+    """
+    Serve /metrics on [METRICS] address:port when enabled. Shard processes on one host add their index to the port.
+    """
+    settings = get_settings().metrics
+    if settings.enabled:
+        start_http_server(port=settings.port + port_offset, addr=settings.address)
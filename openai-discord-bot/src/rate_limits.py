@@ -0,0 +1,188 @@
+"""
+Per-guild, per-model rate limiting driven by [OPENAI_MODEL_LIMITS]
+"""
+
+import asyncio
+import re
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, Mapping, Optional, Tuple
+
+from openai import RateLimitError
+
+from settings import get_settings
+
+QueuedCallback = Callable[[int], Awaitable[None]]
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: str) -> float:
+    """
+    Parse OpenAI reset durations such as "20ms", "1s" or "6m0s" into seconds.
+    """
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in _DURATION_PART.findall(value))
+
+
+def retry_after_seconds(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    Read how long to back off from a response's Retry-After style headers.
+    """
+    if value := headers.get("retry-after-ms"):
+        return float(value) / 1000
+    if value := headers.get("retry-after"):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    if headers.get("x-ratelimit-remaining-requests") == "0" and (value := headers.get("x-ratelimit-reset-requests")):
+        return parse_duration(value)
+    return None
+
+
+class TokenBucket:
+    """
+    A token bucket refilled at `per_minute` requests per minute, with a strict FIFO line for callers that have to
+    wait. OpenAI's own rate-limit responses can pause the bucket with block_for().
+    """
+
+    def __init__(self, per_minute: int) -> None:
+        self.per_minute = per_minute
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.dispatcher: Optional[asyncio.Task] = None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(float(self.per_minute), self.tokens + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def _wait_time(self) -> float:
+        """
+        Seconds until a token is available, after refilling; zero means one can be taken now.
+        """
+        self._refill()
+        blocked = self.blocked_until - time.monotonic()
+        if blocked > 0:
+            return blocked
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) * 60 / self.per_minute
+
+    async def acquire(self, on_queued: Optional[QueuedCallback] = None) -> None:
+        """
+        Take a token, waiting in line behind earlier callers if none is free.
+        """
+        if not self.waiters and self._wait_time() == 0:
+            self.tokens -= 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self._dispatch())
+
+        try:
+            if on_queued:
+                await on_queued(len(self.waiters))
+            await waiter
+        except BaseException:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+            raise
+
+    async def _dispatch(self) -> None:
+        while self.waiters:
+            if delay := self._wait_time():
+                await asyncio.sleep(delay)
+                continue
+
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.tokens -= 1
+                waiter.set_result(None)
+
+    def block_for(self, seconds: float) -> None:
+        """
+        Hold every caller back for `seconds`, e.g. after a 429 with Retry-After.
+        """
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    def observe(self, headers: Mapping[str, str]) -> None:
+        """
+        Adapt to OpenAI's rate-limit headers from any response.
+        """
+        if seconds := retry_after_seconds(headers):
+            self.block_for(seconds)
+
+
+class RateLimiter:
+    """
+    One TokenBucket per (guild, limited model).
+
+    A model is limited by the longest OPENAI_MODEL_LIMITS key it starts with, so `gpt-image-1` also covers
+    `gpt-image-1.5` and `gpt-image-1-mini`.
+    """
+
+    def __init__(self) -> None:
+        self.buckets: Dict[Tuple[int, str], TokenBucket] = {}
+
+    @staticmethod
+    def limit_for(model: str) -> Optional[Tuple[str, int]]:
+        limits = get_settings().model_limits
+        matches = [key for key in limits if model.startswith(key)]
+        if not matches:
+            return None
+
+        key = max(matches, key=len)
+        return key, limits[key]
+
+    def bucket(self, guild_id: int, model: str) -> Optional[TokenBucket]:
+        if not (limit := self.limit_for(model)):
+            return None
+
+        key, per_minute = limit
+        bucket = self.buckets.get((guild_id, key))
+
+        if bucket is None:
+            bucket = self.buckets[(guild_id, key)] = TokenBucket(per_minute)
+        else:
+            # follow config reloads without dropping anyone already in line
+            bucket.per_minute = per_minute
+
+        return bucket
+
+    def observe(self, guild_id: int, model: str, headers: Mapping[str, str]) -> None:
+        """
+        Feed a successful response's rate-limit headers back into the matching bucket.
+        """
+        if bucket := self.bucket(guild_id=guild_id, model=model):
+            bucket.observe(headers)
+
+    @asynccontextmanager
+    async def slot(
+        self, guild_id: int, model: str, on_queued: Optional[QueuedCallback] = None
+    ) -> AsyncIterator[Optional[TokenBucket]]:
+        """
+        Wait for a turn to call `model` for this guild. A 429 raised inside the block pauses the bucket.
+        """
+        bucket = self.bucket(guild_id=guild_id, model=model)
+
+        if bucket:
+            await bucket.acquire(on_queued=on_queued)
+
+        try:
+            yield bucket
+        except RateLimitError as e:
+            if bucket:
+                bucket.block_for(retry_after_seconds(e.response.headers) or 60 / bucket.per_minute)
+            raise
+
+
+rate_limiter = RateLimiter()
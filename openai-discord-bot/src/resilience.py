@@ -0,0 +1,179 @@
+"""
+Retry, circuit breaking and request hedging for OpenAI calls, driven by [RESILIENCE]
+"""
+
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from openai import APIConnectionError, APIStatusError, RateLimitError
+
+from metrics import CIRCUIT_REJECTIONS, CIRCUIT_STATE, CIRCUIT_TRANSITIONS
+from rate_limits import retry_after_seconds
+from settings import get_settings
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a model whose circuit is open.
+    """
+
+    def __init__(self, model: str, retry_in: float) -> None:
+        super().__init__(f"OpenAI looks unavailable for {model}; not retrying for another {retry_in:.0f} seconds")
+        self.model = model
+        self.retry_in = retry_in
+
+
+def is_outage(error: BaseException) -> bool:
+    """
+    Whether an error says the service is unhealthy (5xx, timeouts, dropped connections), as opposed to a bad request
+    or this key being rate limited.
+    """
+    if isinstance(error, APIConnectionError):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+
+def retry_reason(error: BaseException) -> Optional[str]:
+    """
+    A short label for a retryable error, or None if retrying would not help.
+    """
+    if isinstance(error, RateLimitError):
+        # an exhausted quota or billing limit does not clear up on its own
+        return None if error.code == "insufficient_quota" else "rate_limited"
+    if isinstance(error, APIConnectionError):
+        return "connection"
+    if isinstance(error, APIStatusError) and error.status_code >= 500:
+        return f"http_{error.status_code}"
+    return None
+
+
+def retry_delay(error: BaseException, attempt: int, idempotent: bool = True) -> Optional[float]:
+    """
+    Seconds to wait before retrying after `error` on the `attempt`-th try, or None to give up.
+
+    OpenAI's Retry-After / rate-limit reset headers are honoured when present, with a little jitter so everyone held
+    back by the same 429 does not return at once; otherwise the delay is "full jitter" exponential backoff. Calls that
+    are not safe to repeat are only retried after a 429, which OpenAI did not act on.
+    """
+    if (reason := retry_reason(error)) is None or (not idempotent and reason != "rate_limited"):
+        return None
+
+    settings = get_settings().resilience
+    headers = error.response.headers if isinstance(error, APIStatusError) else {}
+
+    if (suggested := retry_after_seconds(headers)) is not None:
+        if suggested > settings.backoff_max_seconds:
+            return None
+        return suggested + random.uniform(0, settings.backoff_base_seconds)
+
+    ceiling = min(settings.backoff_max_seconds, settings.backoff_base_seconds * 2 ** (attempt - 1))
+    return random.uniform(0, ceiling)
+
+
+class CircuitBreaker:
+    """
+    Stops calls to one model after [RESILIENCE] breaker_failures outage errors in a row.
+
+    While open, calls fail fast with CircuitOpenError. After breaker_reset_seconds one trial call is let through
+    (half-open): success closes the circuit, another outage error opens it again. 429s and bad requests say nothing
+    about the model's health and leave the count alone.
+    """
+
+    def __init__(self, model: str) -> None:
+        self.model = model
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_running = False
+
+    def _transition(self, state: str) -> None:
+        self.state = state
+        CIRCUIT_TRANSITIONS.labels(model=self.model, state=state).inc()
+        CIRCUIT_STATE.labels(model=self.model).set(_STATE_VALUES[state])
+
+    def before_call(self) -> None:
+        """
+        Let a call through or raise CircuitOpenError.
+        """
+        if self.state == OPEN:
+            retry_in = self.opened_at + get_settings().resilience.breaker_reset_seconds - time.monotonic()
+            if retry_in > 0:
+                CIRCUIT_REJECTIONS.labels(model=self.model).inc()
+                raise CircuitOpenError(self.model, retry_in)
+            self._transition(HALF_OPEN)
+
+        if self.state == HALF_OPEN:
+            # only the trial call goes through until it tells us whether the model is back
+            if self.trial_running:
+                CIRCUIT_REJECTIONS.labels(model=self.model).inc()
+                raise CircuitOpenError(self.model, 0)
+            self.trial_running = True
+
+    def record(self, error: Optional[BaseException]) -> None:
+        """
+        Count the outcome of a call that before_call() let through.
+        """
+        self.trial_running = False
+
+        if error is None:
+            self.failures = 0
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+        elif is_outage(error):
+            self.failures += 1
+            threshold = get_settings().resilience.breaker_failures
+            if self.state == HALF_OPEN or (threshold and self.failures >= threshold and self.state == CLOSED):
+                self.opened_at = time.monotonic()
+                self._transition(OPEN)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def breaker_for(model: str) -> CircuitBreaker:
+    breaker = _breakers.get(model)
+    if breaker is None:
+        breaker = _breakers[model] = CircuitBreaker(model)
+    return breaker
+
+
+async def hedged(func: Callable[[], Awaitable[T]], delay: float) -> Tuple[T, Optional[str]]:
+    """
+    Run func(), and if it has not finished after `delay` seconds run it a second time alongside. The first copy to
+    succeed wins and the other is cancelled; an error only surfaces once both copies have failed.
+
+    Returns the result and which copy produced it ("primary" or "hedge"), or None as the winner if no hedge was sent.
+    """
+    primary = asyncio.ensure_future(func())
+    tasks = {primary: "primary"}
+
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result(), None
+
+        tasks[asyncio.ensure_future(func())] = "hedge"
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result(), tasks[task]
+                error = error or task.exception()
+
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,252 @@
+"""
+Parsed-once settings from config.ini
+"""
+
+import asyncio
+import os
+import signal
+import time
+from configparser import ConfigParser
+from dataclasses import dataclass, field, fields
+from typing import Dict, Optional, Type, TypeVar
+
+CONFIG_FILE_NAME = "config.ini"
+MTIME_CHECK_SECONDS = 5.0
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class GeneralSettings:
+    """
+    [GENERAL]
+    """
+
+    session_strftime: str = "%Y-%m-%d - %A"
+    clean_concurrency: int = 3
+    max_clean_minutes: int = 1440
+    talk_prefetch: int = 2
+    audit_flush_ms: int = 250
+    audit_batch_size: int = 100
+    video_workers: int = 2
+    video_poll_seconds: float = 10.0
+    video_poll_max_seconds: float = 60.0
+    chat_streaming: bool = True
+    chat_edit_seconds: float = 1.5
+    chat_cache_size: int = 1024
+    chat_expiry_minutes: float = 120.0
+    chat_max_turns: int = 25
+
+
+@dataclass(frozen=True)
+class OpenAIGeneralSettings:
+    """
+    [OPENAI_GENERAL]
+    """
+
+    speech_model: str = "tts-1"
+    speech_file_format: str = "wav"
+    speech_streaming: bool = True
+    speech_cache_mb: int = 512
+    speech_cache_transcode_minutes: float = 1440.0
+    speech_cache_codec: str = "opus"
+    vision_model: str = "gpt-5-mini"
+    vision_max_mb: int = 20
+    image_partial_images: int = 1
+    voice: str = "onyx"
+    max_output_tokens: int = 500
+
+
+@dataclass(frozen=True)
+class DiscordSettings:
+    """
+    [DISCORD]
+    """
+
+    embed_title: str = "B4NG AI Image Response"
+
+
+@dataclass(frozen=True)
+class MetricsSettings:
+    """
+    [METRICS]
+    """
+
+    enabled: bool = False
+    address: str = "127.0.0.1"
+    port: int = 9464
+
+
+@dataclass(frozen=True)
+class StorageSettings:
+    """
+    [STORAGE]
+    """
+
+    guild_quota_mb: int = 2048
+    max_age_days: float = 30.0
+    sweep_minutes: float = 60.0
+    backend: str = "local"
+    s3_bucket: str = ""
+    s3_prefix: str = ""
+    s3_endpoint_url: str = ""
+    s3_region: str = ""
+
+
+@dataclass(frozen=True)
+class LoopMonitorSettings:
+    """
+    [LOOP_MONITOR]
+    """
+
+    enabled: bool = True
+    sample_ms: float = 50.0
+    slow_callback_ms: float = 100.0
+    stack_limit: int = 30
+    profile_interval_ms: float = 5.0
+
+
+@dataclass(frozen=True)
+class ResilienceSettings:
+    """
+    [RESILIENCE]
+    """
+
+    max_attempts: int = 4
+    backoff_base_seconds: float = 0.5
+    backoff_max_seconds: float = 20.0
+    breaker_failures: int = 5
+    breaker_reset_seconds: float = 30.0
+    hedge_after_ms: float = 4000.0
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Every section of config.ini, typed and ready for attribute access.
+    """
+
+    general: GeneralSettings = field(default_factory=GeneralSettings)
+    openai_general: OpenAIGeneralSettings = field(default_factory=OpenAIGeneralSettings)
+    discord: DiscordSettings = field(default_factory=DiscordSettings)
+    metrics: MetricsSettings = field(default_factory=MetricsSettings)
+    storage: StorageSettings = field(default_factory=StorageSettings)
+    loop_monitor: LoopMonitorSettings = field(default_factory=LoopMonitorSettings)
+    resilience: ResilienceSettings = field(default_factory=ResilienceSettings)
+    model_limits: Dict[str, int] = field(default_factory=dict)
+    instructions: Dict[str, str] = field(default_factory=dict)
+    prompts: Dict[str, str] = field(default_factory=dict)
+    credits: Dict[str, int] = field(default_factory=dict)
+    chat_expiry: Dict[str, float] = field(default_factory=dict)
+    chat_turns: Dict[str, int] = field(default_factory=dict)
+
+
+def _section(config: ConfigParser, name: str, cls: Type[T]) -> T:
+    """
+    Build a section dataclass, casting each option to its field's type.
+    """
+    if not config.has_section(name):
+        return cls()
+
+    values = {}
+    for item in fields(cls):
+        if config.has_option(name, item.name):
+            if item.type is bool:
+                values[item.name] = config.getboolean(name, item.name)
+            else:
+                values[item.name] = item.type(config.get(name, item.name))
+
+    return cls(**values)
+
+
+def _items(config: ConfigParser, name: str) -> Dict[str, str]:
+    """
+    Return a section as a plain dict, or an empty one when it is missing.
+    """
+    return dict(config.items(name)) if config.has_section(name) else {}
+
+
+def load_settings(file_name: str = CONFIG_FILE_NAME) -> Settings:
+    """
+    Read and parse the configuration specified in the config ini
+    """
+    config = ConfigParser()
+    config.read(file_name)
+
+    return Settings(
+        general=_section(config, "GENERAL", GeneralSettings),
+        openai_general=_section(config, "OPENAI_GENERAL", OpenAIGeneralSettings),
+        discord=_section(config, "DISCORD", DiscordSettings),
+        metrics=_section(config, "METRICS", MetricsSettings),
+        storage=_section(config, "STORAGE", StorageSettings),
+        loop_monitor=_section(config, "LOOP_MONITOR", LoopMonitorSettings),
+        resilience=_section(config, "RESILIENCE", ResilienceSettings),
+        model_limits={key: int(value) for key, value in _items(config, "OPENAI_MODEL_LIMITS").items()},
+        instructions=_items(config, "OPENAI_INSTRUCTIONS"),
+        prompts=_items(config, "PROMPTS"),
+        credits={key: int(value) for key, value in _items(config, "OPENAI_CREDITS").items()},
+        chat_expiry={key: float(value) for key, value in _items(config, "CHAT_EXPIRY").items()},
+        chat_turns={key: int(value) for key, value in _items(config, "CHAT_TURNS").items()},
+    )
+
+
+class _SettingsCache:
+    """
+    Holds the current Settings and the mtime of the file they came from.
+    """
+
+    def __init__(self, file_name: str) -> None:
+        self.file_name = file_name
+        self.settings: Optional[Settings] = None
+        self.mtime: Optional[float] = None
+        self.checked_at = 0.0
+
+    def _file_mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.file_name).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def reload(self) -> Settings:
+        self.mtime = self._file_mtime()
+        self.settings = load_settings(self.file_name)
+        self.checked_at = time.monotonic()
+        return self.settings
+
+    def get(self) -> Settings:
+        if self.settings is None:
+            return self.reload()
+
+        # stat the file at most once every MTIME_CHECK_SECONDS
+        now = time.monotonic()
+        if now - self.checked_at >= MTIME_CHECK_SECONDS:
+            self.checked_at = now
+            if self._file_mtime() != self.mtime:
+                return self.reload()
+
+        return self.settings
+
+
+_cache = _SettingsCache(CONFIG_FILE_NAME)
+
+
+def get_settings() -> Settings:
+    """
+    Return the cached settings, re-reading config.ini only when its mtime changes.
+    """
+    return _cache.get()
+
+
+def reload_settings() -> Settings:
+    """
+    Force a re-read of config.ini.
+    """
+    return _cache.reload()
+
+
+def install_reload_signal(loop: asyncio.AbstractEventLoop) -> None:
+    """
+    Reload config.ini when the process receives SIGHUP (no-op where SIGHUP does not exist).
+    """
+    if hasattr(signal, "SIGHUP"):
+        loop.add_signal_handler(signal.SIGHUP, reload_settings)
@@ -0,0 +1,120 @@
+"""
+Gateway sharding: which shards this process runs, which guilds it owns, and a launcher for several shard processes
+"""
+
+import functools
+import os
+import signal
+import subprocess
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class ShardConfig:
+    """
+    SHARD_COUNT, SHARD_IDS and SHARD_PROCESS_INDEX from the environment.
+
+    With none of them set the process runs every shard Discord recommends and owns every guild.
+    """
+
+    shard_count: Optional[int] = None
+    shard_ids: Optional[Tuple[int, ...]] = None
+    process_index: int = 0
+
+    @property
+    def primary(self) -> bool:
+        """
+        The process that runs shard 0 does the once-per-deployment work, such as syncing slash commands.
+        """
+        return self.shard_ids is None or 0 in self.shard_ids
+
+    def owns_guild(self, guild_id: Optional[int]) -> bool:
+        """
+        Whether a guild's events arrive on one of this process' shards. Rows without a guild belong to the primary.
+        """
+        if guild_id is None:
+            return self.primary
+        if self.shard_count is None or self.shard_ids is None:
+            return True
+        return shard_for_guild(guild_id, self.shard_count) in self.shard_ids
+
+
+def shard_for_guild(guild_id: int, shard_count: int) -> int:
+    """
+    Discord's shard formula.
+    """
+    return (guild_id >> 22) % shard_count
+
+
+def _int_list(value: str) -> Tuple[int, ...]:
+    return tuple(int(part) for part in value.split(",") if part.strip())
+
+
+@functools.lru_cache(maxsize=None)
+def get_shard_config() -> ShardConfig:
+    """
+    Read the shard layout for this process once.
+    """
+    shard_count = os.getenv("SHARD_COUNT")
+    shard_ids = os.getenv("SHARD_IDS")
+
+    if shard_ids and not shard_count:
+        raise ValueError("SHARD_IDS requires SHARD_COUNT")
+
+    return ShardConfig(
+        shard_count=int(shard_count) if shard_count else None,
+        shard_ids=_int_list(shard_ids) if shard_ids else None,
+        process_index=int(os.getenv("SHARD_PROCESS_INDEX", "0")),
+    )
+
+
+def owns_guild(guild_id: Optional[int]) -> bool:
+    """
+    Whether this process owns a guild under the current shard layout.
+    """
+    return get_shard_config().owns_guild(guild_id)
+
+
+def split_shards(shard_count: int, processes: int) -> List[Tuple[int, ...]]:
+    """
+    Spread shards over processes round-robin so each process gets a similar share of guilds.
+    """
+    return [tuple(range(index, shard_count, processes)) for index in range(min(processes, shard_count))]
+
+
+def main() -> int:
+    """
+    Run SHARD_PROCESSES copies of app.py on this host, splitting SHARD_COUNT shards between them.
+
+    Every process shares database.db and generated_content/ in the working directory, and serves metrics on
+    [METRICS] port + its process index. SIGTERM, SIGINT and SIGHUP are passed on to every process.
+    """
+    shard_count = int(os.environ["SHARD_COUNT"])
+    processes = int(os.getenv("SHARD_PROCESSES", "1"))
+    app_path = Path(__file__).with_name("app.py")
+
+    children = []
+    for index, shard_ids in enumerate(split_shards(shard_count, processes)):
+        env = {
+            **os.environ,
+            "SHARD_COUNT": str(shard_count),
+            "SHARD_IDS": ",".join(map(str, shard_ids)),
+            "SHARD_PROCESS_INDEX": str(index),
+        }
+        children.append(subprocess.Popen([sys.executable, str(app_path)], env=env))  # pylint: disable=consider-using-with
+
+    def forward(signum, _frame) -> None:
+        for child in children:
+            child.send_signal(signum)
+
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, forward)
+
+    return max(child.wait() for child in children)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
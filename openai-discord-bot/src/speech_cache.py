@@ -0,0 +1,317 @@
+"""
+Content-addressed, size-bounded cache for text-to-speech audio
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from metrics import SPEECH_CACHE_LOOKUPS
+from settings import get_settings
+from storage import LocalBackend, storage
+
+logger = logging.getLogger(__name__)
+
+SPEECH_CACHE_DIR = Path("generated_content/speech_cache")
+
+# a .part file untouched for this long belongs to a generation that died, not one another process is writing
+STALE_PART_SECONDS = 3600
+
+# how often to look for cold WAVs to re-encode
+TRANSCODE_INTERVAL_SECONDS = 600
+
+# file suffix and ffmpeg output options for each OPENAI_GENERAL.speech_cache_codec
+TRANSCODE_CODECS = {
+    "opus": (".opus", ["-c:a", "libopus", "-b:a", "48k", "-f", "opus"]),
+    "flac": (".flac", ["-c:a", "flac", "-f", "flac"]),
+}
+
+
+class SpeechCache:
+    """
+    Stores one audio file per (text, voice, speech model, format), named by the hash of those values.
+
+    An in-memory LRU index tracks every file and its size; the least recently used files are deleted once the
+    directory grows past OPENAI_GENERAL.speech_cache_mb. The local files are what playback reads; with a remote
+    [STORAGE] backend every new entry is also uploaded there, and evicted entries are deleted from it.
+
+    WAVs unused for OPENAI_GENERAL.speech_cache_transcode_minutes are re-encoded to speech_cache_codec by a background
+    task when ffmpeg is available. The entry keeps its key; only the file it points to (key + codec suffix) changes.
+    """
+
+    def __init__(self, directory: Path = SPEECH_CACHE_DIR) -> None:
+        self.directory = directory
+        self.index: "OrderedDict[str, int]" = OrderedDict()  # key -> size in bytes
+        self.files: Dict[str, str] = {}  # key -> file name, for entries that were transcoded
+        self.used: Dict[str, float] = {}  # key -> when it was last written or read
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.transcoded = 0
+        self.task: Optional[asyncio.Task] = None
+        self._loaded = False
+        self._uploads: Set[asyncio.Task] = set()
+        self._upload_lock = asyncio.Lock()
+
+    @property
+    def max_bytes(self) -> int:
+        return get_settings().openai_general.speech_cache_mb * 1024 * 1024
+
+    @staticmethod
+    def key(text: str, voice: str, model: str, file_format: str) -> str:
+        digest = hashlib.sha256("\0".join((model, voice, file_format, text)).encode()).hexdigest()
+        return f"{digest}.{file_format}"
+
+    def path(self, key: str) -> Path:
+        return self.directory / self.files.get(key, key)
+
+    def _load(self) -> None:
+        """
+        Build the index from whatever is already on disk, oldest access first.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        entries = []
+        stale_before = time.time() - STALE_PART_SECONDS
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".part"):
+                # left behind by a generation that never finished; newer ones may still be in progress elsewhere
+                try:
+                    if entry.stat().st_mtime < stale_before:
+                        os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+            elif entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_atime, entry.name, stat.st_size))
+
+        # keys are "<digest>.<format>", so a second suffix marks a transcoded file
+        transcoded = {name.rsplit(".", 1)[0] for _, name, _ in entries if name.count(".") > 1}
+
+        for atime, name, size in sorted(entries):
+            key = name.rsplit(".", 1)[0] if name.count(".") > 1 else name
+            if key != name:
+                self.files[key] = name
+            elif key in transcoded:
+                # a transcode finished but the bot stopped before the WAV was removed
+                (self.directory / name).unlink(missing_ok=True)
+                continue
+
+            self.index[key] = size
+            self.used[key] = atime
+            self.total_bytes += size
+
+        self._loaded = True
+
+    def get(self, key: str) -> Optional[Path]:
+        """
+        Return the cached file for a key and mark it as recently used, or None on a miss.
+        """
+        if not self._loaded:
+            self._load()
+
+        # another shard process sharing the directory may have evicted or transcoded the file
+        if key in self.index and not self.path(key).exists():
+            self._forget(key)
+
+        if key not in self.index:
+            self.misses += 1
+            SPEECH_CACHE_LOOKUPS.labels(result="miss").inc()
+            return None
+
+        self.hits += 1
+        SPEECH_CACHE_LOOKUPS.labels(result="hit").inc()
+        self.index.move_to_end(key)
+        self.used[key] = time.time()
+        return self.path(key)
+
+    def temp_path(self, key: str) -> Path:
+        """
+        A unique path to write a new entry to before it is committed with add().
+        """
+        if not self._loaded:
+            self._load()
+
+        return self.directory / f"{key}.{uuid.uuid4().hex}.part"
+
+    def add(self, key: str, temp_path: Path) -> Path:
+        """
+        Move a finished temp file into the cache and evict old entries if it is over budget.
+        """
+        removed = []
+        if key in self.files:
+            # regenerated after another process dropped our copy; the new WAV replaces the transcoded file
+            removed.append(self.path(key))
+            removed[-1].unlink(missing_ok=True)
+        self._forget(key)
+
+        path = self.directory / key
+        os.replace(temp_path, path)
+
+        size = path.stat().st_size
+        self.total_bytes += size
+        self.index[key] = size
+        self.used[key] = time.time()
+
+        while self.total_bytes > self.max_bytes and len(self.index) > 1:
+            old_key = next(iter(self.index))
+            old_path = self.path(old_key)
+            self._forget(old_key)
+            old_path.unlink(missing_ok=True)
+            removed.append(old_path)
+            logger.debug("Evicted %s from the speech cache", old_key)
+
+        self._mirror(written=path, removed=removed)
+        return path
+
+    def _forget(self, key: str) -> None:
+        self.total_bytes -= self.index.pop(key, 0)
+        self.files.pop(key, None)
+        self.used.pop(key, None)
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self._run(), name="speech-cache-transcoder")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(TRANSCODE_INTERVAL_SECONDS)
+
+            try:
+                if transcoded := await self.transcode_cold():
+                    logger.info("Transcoded %s cold speech cache entries", transcoded)
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Speech cache transcoding failed")
+
+    async def transcode_cold(self) -> int:
+        """
+        Re-encode WAVs that have not been used for speech_cache_transcode_minutes, least recently used first, and
+        return how many were transcoded.
+        """
+        settings = get_settings().openai_general
+        if not settings.speech_cache_transcode_minutes or not shutil.which("ffmpeg"):
+            return 0
+        if settings.speech_cache_codec not in TRANSCODE_CODECS:
+            logger.warning("Unknown speech_cache_codec %r", settings.speech_cache_codec)
+            return 0
+
+        if not self._loaded:
+            self._load()
+
+        cutoff = time.time() - settings.speech_cache_transcode_minutes * 60
+        transcoded = 0
+        for key in list(self.index):
+            # the index is in order of use, so everything after the first warm entry is warm too
+            if key in self.index and self.used.get(key, 0) >= cutoff:
+                break
+            if key in self.index and key not in self.files and key.endswith(".wav"):
+                transcoded += await self._transcode(key, *TRANSCODE_CODECS[settings.speech_cache_codec])
+
+        self.transcoded += transcoded
+        return transcoded
+
+    async def _transcode(self, key: str, suffix: str, options: List[str]) -> bool:
+        source = self.directory / key
+        target = self.directory / f"{key}{suffix}"
+        temp_path = self.directory / f"{target.name}.{uuid.uuid4().hex}.part"
+        used = self.used.get(key)
+
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg",
+            "-nostdin",
+            "-loglevel",
+            "error",
+            "-y",
+            "-i",
+            str(source),
+            *options,
+            str(temp_path),
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _, stderr = await process.communicate()
+
+        if process.returncode != 0:
+            logger.warning("Could not transcode %s: %s", source, stderr.decode(errors="replace").strip())
+            self.discard(temp_path)
+            return False
+
+        # played, regenerated or evicted while ffmpeg ran: a reader may have the WAV open, so keep it
+        if self.used.get(key) != used or key not in self.index or key in self.files:
+            self.discard(temp_path)
+            return False
+
+        os.replace(temp_path, target)
+        size = target.stat().st_size
+        self.total_bytes += size - self.index[key]
+        self.index[key] = size
+        self.files[key] = target.name
+        source.unlink(missing_ok=True)
+
+        self._mirror(written=target, removed=[source])
+        return True
+
+    def _mirror(self, written: Optional[Path], removed: List[Path]) -> None:
+        """
+        Copy a new file to the [STORAGE] backend and delete removed ones from it, in the background.
+        """
+        backend = storage.backend
+        if isinstance(backend, LocalBackend):
+            # the cache directory is already under the local storage root
+            return
+
+        async def upload() -> None:
+            # one at a time and in order, so an eviction never overtakes the upload of the file it removes
+            async with self._upload_lock:
+                await copy()
+
+        async def copy() -> None:
+            try:
+                if written is not None:
+                    await backend.write(written.as_posix(), await asyncio.to_thread(written.read_bytes))
+                if removed:
+                    await backend.delete([path.as_posix() for path in removed])
+            except FileNotFoundError:
+                # evicted again before the upload started
+                pass
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Could not copy %s to storage", written)
+
+        task = asyncio.create_task(upload())
+        self._uploads.add(task)
+        task.add_done_callback(self._uploads.discard)
+
+    @staticmethod
+    def discard(temp_path: Path) -> None:
+        """
+        Drop an unfinished temp file.
+        """
+        temp_path.unlink(missing_ok=True)
+
+    async def stop(self) -> None:
+        """
+        Stop transcoding and wait for uploads that are still running.
+        """
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+        await asyncio.gather(*self._uploads, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.index),
+            "transcoded": self.transcoded,
+            "bytes": self.total_bytes,
+        }
+
+
+speech_cache = SpeechCache()
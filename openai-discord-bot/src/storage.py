@@ -0,0 +1,251 @@
+"""
+Generated-content storage: paths, the GeneratedContent index, per-guild quotas and a background sweeper
+"""
+
+import asyncio
+import io
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+import discord
+
+from db_utils import (
+    CommandContext,
+    GeneratedContent,
+    delete_generated_content,
+    get_content_created_before,
+    get_content_usage,
+    get_least_recent_content,
+    record_generated_content,
+)
+from settings import get_settings
+from sharding import owns_guild
+
+logger = logging.getLogger(__name__)
+
+CONTENT_ROOT = Path("generated_content")
+
+MULTIPART_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+class StorageBackend(ABC):
+    """
+    Where generated files are kept. Keys look like relative paths, e.g. generated_content/guild_1/.../image.png.
+    """
+
+    @abstractmethod
+    async def write(self, key: str, data: bytes) -> None:
+        """
+        Store `data` under `key`, replacing whatever was there.
+        """
+
+    @abstractmethod
+    async def delete(self, keys: List[str]) -> None:
+        """
+        Remove the given keys; ones that do not exist are ignored.
+        """
+
+
+class LocalBackend(StorageBackend):
+    """
+    Files on the local disk, relative to the working directory.
+    """
+
+    def __init__(self) -> None:
+        self._dirs: Set[Path] = set()
+
+    def _write(self, key: str, data: bytes) -> None:
+        path = Path(key)
+
+        # only the first file in a directory pays for the mkdir
+        if path.parent not in self._dirs:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._dirs.add(path.parent)
+
+        path.write_bytes(data)
+
+    async def write(self, key: str, data: bytes) -> None:
+        await asyncio.to_thread(self._write, key, data)
+
+    async def delete(self, keys: List[str]) -> None:
+        def unlink_all() -> None:
+            for key in keys:
+                Path(key).unlink(missing_ok=True)
+
+        await asyncio.to_thread(unlink_all)
+
+
+class S3Backend(StorageBackend):
+    """
+    An S3-compatible bucket (AWS, MinIO, R2, ...). Needs the optional boto3 package; credentials come from the usual
+    AWS environment variables or config files.
+
+    Objects over MULTIPART_CHUNK_BYTES are uploaded in parallel multipart chunks. boto3 is blocking, so every call runs
+    in a worker thread.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str = "", region: str = "") -> None:
+        try:
+            import boto3  # pylint: disable=import-outside-toplevel
+            from boto3.s3.transfer import TransferConfig  # pylint: disable=import-outside-toplevel
+        except ImportError as e:
+            raise RuntimeError("[STORAGE] backend = s3 needs boto3: pip install boto3") from e
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url or None, region_name=region or None)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=MULTIPART_CHUNK_BYTES, multipart_chunksize=MULTIPART_CHUNK_BYTES, max_concurrency=4
+        )
+
+    async def write(self, key: str, data: bytes) -> None:
+        await asyncio.to_thread(
+            self.client.upload_fileobj, io.BytesIO(data), self.bucket, self.prefix + key, Config=self.transfer_config
+        )
+
+    async def delete(self, keys: List[str]) -> None:
+        # DeleteObjects takes at most 1000 keys per call
+        for start in range(0, len(keys), 1000):
+            objects = [{"Key": self.prefix + key} for key in keys[start : start + 1000]]
+            await asyncio.to_thread(
+                self.client.delete_objects, Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True}
+            )
+
+
+def create_backend() -> StorageBackend:
+    """
+    Build the backend chosen by [STORAGE] backend.
+    """
+    settings = get_settings().storage
+
+    if settings.backend == "local":
+        return LocalBackend()
+    if settings.backend == "s3":
+        return S3Backend(
+            bucket=settings.s3_bucket,
+            prefix=settings.s3_prefix,
+            endpoint_url=settings.s3_endpoint_url,
+            region=settings.s3_region,
+        )
+
+    raise ValueError(f"Unknown [STORAGE] backend: {settings.backend}")
+
+
+class StorageManager:
+    """
+    Owns everything written under generated_content/.
+
+    Files are written through a StorageBackend (local disk or S3, per [STORAGE] backend). Every file is indexed in the
+    GeneratedContent table and its size added to an in-memory per-guild total, so quota
+    checks and usage reports never walk the directory tree. A sweeper task periodically removes files past
+    STORAGE.max_age_days and trims guilds over STORAGE.guild_quota_mb oldest-written first. Only guilds owned by
+    this shard process are tracked and swept.
+    """
+
+    def __init__(self, root: Path = CONTENT_ROOT, backend: Optional[StorageBackend] = None) -> None:
+        self.root = root
+        self._backend = backend
+        self.usage: Dict[int, int] = {}  # guild_id -> bytes
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def backend(self) -> StorageBackend:
+        if self._backend is None:
+            self._backend = create_backend()
+        return self._backend
+
+    def key(self, context: CommandContext, file_name: str) -> str:
+        """
+        Where a command's file is stored, grouped by guild, day and command.
+        """
+        ts = datetime.now().strftime(format="%Y-%m-%d - %A")
+        return (self.root / f"guild_{context.guild_id}" / ts / context.command_name / file_name).as_posix()
+
+    async def save(self, context: CommandContext, file_name: str, data: bytes) -> discord.File:
+        """
+        Store and index a generated file, returning it as an attachment read from memory rather than from storage.
+        """
+        key = self.key(context=context, file_name=file_name)
+        await self.backend.write(key, data)
+
+        delta = await record_generated_content(
+            guild_id=context.guild_id, command_name=context.command_name, path=key, size=len(data)
+        )
+        self.usage[context.guild_id] = self.usage.get(context.guild_id, 0) + delta
+
+        return attachment(data, file_name)
+
+    def usage_for(self, guild_id: int) -> int:
+        return self.usage.get(guild_id, 0)
+
+    async def start(self) -> None:
+        self.usage = {guild_id: size for guild_id, size in (await get_content_usage()).items() if owns_guild(guild_id)}
+        self.task = asyncio.create_task(self._run(), name="storage-sweeper")
+
+    async def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(get_settings().storage.sweep_minutes * 60)
+
+            try:
+                await self.sweep()
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Storage sweep failed")
+
+    async def sweep(self) -> Dict[str, int]:
+        """
+        Run one round of expiry and quota trimming.
+        """
+        settings = get_settings().storage
+        stats = {"expired": 0, "evicted": 0}
+
+        if settings.max_age_days:
+            cutoff = datetime.now() - timedelta(days=settings.max_age_days)
+            while entries := await get_content_created_before(cutoff, guild_ids=list(self.usage)):
+                await self._delete(entries)
+                stats["expired"] += len(entries)
+
+        if settings.guild_quota_mb:
+            quota = settings.guild_quota_mb * 1024 * 1024
+            for guild_id in [guild_id for guild_id, size in self.usage.items() if size > quota]:
+                while self.usage_for(guild_id) > quota and (entries := await get_least_recent_content(guild_id)):
+                    over = self.usage_for(guild_id) - quota
+                    victims = []
+                    for entry in entries:
+                        if over <= 0:
+                            break
+                        victims.append(entry)
+                        over -= entry.size
+
+                    await self._delete(victims)
+                    stats["evicted"] += len(victims)
+
+        if any(stats.values()):
+            logger.info("Storage sweep: %s", stats)
+
+        return stats
+
+    async def _delete(self, entries: List[GeneratedContent]) -> None:
+        await self.backend.delete([entry.path for entry in entries])
+        await delete_generated_content([entry.id for entry in entries])
+
+        for entry in entries:
+            self.usage[entry.guild_id] = self.usage.get(entry.guild_id, 0) - entry.size
+
+
+def attachment(data: bytes, file_name: str) -> discord.File:
+    """
+    A Discord attachment backed by bytes already in memory.
+    """
+    return discord.File(fp=io.BytesIO(data), filename=file_name)
+
+
+storage = StorageManager()
@@ -0,0 +1,99 @@
+"""
+Prefetching playback pipeline for the /talk loop
+"""
+
+import asyncio
+import logging
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+import discord
+from discord import FFmpegOpusAudio
+
+from ai_helpers import play_and_wait, speak_and_spell
+from db_utils import CommandContext
+
+logger = logging.getLogger(__name__)
+
+Utterance = Tuple[str, Path]
+
+talk_sessions: Dict[int, "TalkSession"] = {}  # guild_id -> running session
+
+
+class TalkSession:
+    """
+    One guild's /talk loop.
+
+    A producer keeps up to `prefetch` finished utterances (text plus audio file) in a bounded queue, so the next clip
+    is ready before the interval elapses. The consumer plays each clip to completion, posts it, then waits.
+    """
+
+    def __init__(
+        self,
+        client: discord.Client,
+        context: CommandContext,
+        channel: discord.abc.Messageable,
+        prompt: str,
+        interval: float,
+        prefetch: int = 2,
+    ) -> None:
+        self.client = client
+        self.context = context
+        self.channel = channel
+        self.prompt = prompt
+        self.interval = interval
+        self.queue: "asyncio.Queue[Union[Utterance, Exception]]" = asyncio.Queue(maxsize=max(prefetch, 1))
+        self.producer: Optional[asyncio.Task] = None
+        self.consumer: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        talk_sessions[self.context.guild_id] = self
+        self.producer = asyncio.create_task(self._produce(), name=f"talk-producer-{self.context.guild_id}")
+        self.consumer = asyncio.create_task(self._consume(), name=f"talk-consumer-{self.context.guild_id}")
+
+    def stop(self) -> None:
+        if talk_sessions.get(self.context.guild_id) is self:
+            del talk_sessions[self.context.guild_id]
+
+        for task in (self.producer, self.consumer):
+            if task and task is not asyncio.current_task():
+                task.cancel()
+
+    def _voice_client(self) -> Optional[discord.VoiceClient]:
+        return discord.utils.find(lambda vc: vc.guild.id == self.context.guild_id, self.client.voice_clients)
+
+    async def _produce(self) -> None:
+        while True:
+            try:
+                utterance = await speak_and_spell(context=self.context, prompt=self.prompt)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                await self.queue.put(e)
+                return
+
+            await self.queue.put(utterance)
+
+    async def _consume(self) -> None:
+        try:
+            while True:
+                item = await self.queue.get()
+
+                # check to see if a voice connection is still active
+                voice = self._voice_client()
+                if not voice:
+                    break
+
+                if isinstance(item, Exception):
+                    logger.error("Talk loop for guild %s stopped: %s", self.context.guild_id, item)
+                    await self.channel.send(content="The talk loop hit an error and stopped.")
+                    break
+
+                tts, file_path = item
+                await play_and_wait(voice, FFmpegOpusAudio(file_path))
+
+                # create our file object
+                discord_file = discord.File(fp=file_path, filename=file_path.name)
+
+                await self.channel.send(content=tts, file=discord_file)
+                await asyncio.sleep(self.interval)
+        finally:
+            self.stop()
@@ -0,0 +1,325 @@
+"""
+Durable background queue for /video generations
+"""
+
+import asyncio
+import logging
+from datetime import timedelta
+from typing import List, Optional
+
+import discord
+from discord import Embed
+from openai import APIError, BadRequestError, NotFoundError
+
+from ai_helpers import call_openai, construct_error_embed, get_openai_client, new_response
+from db_utils import (
+    CommandContext,
+    VideoJob,
+    add_credits,
+    create_video_job,
+    get_unfinished_video_jobs,
+    refund_credits,
+    settle_credits,
+    update_video_job,
+)
+from rate_limits import rate_limiter
+from resilience import CircuitOpenError
+from settings import get_settings
+from sharding import owns_guild
+from storage import storage
+
+logger = logging.getLogger(__name__)
+
+# how far back from an interrupted submission to look for the video it created, allowing for clock skew
+SUBMISSION_MATCH_SLACK = timedelta(minutes=2)
+
+
+def job_context(job: VideoJob) -> CommandContext:
+    """
+    Rebuild a CommandContext for a job so the usual helpers can be reused.
+    """
+    return CommandContext(
+        guild_id=job.guild_id,
+        user_id=job.user_id,
+        user=job.user,
+        command_name="video",
+        params={"job_id": job.id, "prompt": job.prompt, "model": job.model},
+    )
+
+
+class VideoJobQueue:
+    """
+    Persists /video requests and runs them on a bounded pool of workers.
+
+    Jobs are submitted to OpenAI, polled with backoff, downloaded, charged and posted back to the channel they came
+    from. Anything unfinished in the table is picked back up by start().
+    """
+
+    def __init__(self, client: discord.Client) -> None:
+        self.client = client
+        self.queue: "asyncio.Queue[VideoJob]" = asyncio.Queue()
+        self.workers: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        """
+        Re-queue unfinished jobs and spawn the workers.
+        """
+        for job in await get_unfinished_video_jobs():
+            # another shard process resumes jobs for guilds it owns
+            if not owns_guild(job.guild_id):
+                continue
+
+            logger.info("Resuming video job %s (%s)", job.id, job.status)
+            self.queue.put_nowait(job)
+
+        for number in range(get_settings().general.video_workers):
+            self.workers.append(asyncio.create_task(self._worker(), name=f"video-worker-{number}"))
+
+    async def stop(self) -> None:
+        """
+        Cancel the workers. In-flight jobs stay unfinished in the table and resume on the next start().
+        """
+        for worker in self.workers:
+            worker.cancel()
+
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers.clear()
+
+    async def submit(self, job: VideoJob) -> VideoJob:
+        """
+        Persist a new job and queue it for the workers.
+        """
+        job = await create_video_job(job)
+        self.queue.put_nowait(job)
+        return job
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.exception("Video job %s failed", job.id)
+                await self._fail(job, error=e)
+            finally:
+                self.queue.task_done()
+
+    async def _fail(self, job: VideoJob, error: Exception) -> None:
+        try:
+            if job.status == "completed":
+                # charged already and OpenAI billed the render; only posting it went wrong, so keep the charge
+                await update_video_job(job, error_code="delivery_failed", error_message=str(error))
+            else:
+                await self._mark_failed(job, error_code="internal_error", error_message=str(error))
+            await self._post_failure(job)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Could not report failure of video job %s", job.id)
+
+    async def _mark_failed(self, job: VideoJob, error_code: str, error_message: Optional[str]) -> None:
+        await update_video_job(job, status="failed", error_code=error_code, error_message=error_message)
+
+        if job.reservation_id is not None:
+            await refund_credits(reservation_id=job.reservation_id)
+
+    async def _run(self, job: VideoJob) -> None:
+        openai_client = await get_openai_client(guild_id=0)
+
+        if job.status == "submitting" and not await self._recover_submission(job):
+            return
+
+        if job.status == "queued":
+            if job.ai_director and not job.director_prompt:
+                instructions = get_settings().instructions["video"].format(seconds=job.seconds)
+                response = await new_response(context=job_context(job), instructions=instructions, prompt=job.prompt)
+                await update_video_job(job, director_prompt=response.output_text)
+
+            # videos run on the guild 0 key, so they share its rate limits; a repeated submission would be billed
+            # twice, so only rejected (429) submissions are retried. The guild 0 bucket is per process: with several
+            # shard processes each one spends the full [OPENAI_MODEL_LIMITS] budget, and only OpenAI's own 429s and
+            # rate-limit headers hold the total back
+            await update_video_job(job, status="submitting")
+            raw_response = await call_openai(
+                "videos.create",
+                model=job.model,
+                guild_id=0,
+                request=lambda: openai_client.videos.with_raw_response.create(
+                    prompt=job.director_prompt or job.prompt,
+                    model=job.model,
+                    seconds=job.seconds,
+                    size=job.size,
+                ),
+                idempotent=False,
+            )
+            rate_limiter.observe(guild_id=0, model=job.model, headers=raw_response.headers)
+            video_object = raw_response.parse()
+            await update_video_job(job, video_id=video_object.id, status="submitted")
+
+        video_object = await self._poll(job)
+
+        if video_object.status == "completed":
+            await self._post_success(job)
+        else:
+            error = video_object.error
+            await self._mark_failed(
+                job,
+                error_code=error.code if error else video_object.status,
+                error_message=error.message if error else None,
+            )
+            await self._post_failure(job)
+
+    async def _recover_submission(self, job: VideoJob) -> bool:
+        """
+        Settle a job whose last run stopped partway through videos.create, returning whether it can carry on.
+
+        The video is looked up among the most recent ones by model and prompt. If it never reached OpenAI (or
+        cannot be found) the job is failed and refunded rather than submitted, and billed, a second time.
+        """
+        prompt = job.director_prompt or job.prompt
+        since = (job.updated - SUBMISSION_MATCH_SLACK).timestamp()
+        openai_client = await get_openai_client(guild_id=0)
+
+        try:
+            page = await call_openai(
+                "videos.list",
+                model=job.model,
+                guild_id=0,
+                request=lambda: openai_client.videos.list(limit=100, order="desc"),
+                limit=False,
+            )
+            video = next(
+                (
+                    video
+                    for video in page.data
+                    if video.model == job.model and video.prompt == prompt and video.created_at >= since
+                ),
+                None,
+            )
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Could not list videos to recover job %s", job.id)
+            video = None
+
+        if video is not None:
+            logger.info("Video job %s was submitted as %s before the restart", job.id, video.id)
+            await update_video_job(job, video_id=video.id, status="submitted")
+            return True
+
+        await self._mark_failed(
+            job,
+            error_code="interrupted",
+            error_message="The bot restarted while submitting this video and could not find it at OpenAI.",
+        )
+        await self._post_failure(job)
+        return False
+
+    async def _poll(self, job: VideoJob):
+        """
+        Poll OpenAI until the video leaves the queue, backing off between checks.
+
+        The render carries on (and is billed) whatever happens here, so outages, throttling and an open circuit only
+        delay the next check; the job stays submitted until OpenAI says how the video itself ended.
+        """
+        settings = get_settings()
+        delay = settings.general.video_poll_seconds
+
+        while True:
+            # fetched every time, since a long render can outlive the client for a key that was replaced
+            openai_client = await get_openai_client(guild_id=0)
+            try:
+                video_object = await call_openai(
+                    "videos.retrieve",
+                    model=job.model,
+                    guild_id=0,
+                    request=lambda: openai_client.videos.retrieve(job.video_id),
+                    limit=False,
+                )
+            except (BadRequestError, NotFoundError):
+                # OpenAI doesn't know this video id, so waiting won't change the answer
+                raise
+            except (APIError, CircuitOpenError) as e:
+                logger.warning("Could not poll video job %s, checking again in %.0fs: %s", job.id, delay, e)
+            else:
+                if video_object.status not in ("queued", "in_progress"):
+                    return video_object
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.5, settings.general.video_poll_max_seconds)
+
+    async def _channel(self, job: VideoJob) -> discord.abc.Messageable:
+        await self.client.wait_until_ready()
+        return self.client.get_channel(job.channel_id) or await self.client.fetch_channel(job.channel_id)
+
+    async def _director_file(self, job: VideoJob, prefix: str = "") -> Optional[discord.File]:
+        if not job.director_prompt:
+            return None
+
+        text_file_name = f"{prefix}{job.model}-ai-director-prompt-{job.video_id}.txt"
+        return await storage.save(
+            context=job_context(job), file_name=text_file_name, data=job.director_prompt.encode("UTF-8")
+        )
+
+    async def _post_success(self, job: VideoJob) -> None:
+        openai_client = await get_openai_client(guild_id=0)
+
+        content = await call_openai(
+            "videos.download_content",
+            model=job.model,
+            guild_id=0,
+            request=lambda: openai_client.videos.download_content(job.video_id, variant="video"),
+            limit=False,
+        )
+        video_file_name = f"{job.model}-{job.video_id}.mp4"
+        files = [await storage.save(context=job_context(job), file_name=video_file_name, data=content.content)]
+
+        description_text = f"### User Input:\n> {job.prompt}"
+        if text_file := await self._director_file(job):
+            files.append(text_file)
+            description_text += "\n### AI Director:\n`True`"
+
+        # create our embed object
+        embed = Embed(
+            color=3426654,
+            title=f"`{job.model}` Video Generation",
+            description=description_text,
+        )
+
+        # keep the held credits on success
+        await update_video_job(job, status="completed")
+        if job.reservation_id is not None:
+            remaining_credits = await settle_credits(reservation_id=job.reservation_id)
+        else:
+            # queued before credit reservations existed
+            remaining_credits = await add_credits(user_id=job.user_id, num_credits=-job.cost)
+        embed.set_footer(text=f"{job.user} has {remaining_credits} B4NG AI credits remaining.")
+
+        channel = await self._channel(job)
+        await channel.send(content=f"<@{job.user_id}> video job `#{job.id}` is done.", embed=embed, files=files)
+
+    async def _post_failure(self, job: VideoJob) -> None:
+        charged = job.status == "completed"
+        failure_followup = {
+            "content": f"<@{job.user_id}> video job `#{job.id}` "
+            + ("was generated but could not be posted." if charged else "failed."),
+            "embed": construct_error_embed(
+                context=job_context(job),
+                user_input=job.prompt,
+                fields={
+                    "Error Type": f"`{job.error_code}`",
+                    "Error Message": job.error_message or "Unknown error",
+                    "Video ID": f"`{job.video_id}`",
+                    "Video Status": f"`{job.status}`",
+                    "Guidelines URL": (
+                        "https://platform.openai.com/docs/guides/video-generation#guardrails-and-restrictions"
+                    ),
+                    "Charged Credits": str(charged),
+                },
+            ),
+        }
+
+        # write text file with a failed name
+        if text_file := await self._director_file(job, prefix="FAILED-"):
+            failure_followup["file"] = text_file
+
+        channel = await self._channel(job)
+        await channel.send(**failure_followup)
@@ -0,0 +1,83 @@
+"""
+Concurrent credit reservations against a real SQLite file
+"""
+
+import asyncio
+import random
+import shutil
+import sys
+from pathlib import Path
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+
+BOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BOT_DIR / "src"))
+
+import pytest  # pylint: disable=wrong-import-position
+
+import db_utils  # pylint: disable=wrong-import-position
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    shutil.copy(BOT_DIR / "config.ini", tmp_path)
+    monkeypatch.chdir(tmp_path)
+
+    # SQLAlchemy resolves the relative database.db when the engine is created, so point a fresh one at tmp_path
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'database.db'}")
+    event.listen(engine.sync_engine, "connect", db_utils._set_sqlite_pragmas)  # pylint: disable=protected-access
+    monkeypatch.setattr(db_utils, "engine", engine)
+    return engine
+
+
+def test_concurrent_reservations_never_overdraw(engine):
+    async def scenario():
+        await db_utils.init_db()
+        await db_utils.add_credits(user_id=1, num_credits=100)
+
+        balances = []
+        done = asyncio.Event()
+
+        async def watch():
+            while not done.is_set():
+                balances.append(await db_utils.get_user_credits(1))
+                await asyncio.sleep(0)
+
+        watcher = asyncio.create_task(watch())
+        try:
+            reservations = await asyncio.gather(*(db_utils.reserve_credits(1, 3, guild_id=1) for _ in range(300)))
+        finally:
+            done.set()
+            await watcher
+
+        balance = await db_utils.get_user_credits(1)
+        await engine.dispose()
+        return reservations, balances, balance
+
+    reservations, balances, balance = asyncio.run(scenario())
+
+    assert sum(reservation is not None for reservation in reservations) == 33
+    assert balance == 1
+    assert balances and min(balances) >= 0
+
+
+def test_grants_interleaved_with_reservations_keep_every_debit(engine):
+    async def scenario():
+        await db_utils.init_db()
+        await db_utils.add_credits(user_id=1, num_credits=100)
+
+        calls = [db_utils.reserve_credits(1, 5, guild_id=1) for _ in range(60)]
+        calls += [db_utils.add_credits(user_id=1, num_credits=10) for _ in range(20)]
+        random.Random(0).shuffle(calls)
+        results = await asyncio.gather(*calls)
+
+        balance = await db_utils.get_user_credits(1)
+        await engine.dispose()
+        return results, balance
+
+    results, balance = asyncio.run(scenario())
+
+    reserved = sum(5 for result in results if isinstance(result, db_utils.CreditReservation))
+    assert reserved
+    assert balance == 100 + 20 * 10 - reserved
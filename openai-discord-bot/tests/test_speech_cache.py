@@ -0,0 +1,51 @@
+"""
+Speech cache transcoding, with a real ffmpeg
+"""
+
+import asyncio
+import shutil
+import sys
+import wave
+from pathlib import Path
+
+import pytest
+
+BOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BOT_DIR / "src"))
+
+from speech_cache import SpeechCache  # pylint: disable=wrong-import-position
+
+pytestmark = pytest.mark.skipif(not shutil.which("ffmpeg"), reason="needs ffmpeg")
+
+
+def test_cold_wavs_are_transcoded(tmp_path, monkeypatch):
+    shutil.copy(BOT_DIR / "config.ini", tmp_path)
+    monkeypatch.chdir(tmp_path)
+    cache = SpeechCache(directory=tmp_path / "speech_cache")
+
+    keys = [cache.key(text=text, voice="onyx", model="tts-1", file_format="wav") for text in ("cold", "warm")]
+    for key in keys:
+        temp_path = cache.temp_path(key)
+        with wave.open(str(temp_path), "wb") as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(24000)
+            wav_file.writeframes(bytes(48000))
+        cache.add(key, temp_path)
+
+    cold, warm = keys
+    cache.used[cold] = 0
+    wav_size = cache.index[cold]
+
+    assert asyncio.run(cache.transcode_cold()) == 1
+
+    path = cache.get(cold)
+    assert path.name == f"{cold}.opus"
+    assert cache.index[cold] == path.stat().st_size < wav_size
+    assert not (tmp_path / "speech_cache" / cold).exists()
+    assert cache.get(warm).name == warm
+    assert cache.total_bytes == sum(cache.index.values())
+
+    # a restart finds the transcoded file under the same key
+    reloaded = SpeechCache(directory=tmp_path / "speech_cache")
+    assert reloaded.get(cold) == path
@@ -0,0 +1,97 @@
+"""
+Storage backends, with S3 served by moto
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+BOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BOT_DIR / "src"))
+
+import storage  # pylint: disable=wrong-import-position
+from speech_cache import SpeechCache  # pylint: disable=wrong-import-position
+from storage import MULTIPART_CHUNK_BYTES, S3Backend, StorageBackend  # pylint: disable=wrong-import-position
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+
+def test_backend_must_implement_write_and_delete():
+    class WriteOnly(StorageBackend):  # pylint: disable=abstract-method
+        async def write(self, key, data):
+            pass
+
+    with pytest.raises(TypeError):
+        WriteOnly()  # pylint: disable=abstract-class-instantiated
+
+
+def test_s3_backend_writes_and_deletes(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+
+    with moto.mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="bot-content")
+        backend = S3Backend(bucket="bot-content", prefix="bot/", region="us-east-1")
+
+        small = b"\x89PNG small"
+        large = bytes(MULTIPART_CHUNK_BYTES * 2 + 1)  # uploaded in three parts
+        many = [f"generated_content/guild_1/bulk/{number}.txt" for number in range(1001)]
+
+        async def scenario():
+            await backend.write("generated_content/guild_1/a.png", small)
+            await backend.write("generated_content/guild_1/b.mp4", large)
+            await asyncio.gather(*(backend.write(key, b"x") for key in many))
+            stored = {obj["Key"]: obj["Size"] for obj in _list(s3)}
+
+            # more than one DeleteObjects call's worth of keys
+            await backend.delete(["generated_content/guild_1/a.png", *many, "generated_content/missing.png"])
+            return stored, {obj["Key"] for obj in _list(s3)}
+
+        stored, remaining = asyncio.run(scenario())
+
+        assert stored["bot/generated_content/guild_1/a.png"] == len(small)
+        assert stored["bot/generated_content/guild_1/b.mp4"] == len(large)
+        assert len(stored) == 1003
+        assert remaining == {"bot/generated_content/guild_1/b.mp4"}
+
+        head = s3.head_object(Bucket="bot-content", Key="bot/generated_content/guild_1/b.mp4")
+        assert head["ETag"].strip('"').endswith("-3")  # multipart ETags end in the part count
+
+
+def test_speech_cache_mirrors_to_s3(tmp_path, monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setattr(SpeechCache, "max_bytes", 10)
+
+    with moto.mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="bot-content")
+        monkeypatch.setattr(storage.storage, "_backend", S3Backend(bucket="bot-content", region="us-east-1"))
+        cache = SpeechCache(directory=tmp_path / "speech_cache")
+
+        async def scenario():
+            for text in ("first", "second"):
+                key = cache.key(text=text, voice="onyx", model="tts-1", file_format="wav")
+                temp_path = cache.temp_path(key)
+                temp_path.write_bytes(b"RIFF" + bytes(4))
+                cache.add(key, temp_path)
+            await cache.stop()
+            return key
+
+        key = asyncio.run(scenario())
+
+        # the first clip was evicted to stay under max_bytes, locally and in the bucket
+        assert {obj["Key"] for obj in _list(s3)} == {(tmp_path / "speech_cache" / key).as_posix()}
+        assert [path.name for path in (tmp_path / "speech_cache").iterdir()] == [key]
+
+
+def _list(s3):
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket="bot-content"):
+        yield from page.get("Contents", [])